@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class CartConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cart'
+
+    def ready(self):
+        # Stock counters are shared by every cart, so the cart scripts can't
+        # reach them from a cart's slot
+        if settings.STOCK_RESERVATIONS and settings.REDIS_MODE == "cluster":
+            raise ImproperlyConfigured(
+                "STOCK_RESERVATIONS is not supported with REDIS_MODE = 'cluster'"
+            )
+        if settings.CART_PERSISTENCE and settings.REDIS_MODE == "cluster":
+            raise ImproperlyConfigured(
+                "CART_PERSISTENCE is not supported with REDIS_MODE = 'cluster'"
+            )
+
+        from . import signals  # noqa: F401
+        from .redis_cart import load_scripts
+
+        load_scripts()
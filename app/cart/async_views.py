@@ -0,0 +1,239 @@
+# async_views.py
+#
+# Async versions of the cart endpoints for ASGI servers. Redis calls are
+# awaited on the shared redis.asyncio pool, so one worker can keep thousands
+# of cart requests in flight instead of one per thread.
+#
+# DRF's APIView is sync only, so these are plain Django views that reuse the
+# DRF serializers for validation, the throttle classes and the CSRF check of
+# SessionAuthentication.
+import math
+
+import orjson
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException, Throttled, UnsupportedMediaType
+
+from core.renderers import ORJSONResponse
+from inventory.catalog import aget_products
+
+from .idempotency import aidempotent
+from .owners import acart_id
+from .promotions import avalidate as avalidate_promo
+from .redis_cart import InsufficientStock
+from .redis_cart_async import (
+    add_to_cart,
+    apply_batch,
+    get_cart_lines,
+    get_cart_summary,
+    get_cart_totals,
+    remove_from_cart,
+    clear_cart,
+    increment_quantity,
+    decrement_quantity,
+    set_quantity,
+    set_cart_promo_code,
+)
+from .serializer import (
+    AddToCartSerializer,
+    RemoveFromCartSerializer,
+    UpdateQuantitySerializer,
+    SetQuantitySerializer,
+    CartPromoSerializer,
+    CartBatchSerializer,
+)
+from .views import merge_batch_results, split_unknown_products
+
+
+def out_of_stock():
+    return ORJSONResponse({"error": "Not enough stock."}, status=409)
+
+
+class InvalidPayload(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+
+
+# Exempt from the CSRF middleware, which would also reject anonymous carts,
+# and checked in dispatch() for signed in users like the DRF views do
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncCartAPIView(View):
+    throttle_classes = ()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            # Before the payload is parsed, like APIView.initial()
+            if (await request.auser()).is_authenticated:
+                SessionAuthentication().enforce_csrf(request)
+            for throttle_class in self.throttle_classes:
+                throttle = throttle_class()
+                if not await throttle.aallow_request(request, self):
+                    return self.throttled(throttle.wait())
+            return await super().dispatch(request, *args, **kwargs)
+        except InvalidPayload as exc:
+            return ORJSONResponse(exc.errors, status=400)
+        except APIException as exc:
+            return ORJSONResponse({"detail": exc.detail}, status=exc.status_code)
+
+    def throttled(self, wait):
+        response = ORJSONResponse({"detail": Throttled(wait).detail}, status=429)
+        if wait is not None:
+            response["Retry-After"] = str(math.ceil(wait))
+        return response
+
+    def validate(self, request, serializer_class):
+        # JSON only: a form or text/plain body could be posted cross-site
+        if request.body and request.content_type != "application/json":
+            raise UnsupportedMediaType(request.content_type)
+        try:
+            data = orjson.loads(request.body or b"{}")
+        except orjson.JSONDecodeError:
+            raise InvalidPayload({"detail": "JSON parse error."})
+
+        serializer = serializer_class(data=data)
+        if not serializer.is_valid():
+            raise InvalidPayload(serializer.errors)
+        return serializer.validated_data
+
+
+class AsyncCartView(AsyncCartAPIView):
+    async def get(self, request):
+        return ORJSONResponse(await get_cart_summary(await acart_id(request)))
+
+    @aidempotent
+    async def delete(self, request):
+        await clear_cart(await acart_id(request))
+        return HttpResponse(status=204)
+
+
+class AsyncCartTotalsView(AsyncCartAPIView):
+    async def get(self, request):
+        return ORJSONResponse(await get_cart_totals(await acart_id(request)))
+
+
+class AsyncAddToCartView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        session_id = await acart_id(request, create=True)
+
+        data = self.validate(request, AddToCartSerializer)
+
+        if not await aget_products([data["product_id"]]):
+            return ORJSONResponse({"error": "Product not found."}, status=404)
+
+        try:
+            await add_to_cart(
+                session_id, product_id=data["product_id"], quantity=data["quantity"]
+            )
+        except InsufficientStock:
+            return out_of_stock()
+
+        return ORJSONResponse({"message": "Added to cart."})
+
+
+class AsyncRemoveFromCartView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        data = self.validate(request, RemoveFromCartSerializer)
+        await remove_from_cart(await acart_id(request), data["product_id"])
+        return HttpResponse(status=204)
+
+
+class AsyncUpdateQuantityView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        data = self.validate(request, UpdateQuantitySerializer)
+        session_id = await acart_id(request)
+
+        if data["action"] == "inc":
+            try:
+                await increment_quantity(session_id, data["product_id"])
+            except InsufficientStock:
+                return out_of_stock()
+        else:
+            await decrement_quantity(session_id, data["product_id"])
+
+        return HttpResponse(status=204)
+
+
+class AsyncSetQuantityView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        data = self.validate(request, SetQuantitySerializer)
+        product_id, quantity = data["product_id"], data["quantity"]
+
+        try:
+            updated = await set_quantity(await acart_id(request), product_id, quantity)
+        except InsufficientStock:
+            return out_of_stock()
+        if not updated:
+            return ORJSONResponse({"error": "Product not found in cart."}, status=404)
+
+        return ORJSONResponse({"message": f"Product quantity updated to {quantity}."})
+
+
+class AsyncCartPromoView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        data = self.validate(request, CartPromoSerializer)
+        rule = await avalidate_promo(data["promo_code"])
+        if rule is None:
+            return ORJSONResponse({"error": "Invalid promo code."}, status=400)
+        await set_cart_promo_code(await acart_id(request), rule.code)
+        return ORJSONResponse({"message": "Promo code applied"})
+
+
+class AsyncCartBatchView(AsyncCartAPIView):
+    @aidempotent
+    async def post(self, request):
+        session_id = await acart_id(request, create=True)
+
+        operations = self.validate(request, CartBatchSerializer)["operations"]
+
+        added = {op["product_id"] for op in operations if op["op"] == "add"}
+        valid, rejected = split_unknown_products(operations, await aget_products(added))
+
+        applied = await apply_batch(session_id, valid)
+        results = merge_batch_results(operations, applied, rejected)
+        return ORJSONResponse({"results": results})
+
+
+class AsyncCheckoutPromoView(AsyncCartAPIView):
+    async def post(self, request):
+        session_id = await acart_id(request)
+        lines = await get_cart_lines(session_id)
+
+        if not lines:
+            return ORJSONResponse([])
+
+        products = await aget_products(lines)
+
+        cleaned_cart = []
+        stale = []
+
+        for product_id, quantity in lines.items():
+            product = products.get(product_id)
+
+            if not product:
+                stale.append({"op": "remove", "product_id": product_id})
+                continue
+
+            cleaned_cart.append(
+                {
+                    "product_id": product_id,
+                    "name": product["name"],
+                    "price": product["price"],
+                    "quantity": quantity,
+                    "valid": True,
+                    "error": "",
+                }
+            )
+
+        # All corrections go out in one scripted call, whatever the cart size
+        if stale:
+            await apply_batch(session_id, stale)
+
+        return ORJSONResponse(cleaned_cart)
@@ -0,0 +1,109 @@
+# expiry.py
+#
+# Index of cart activity, so idle carts can be found without a SCAN over
+# cart:*, and the sweeper that reports them on a stream.
+#
+#   carts:touched        zset    session_id -> time of the last cart change,
+#                                maintained by the cart scripts (touch())
+#   carts:touched:users  zset    the same for user carts, which expire later
+#   carts:events         stream  {event, session_id, touched_at}
+#                                event is "abandoned" once a cart has been
+#                                idle for CART_ABANDONED_AFTER, "expired" once
+#                                its TTL ran out
+#   carts:sweep          hash    cursor of the abandoned sweep, and
+#   carts:sweep:users            of the one over the user carts
+#
+# Consumers read the stream (XREAD, or XREADGROUP for a group of workers), and
+# ZRANGEBYSCORE on the index lists the carts active in any time window, both
+# in O(log N) per batch. In cluster mode the keys share the {carts} hash tag.
+import time
+
+from django.conf import settings
+
+from core.redis_client import get_redis, hash_tag
+
+from . import lua_scripts
+from .owners import is_user_cart
+
+r = get_redis()
+
+TOUCHED_KEY = f"{hash_tag('carts')}:touched"
+EVENTS_KEY = f"{hash_tag('carts')}:events"
+SWEEP_CURSOR_KEY = f"{hash_tag('carts')}:sweep"
+USER_TOUCHED_KEY = f"{TOUCHED_KEY}:users"
+USER_SWEEP_CURSOR_KEY = f"{SWEEP_CURSOR_KEY}:users"
+
+_sweep_expired = r.register_script(lua_scripts.SWEEP_EXPIRED)
+_sweep_abandoned = r.register_script(lua_scripts.SWEEP_ABANDONED)
+
+
+def index_key(session_id):
+    return USER_TOUCHED_KEY if is_user_cart(session_id) else TOUCHED_KEY
+
+
+def record_touch(session_id):
+    # Cluster mode only: the cart scripts can't reach the index there
+    r.zadd(index_key(session_id), {session_id: time.time()})
+
+
+def record_clear(session_id):
+    r.zrem(index_key(session_id), session_id)
+
+
+def sweep_expired(batch_size):
+    """
+    Pop every cart idle for longer than its TTL (CART_TTL, CART_USER_TTL),
+    batch_size per script call, and give back the stock they were holding.
+    """
+    from .redis_cart import release_holds
+
+    total = 0
+    for key, ttl in (
+        (TOUCHED_KEY, settings.CART_TTL),
+        (USER_TOUCHED_KEY, settings.CART_USER_TTL),
+    ):
+        while True:
+            popped = _sweep_expired(
+                keys=[key, EVENTS_KEY],
+                args=[ttl, batch_size, settings.CART_EVENTS_MAXLEN],
+            )
+            if settings.STOCK_RESERVATIONS:
+                release_holds(popped)
+            total += len(popped)
+            if len(popped) < batch_size:
+                break
+    return total
+
+
+def sweep_abandoned(batch_size):
+    """Report the carts that went idle since the last sweep."""
+    total = 0
+    for key, cursor_key in (
+        (TOUCHED_KEY, SWEEP_CURSOR_KEY),
+        (USER_TOUCHED_KEY, USER_SWEEP_CURSOR_KEY),
+    ):
+        while True:
+            emitted = _sweep_abandoned(
+                keys=[key, EVENTS_KEY, cursor_key],
+                args=[
+                    settings.CART_ABANDONED_AFTER,
+                    batch_size,
+                    settings.CART_EVENTS_MAXLEN,
+                ],
+            )
+            total += emitted
+            if emitted < batch_size:
+                break
+    return total
+
+
+def sweep(batch_size=None):
+    """
+    Run both sweeps and return {"expired": n, "abandoned": n}. Expired carts go
+    first so a cart past its TTL is never also reported as abandoned.
+    """
+    batch_size = batch_size or settings.CART_SWEEP_BATCH
+    return {
+        "expired": sweep_expired(batch_size),
+        "abandoned": sweep_abandoned(batch_size),
+    }
@@ -0,0 +1,210 @@
+# idempotency.py
+#
+# Idempotency-Key support for the cart mutation endpoints, so clients can
+# retry or hedge a request without applying it twice.
+#
+#   cart:{sid}:idempotency:<key>  string  "<fingerprint> <JSON script result>"
+#                                         "\n<status> <JSON body>"
+#                                         for CART_IDEMPOTENCY_TTL
+#
+# A request carrying the header runs its cart script in the idempotent
+# variant (lua_scripts.IDEMPOTENT_*): the script's result is stored with the
+# change, in the same atomic call, and the view's response is added to it
+# once built. A repeat of the request gets the stored response back, marked
+# with Idempotent-Replayed: true, before the view validates or looks up
+# anything. A repeat arriving before the response is stored gets the script
+# result back from the script instead of running it again, and the view
+# builds the same response from it. Concurrent copies of a request are
+# serialized by Redis, so only one applies. The key is scoped to the cart and
+# tied to a fingerprint of the request; reusing it for a different request
+# is a 422.
+#
+# The request state is kept in a ContextVar, so it follows the view into the
+# cart functions (sync and async) without changing their signatures.
+import functools
+import hashlib
+import json
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.http.request import RawPostDataException
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from core.redis_async import get_async_redis
+from core.redis_client import get_redis, hash_tag
+from core.renderers import render_json
+
+from .lua_scripts import IDEMPOTENT_OPS
+from .owners import acart_id, cart_id
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+_current = ContextVar("idempotency", default=None)
+
+
+class InvalidIdempotencyKey(APIException):
+    status_code = 400
+    default_detail = f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} printable characters."
+    default_code = "invalid_idempotency_key"
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = 422
+    default_detail = "This Idempotency-Key was used for a different request."
+    default_code = "idempotency_key_reused"
+
+
+class _Request:
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.claimed = False
+        self.replayed = False
+        self.storage_key = None  # set when a cart script claims the request
+        self.stored = None  # what the script stored, without the response
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # A form post the CSRF check already read: its parsed fields instead
+        digest.update(render_json(sorted(request.POST.lists())))
+    return digest.hexdigest()[:32]
+
+
+def _storage_key(session_id, key):
+    return f"cart:{hash_tag(session_id)}:idempotency:{key}"
+
+
+def _begin(request):
+    key = request.META.get(HEADER)
+    if key is None:
+        return None, None
+    if not 0 < len(key) <= MAX_KEY_LENGTH or not key.isprintable():
+        raise InvalidIdempotencyKey()
+    state = _Request(key, _fingerprint(request))
+    return state, _current.set(state)
+
+
+def _mark(state, response):
+    if state.replayed:
+        response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def _stored_response(state, stored):
+    """(status, JSON body) of a stored response, or None if there is none yet."""
+    if stored is None:
+        return None
+    line, _, response = stored.partition("\n")
+    if line.split(" ", 1)[0] != state.fingerprint:
+        raise IdempotencyKeyReused()
+    if not response:
+        return None
+    status, body = response.split(" ", 1)
+    state.replayed = True
+    return int(status), body
+
+
+def _response_to_store(state, status, body):
+    # Only for the request that ran the script: a replay finds it stored
+    if state.stored is None or state.replayed:
+        return None
+    return f"{state.stored}\n{status} {body}"
+
+
+def idempotent(handler):
+    """Honour the Idempotency-Key header on a cart view method."""
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        state, token = _begin(request)
+        if state is None:
+            return handler(view, request, *args, **kwargs)
+        try:
+            session_id = cart_id(request)
+            key = session_id and _storage_key(session_id, state.key)
+            stored = _stored_response(state, key and get_redis().get(key))
+            if stored is not None:
+                status, body = stored
+                data = json.loads(body) if body else None
+                return _mark(state, Response(data, status=status))
+
+            response = handler(view, request, *args, **kwargs)
+            body = "" if response.data is None else render_json(response.data).decode()
+            value = _response_to_store(state, response.status_code, body)
+            if value is not None:
+                get_redis().set(state.storage_key, value, xx=True, keepttl=True)
+            return _mark(state, response)
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+def aidempotent(handler):
+    """idempotent() for the async cart views."""
+
+    @functools.wraps(handler)
+    async def wrapper(view, request, *args, **kwargs):
+        state, token = _begin(request)
+        if state is None:
+            return await handler(view, request, *args, **kwargs)
+        try:
+            session_id = await acart_id(request)
+            key = session_id and _storage_key(session_id, state.key)
+            stored = _stored_response(state, key and await get_async_redis().get(key))
+            if stored is not None:
+                status, body = stored
+                response = HttpResponse(body, status=status)
+                if body:
+                    response["Content-Type"] = "application/json"
+                return _mark(state, response)
+
+            response = await handler(view, request, *args, **kwargs)
+            value = _response_to_store(state, response.status_code, response.content.decode())
+            if value is not None:
+                await get_async_redis().set(state.storage_key, value, xx=True, keepttl=True)
+            return _mark(state, response)
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+def claim(name):
+    """
+    The request state if the cart script `name` should run idempotently: the
+    first mutation of a request with an Idempotency-Key, None otherwise.
+    """
+    state = _current.get()
+    if state is None or state.claimed or name not in IDEMPOTENT_OPS:
+        return None
+    state.claimed = True
+    return state
+
+
+def script_args(state, session_id, keys, args):
+    """KEYS and ARGV of the idempotent variant of a cart script."""
+    state.storage_key = _storage_key(session_id, state.key)
+    return (
+        [*keys, state.storage_key],
+        [*args, state.fingerprint, settings.CART_IDEMPOTENCY_TTL],
+    )
+
+
+def result(state, reply):
+    """The script result from an idempotent variant's {replayed, stored} reply."""
+    replayed, stored = reply
+    state.stored = stored.partition("\n")[0]
+    fingerprint, encoded = state.stored.split(" ", 1)
+    if fingerprint != state.fingerprint:
+        raise IdempotencyKeyReused()
+    state.replayed = bool(replayed)
+    return json.loads(encoded)
@@ -0,0 +1,801 @@
+# lua_scripts.py
+#
+# Server-side cart scripts. Each cart operation is one EVALSHA: one round trip
+# per call, atomic against concurrent requests on the same cart, and the TTL
+# refresh happens inside the same script.
+#
+# Carts only hold product_id -> quantity. Product name and price are resolved
+# from the shared catalog cache (inventory.catalog) when the cart is read.
+# Next to the lines, the cart hash keeps running totals (see TOTALS_PRELUDE),
+# adjusted by each line operation from the unit price the caller passes in.
+#
+# The line operations (add, remove, inc, dec, set) are defined once per layout
+# as Lua functions returning 1 if the line was changed, 0 if it wasn't (no
+# such line) and -1 if there isn't enough stock, so the single-op scripts and
+# the batch script share them.
+#
+# After the cart keys come the session key, whose TTL is refreshed along with
+# the cart (to SESSION_TTL: a user cart lives longer than a session), the
+# last-touch index (cart.expiry), which touch() keeps up to
+# date, the write-behind queue and restore marker (cart.persistence) and the
+# stock hold keys (inventory.stock). ARGV[1] is always the cart TTL, the operation specific
+# arguments follow.
+
+
+# Prepended to the layout prelude by the caller: whether changed carts are
+# queued for the write-behind persister (CART_PERSISTENCE), and the TTL the
+# session key is refreshed to (SESSION_COOKIE_AGE)
+SETTINGS_PRELUDE = "local PERSIST, SESSION_TTL = %s, %d\n"
+
+
+# Shared by both preludes. The index and queue keys are left out in cluster
+# mode, where they live in another slot; the caller updates the index there.
+# Members are cart ids (cart.owners), which the layout preludes take from
+# the cart key.
+INDEX_PRELUDE = """
+local function index(index_key, member, alive)
+    if not index_key then
+        return
+    end
+    if alive then
+        local now = redis.call('TIME')
+        redis.call('ZADD', index_key, now[1] + now[2] / 1000000, member)
+    else
+        redis.call('ZREM', index_key, member)
+    end
+end
+
+-- Only user carts are written to Postgres: an anonymous cart is found by its
+-- session, which lives in Redis too and is lost along with it.
+local function is_user_cart(member)
+    return string.sub(member, 1, #'user:') == 'user:'
+end
+
+-- The first change since the cart was last written to Postgres queues it on
+-- the changes stream; every change bumps its version in the dirty hash, so
+-- the persister can tell whether what it wrote is still the latest state.
+local function changed(changes_key, dirty_key, member)
+    if not PERSIST or not changes_key or not is_user_cart(member) then
+        return
+    end
+    if redis.call('HINCRBY', dirty_key, member, 1) == 1 then
+        redis.call('XADD', changes_key, '*', 'session_id', member)
+    end
+end
+"""
+
+# Stock holds, formatted with the position of the first stock key. The keys
+# are left out when STOCK_RESERVATIONS is off; products whose stock isn't
+# tracked have no stock:available entry and are never limited.
+STOCK_PRELUDE = """
+local STOCK_FIRST = %(first)d
+local holds_key, available_key = KEYS[%(first)d], KEYS[%(first)d + 1]
+local reserved_key, holders_key = KEYS[%(first)d + 2], KEYS[%(first)d + 3]
+local OUT_OF_STOCK = -1
+
+-- Hold delta more units of pid for this cart, or give units back when delta
+-- is negative. Returns false if there aren't enough units left.
+local function hold(pid, delta)
+    if not holds_key or delta == 0 then
+        return true
+    end
+    if delta > 0 then
+        local available = redis.call('HGET', available_key, pid)
+        if not available then
+            return true
+        end
+        if tonumber(available) < delta then
+            return false
+        end
+    else
+        -- Only what this cart actually holds goes back
+        local held = tonumber(redis.call('HGET', holds_key, pid) or 0)
+        delta = -math.min(-delta, held)
+        if delta == 0 then
+            return true
+        end
+    end
+    if redis.call('HEXISTS', available_key, pid) == 1 then
+        redis.call('HINCRBY', available_key, pid, -delta)
+    end
+    redis.call('HINCRBY', reserved_key, pid, delta)
+    if redis.call('HINCRBY', holds_key, pid, delta) <= 0 then
+        redis.call('HDEL', holds_key, pid)
+    end
+    return true
+end
+
+local function release_all()
+    if not holds_key then
+        return
+    end
+    local holds = redis.call('HGETALL', holds_key)
+    for i = 1, #holds, 2 do
+        hold(holds[i], -tonumber(holds[i + 1]))
+    end
+end
+
+-- The holders set lists the carts with holds, so the ones left behind by
+-- expired carts can be found and released (cart.redis_cart.release_holds)
+local function update_holders(member)
+    if not holds_key then
+        return
+    end
+    if redis.call('EXISTS', holds_key) == 1 then
+        redis.call('SADD', holders_key, member)
+    else
+        redis.call('SREM', holders_key, member)
+    end
+end
+"""
+
+
+# Running totals, kept in the hash that holds the lines (totals_key, set by
+# the layout prelude) under fields the line parsers skip:
+#
+#   _items        units in the cart
+#   _subtotal     sum of quantity * unit price, in cents
+#   _rev          bumped on every change to the lines or the promo code
+#   _discount     promo discount in cents, valid while _discount_rev == _rev
+#                 and _discount_ver is the current promo rules version
+#   _catalog      catalog version (inventory.catalog) the totals were last
+#                 checked against, set by reprice
+#
+# The subtotal uses the price passed with each operation, so it drifts when a
+# price changes (a line can be added at one price and removed at another).
+# It is only trusted while _catalog is the current catalog version;
+# cart.redis_cart recomputes it on the next full read otherwise (reprice).
+TOTALS_PRELUDE = """
+local ITEMS, SUBTOTAL, REV = '_items', '_subtotal', '_rev'
+local DISCOUNT, DISCOUNT_REV, DISCOUNT_VER = '_discount', '_discount_rev', '_discount_ver'
+local CATALOG = '_catalog'
+local META = {'_promo', ITEMS, SUBTOTAL, REV, DISCOUNT, DISCOUNT_REV, DISCOUNT_VER, CATALOG}
+
+local function line_count()
+    local count = redis.call('HLEN', totals_key)
+    for _, field in ipairs(META) do
+        count = count - redis.call('HEXISTS', totals_key, field)
+    end
+    return count
+end
+
+-- Called before the lines change. Carts written before the totals existed
+-- are left alone until a read fills them in.
+local function adjust(units, price)
+    if redis.call('HEXISTS', totals_key, ITEMS) == 0 and line_count() > 0 then
+        return
+    end
+    redis.call('HINCRBY', totals_key, ITEMS, units)
+    redis.call('HINCRBY', totals_key, SUBTOTAL, units * price)
+end
+
+local function bump()
+    if redis.call('EXISTS', totals_key) == 1 then
+        redis.call('HINCRBY', totals_key, REV, 1)
+    end
+end
+"""
+
+
+# Merges a cart (the anonymous one, on login) into this one. Its keys follow
+# this cart's own, from KEYS[ARGV[3]]: its cart keys in the layout order, then
+# its stock holds key when reservations are on, then its last-touch index
+# (cart.expiry) when this cart has one. Quantities of the same
+# product add up, the running totals are carried over and the stock held for
+# the source lines moves to this cart, so no unit is reserved twice.
+#
+# ARGV = ttl, source cart id, position of the first source key
+MERGE_PRELUDE = """
+local source_id, first = ARGV[2], tonumber(ARGV[3])
+local source_index = index_key and KEYS[#KEYS]
+-- This cart's key list is shorter without reservations: what the prelude
+-- read from the stock positions belongs to the source
+if first <= STOCK_FIRST then
+    holds_key, available_key, reserved_key, holders_key = nil, nil, nil, nil
+end
+
+local META_FIELDS = {}
+for _, field in ipairs(META) do
+    META_FIELDS[field] = true
+end
+
+-- Adds the source lines (HGETALL fields) to this cart's. Returns the number
+-- of lines merged and the promo code found among the fields (compact).
+local function merge_lines(fields, source_holds)
+    local has_totals = redis.call('HEXISTS', totals_key, ITEMS) == 1 or line_count() == 0
+    local source_totals, promo, merged = {}, nil, 0
+    for i = 1, #fields, 2 do
+        local field, value = fields[i], fields[i + 1]
+        if field == '_promo' then
+            promo = value
+        elseif META_FIELDS[field] then
+            source_totals[field] = value
+        else
+            local quantity = tonumber(string.match(value, '^%d+'))
+            local current = redis.call('HGET', totals_key, field)
+            if current then
+                quantity = quantity + tonumber(string.match(current, '^%d+'))
+            end
+            redis.call('HSET', totals_key, field, quantity)
+            merged = merged + 1
+        end
+    end
+    if merged == 0 then
+        -- An expired source cart: its holds are released by the sweeper
+        return 0, promo
+    end
+
+    if has_totals and source_totals[ITEMS] then
+        redis.call('HINCRBY', totals_key, ITEMS, source_totals[ITEMS])
+        redis.call('HINCRBY', totals_key, SUBTOTAL, source_totals[SUBTOTAL] or 0)
+        -- Priced at different catalog versions: the sum isn't trusted
+        if (source_totals[CATALOG] or false) ~= redis.call('HGET', totals_key, CATALOG) then
+            redis.call('HDEL', totals_key, CATALOG)
+        end
+    else
+        -- One side predates the totals: the next full read recomputes them
+        redis.call('HDEL', totals_key, ITEMS, SUBTOTAL)
+    end
+    if source_holds then
+        local holds = redis.call('HGETALL', source_holds)
+        for i = 1, #holds, 2 do
+            redis.call('HINCRBY', holds_key, holds[i], holds[i + 1])
+        end
+        redis.call('DEL', source_holds)
+        redis.call('SREM', holders_key, source_id)
+    end
+    if source_index then
+        redis.call('ZREM', source_index, source_id)
+    end
+    changed(changes_key, dirty_key, source_id)
+    return merged, promo
+end
+"""
+
+
+# Split layout
+#
+#   cart:{sid}:qty         hash  product_id -> quantity, plus the totals
+#   cart:{sid}:promo_code  string
+#
+# KEYS = qty hash, details hash (old carts only, deleted on clear), promo
+#        string, session, index, changes stream, dirty hash, restore marker,
+#        stock holds
+SPLIT_PRELUDE = INDEX_PRELUDE + STOCK_PRELUDE % {"first": 9} + """
+local qty_key, details_key, promo_key = KEYS[1], KEYS[2], KEYS[3]
+local session_key, index_key = KEYS[4], KEYS[5]
+local changes_key, dirty_key, restored_key = KEYS[6], KEYS[7], KEYS[8]
+local live_keys = {qty_key, promo_key}
+local cart_id = string.sub(qty_key, #'cart:' + 1, -#':qty' - 1)
+local totals_key = qty_key
+local ttl = tonumber(ARGV[1])
+""" + TOTALS_PRELUDE + """
+local function touch()
+    bump()
+    local alive = redis.call('EXPIRE', qty_key, ttl) == 1
+    redis.call('EXPIRE', promo_key, ttl)
+    redis.call('EXPIRE', session_key, SESSION_TTL)
+    index(index_key, cart_id, alive)
+    changed(changes_key, dirty_key, cart_id)
+    update_holders(cart_id)
+end
+
+local OPS = {}
+
+function OPS.add(pid, quantity, price)
+    if not hold(pid, quantity) then
+        return OUT_OF_STOCK
+    end
+    adjust(quantity, price)
+    redis.call('HINCRBY', qty_key, pid, quantity)
+    return 1
+end
+
+function OPS.remove(pid, _, price)
+    local current = tonumber(redis.call('HGET', qty_key, pid) or 0)
+    hold(pid, -current)
+    adjust(-current, price)
+    redis.call('HDEL', qty_key, pid)
+    if line_count() == 0 then
+        redis.call('DEL', qty_key, promo_key)
+    end
+    return 1
+end
+
+function OPS.inc(pid, step, price)
+    if redis.call('HEXISTS', qty_key, pid) == 0 then
+        return 0
+    end
+    if not hold(pid, step) then
+        return OUT_OF_STOCK
+    end
+    adjust(step, price)
+    redis.call('HINCRBY', qty_key, pid, step)
+    return 1
+end
+
+function OPS.dec(pid, step, price)
+    local current = redis.call('HGET', qty_key, pid)
+    if not current then
+        return 0
+    end
+    local new_qty = tonumber(current) - step
+    if new_qty < 1 then
+        hold(pid, -tonumber(current))
+        adjust(-tonumber(current), price)
+        redis.call('HDEL', qty_key, pid)
+        if line_count() == 0 then
+            redis.call('DEL', qty_key, promo_key)
+        end
+    else
+        hold(pid, -step)
+        adjust(-step, price)
+        redis.call('HSET', qty_key, pid, new_qty)
+    end
+    return 1
+end
+
+function OPS.set(pid, quantity, price)
+    local current = redis.call('HGET', qty_key, pid)
+    if not current then
+        return 0
+    end
+    if not hold(pid, quantity - tonumber(current)) then
+        return OUT_OF_STOCK
+    end
+    adjust(quantity - tonumber(current), price)
+    redis.call('HSET', qty_key, pid, quantity)
+    return 1
+end
+"""
+
+SPLIT_PROMO = """
+redis.call('SET', promo_key, ARGV[2])
+touch()
+return 1
+"""
+
+# Source keys: qty hash, details hash, promo string[, holds][, index]
+SPLIT_MERGE = MERGE_PRELUDE + """
+local source_holds = holds_key and KEYS[first + 3]
+local promo = redis.call('GET', KEYS[first + 2])
+local merged = merge_lines(redis.call('HGETALL', KEYS[first]), source_holds)
+redis.call('DEL', KEYS[first], KEYS[first + 1], KEYS[first + 2])
+if merged == 0 then
+    return 0
+end
+if promo then
+    redis.call('SET', promo_key, promo)
+end
+touch()
+return merged
+"""
+
+SPLIT_CLEAR = """
+release_all()
+redis.call('DEL', qty_key, details_key, promo_key)
+index(index_key, cart_id, false)
+changed(changes_key, dirty_key, cart_id)
+update_holders(cart_id)
+return 1
+"""
+
+
+# Compact layout: the whole cart is one hash, so a read is one HGETALL and a
+# single EXPIRE covers the cart.
+#
+#   cart:{sid}  hash  product_id -> quantity
+#                     _promo     -> promo code
+#                     plus the totals
+#
+# KEYS = cart hash, then the split layout keys so carts written by the old
+# layout are rewritten the first time any script touches them, then session,
+# index, changes stream, dirty hash, restore marker and stock holds.
+COMPACT_PRELUDE = INDEX_PRELUDE + STOCK_PRELUDE % {"first": 10} + """
+local cart = KEYS[1]
+local session_key, index_key = KEYS[5], KEYS[6]
+local changes_key, dirty_key, restored_key = KEYS[7], KEYS[8], KEYS[9]
+local live_keys = {cart}
+local cart_id = string.sub(cart, #'cart:' + 1)
+local totals_key = cart
+local ttl = tonumber(ARGV[1])
+local PROMO = '_promo'
+""" + TOTALS_PRELUDE + """
+local function touch()
+    bump()
+    local alive = redis.call('EXPIRE', cart, ttl) == 1
+    redis.call('EXPIRE', session_key, SESSION_TTL)
+    index(index_key, cart_id, alive)
+    changed(changes_key, dirty_key, cart_id)
+    update_holders(cart_id)
+end
+
+-- Lines written before carts stopped storing product details are packed
+-- as "quantity|price|name"; the quantity always comes first.
+local function quantity_of(value)
+    return tonumber(string.match(value, '^%d+'))
+end
+
+local function migrate()
+    if redis.call('EXISTS', cart) == 1 then
+        return
+    end
+    local qtys = redis.call('HGETALL', KEYS[2])
+    if #qtys > 0 then
+        redis.call('HSET', cart, unpack(qtys))
+    end
+    local promo = redis.call('GET', KEYS[4])
+    if promo then
+        redis.call('HSET', cart, PROMO, promo)
+    end
+    if #qtys > 0 or promo then
+        redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+        touch()
+    end
+end
+
+migrate()
+
+local OPS = {}
+
+function OPS.add(pid, quantity, price)
+    if not hold(pid, quantity) then
+        return OUT_OF_STOCK
+    end
+    adjust(quantity, price)
+    local current = redis.call('HGET', cart, pid)
+    if current then
+        quantity = quantity + quantity_of(current)
+    end
+    redis.call('HSET', cart, pid, quantity)
+    return 1
+end
+
+function OPS.remove(pid, _, price)
+    local current = redis.call('HGET', cart, pid)
+    if current then
+        hold(pid, -quantity_of(current))
+        adjust(-quantity_of(current), price)
+    end
+    redis.call('HDEL', cart, pid)
+    if line_count() == 0 then
+        redis.call('DEL', cart)
+    end
+    return 1
+end
+
+function OPS.inc(pid, step, price)
+    local current = redis.call('HGET', cart, pid)
+    if not current then
+        return 0
+    end
+    if not hold(pid, step) then
+        return OUT_OF_STOCK
+    end
+    adjust(step, price)
+    redis.call('HSET', cart, pid, quantity_of(current) + step)
+    return 1
+end
+
+function OPS.dec(pid, step, price)
+    local current = redis.call('HGET', cart, pid)
+    if not current then
+        return 0
+    end
+    local new_qty = quantity_of(current) - step
+    if new_qty < 1 then
+        hold(pid, -quantity_of(current))
+        adjust(-quantity_of(current), price)
+        redis.call('HDEL', cart, pid)
+        if line_count() == 0 then
+            redis.call('DEL', cart)
+        end
+    else
+        hold(pid, -step)
+        adjust(-step, price)
+        redis.call('HSET', cart, pid, new_qty)
+    end
+    return 1
+end
+
+function OPS.set(pid, quantity, price)
+    local current = redis.call('HGET', cart, pid)
+    if not current then
+        return 0
+    end
+    if not hold(pid, quantity - quantity_of(current)) then
+        return OUT_OF_STOCK
+    end
+    adjust(quantity - quantity_of(current), price)
+    redis.call('HSET', cart, pid, quantity)
+    return 1
+end
+"""
+
+COMPACT_GET = """
+return redis.call('HGETALL', cart)
+"""
+
+COMPACT_PROMO = """
+redis.call('HSET', cart, PROMO, ARGV[2])
+touch()
+return 1
+"""
+
+# Source keys: cart hash, then its split layout keys[, holds][, index]. A source still
+# in the split layout is read from those.
+COMPACT_MERGE = MERGE_PRELUDE + """
+local source_holds = holds_key and KEYS[first + 4]
+local fields = redis.call('HGETALL', KEYS[first])
+local split_promo = false
+if #fields == 0 then
+    fields = redis.call('HGETALL', KEYS[first + 1])
+    split_promo = redis.call('GET', KEYS[first + 3])
+end
+local merged, promo = merge_lines(fields, source_holds)
+redis.call('DEL', KEYS[first], KEYS[first + 1], KEYS[first + 2], KEYS[first + 3])
+if merged == 0 then
+    return 0
+end
+promo = promo or split_promo
+if promo then
+    redis.call('HSET', cart, PROMO, promo)
+end
+touch()
+return merged
+"""
+
+COMPACT_CLEAR = """
+release_all()
+redis.call('DEL', cart, KEYS[2], KEYS[3], KEYS[4])
+index(index_key, cart_id, false)
+changed(changes_key, dirty_key, cart_id)
+update_holders(cart_id)
+return 1
+"""
+
+
+# Shared by both layouts, appended to the layout prelude.
+
+# ARGV = ttl, product_id, quantity/step, unit price in cents
+LINE_OP = """
+local result = OPS['%s'](ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4]))
+if result == 1 then
+    touch()
+end
+return result
+"""
+
+# ARGV = ttl, then one (op, product_id, quantity, unit price) group per
+# operation. Returns one result per operation, in order.
+BATCH = """
+local results = {}
+local changed = false
+for i = 2, #ARGV, 4 do
+    local result = OPS[ARGV[i]](ARGV[i + 1], tonumber(ARGV[i + 2]), tonumber(ARGV[i + 3]))
+    results[#results + 1] = result
+    changed = changed or result == 1
+end
+if changed then
+    touch()
+end
+return results
+"""
+
+# ARGV = ttl, _rev the totals were computed at, items, subtotal, catalog
+# version the prices were read at.
+# Overwrites totals that drifted (price changes, carts older than the
+# totals) and stamps them with the catalog version, unless the cart changed
+# since it was read. Not a cart change
+# itself: no touch(), but a cached discount was computed from the old
+# subtotal, so it goes.
+REPRICE = """
+if redis.call('EXISTS', totals_key) == 0
+    or (redis.call('HGET', totals_key, REV) or '') ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', totals_key, ITEMS, ARGV[3], SUBTOTAL, ARGV[4], CATALOG, ARGV[5])
+redis.call('HDEL', totals_key, DISCOUNT_REV)
+return 1
+"""
+
+# ARGV = ttl, _rev the discount was computed at, discount in cents, promo
+# rules version it was computed with
+DISCOUNT_SCRIPT = """
+if redis.call('EXISTS', totals_key) == 0
+    or (redis.call('HGET', totals_key, REV) or '') ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', totals_key, DISCOUNT, ARGV[3], DISCOUNT_REV, ARGV[2], DISCOUNT_VER, ARGV[4])
+return 1
+"""
+
+LINE_OPS = ("add", "remove", "inc", "dec", "set")
+
+# Scripts that only maintain the cached totals: not cart activity
+MAINTENANCE = ("reprice", "discount")
+
+# Put before the scripts that change a cart. A user cart missing from Redis,
+# without changes the persister hasn't written yet, may have been lost
+# (restart, eviction) rather than never created: the script changes nothing
+# and returns NEEDS_RESTORE, so the caller restores the Postgres copy
+# (cart.persistence.restore, which sets the marker) and runs it again.
+# Otherwise the change would start a new cart that the persister then writes
+# over the copy. Runs after migrate(), so split layout carts count as there.
+RESTORE_CHECK = """
+if PERSIST and restored_key and is_user_cart(cart_id)
+    and redis.call('EXISTS', unpack(live_keys)) == 0
+    and redis.call('HEXISTS', dirty_key, cart_id) == 0
+    and redis.call('EXISTS', restored_key) == 0 then
+    return -2
+end
+"""
+
+# Returned by RESTORE_CHECK
+NEEDS_RESTORE = -2
+
+# Scripts that start with RESTORE_CHECK
+RESTORING = LINE_OPS + ("batch", "promo", "merge")
+
+# Idempotent variants (cart.idempotency) of the scripts behind the mutation
+# endpoints: IDEMPOTENT_PRELUDE + layout prelude (+ RESTORE_CHECK) +
+# IDEMPOTENT_BEGIN + script + IDEMPOTENT_END. The caller appends the idempotency key to KEYS and the
+# request fingerprint and TTL to ARGV; the prelude takes them off again
+# before the layout prelude reads its keys. The first call stores
+# "<fingerprint> <JSON result>" in the same script as the change (the view's
+# response is appended to it later), later calls with the key get it back
+# without running the script. Both return {replayed (0 or 1), stored}.
+IDEMPOTENT_OPS = LINE_OPS + ("batch", "promo", "clear")
+
+IDEMPOTENT_PRELUDE = """
+local idempotency_key = table.remove(KEYS)
+local idempotency_ttl = table.remove(ARGV)
+local fingerprint = table.remove(ARGV)
+"""
+
+IDEMPOTENT_BEGIN = """
+local stored = redis.call('GET', idempotency_key)
+if stored then
+    return {1, stored}
+end
+local function run()
+"""
+
+IDEMPOTENT_END = """
+end
+stored = fingerprint .. ' ' .. cjson.encode(run())
+redis.call('SET', idempotency_key, stored, 'EX', idempotency_ttl)
+return {0, stored}
+"""
+
+SPLIT = {
+    **{op: LINE_OP % op for op in LINE_OPS},
+    "batch": BATCH,
+    "promo": SPLIT_PROMO,
+    "clear": SPLIT_CLEAR,
+    "merge": SPLIT_MERGE,
+    "reprice": REPRICE,
+    "discount": DISCOUNT_SCRIPT,
+}
+
+COMPACT = {
+    **{op: LINE_OP % op for op in LINE_OPS},
+    "batch": BATCH,
+    "get": COMPACT_GET,
+    "promo": COMPACT_PROMO,
+    "clear": COMPACT_CLEAR,
+    "merge": COMPACT_MERGE,
+    "reprice": REPRICE,
+    "discount": DISCOUNT_SCRIPT,
+}
+
+
+# Sweeper scripts (cart.expiry). They run on their own keys, which share a
+# hash tag, so each batch is one atomic call.
+
+# KEYS = index, stream. ARGV = idle seconds, batch size, stream max length.
+# Pops carts idle for longer than their TTL (their keys are gone by now) and
+# emits one "expired" event each. Returns the popped session ids.
+SWEEP_EXPIRED = """
+local now = redis.call('TIME')
+local cutoff = now[1] + now[2] / 1000000 - tonumber(ARGV[1])
+local entries = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', cutoff, 'WITHSCORES', 'LIMIT', 0, ARGV[2]
+)
+local popped = {}
+for i = 1, #entries, 2 do
+    redis.call('ZREM', KEYS[1], entries[i])
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*',
+        'event', 'expired', 'session_id', entries[i], 'touched_at', entries[i + 1])
+    popped[#popped + 1] = entries[i]
+end
+return popped
+"""
+
+# KEYS = index, stream, cursor hash. ARGV = idle seconds, batch size, stream
+# max length.
+# Emits one "abandoned" event per cart idle for longer than ARGV[1], walking
+# the index from the cursor (score, member) left by the previous call, so a
+# cart is reported once per idle period. Returns how many were emitted.
+SWEEP_ABANDONED = """
+local now = redis.call('TIME')
+local cutoff = now[1] + now[2] / 1000000 - tonumber(ARGV[1])
+local cursor = redis.call('HMGET', KEYS[3], 'score', 'member')
+local low, last = cursor[1] or '-inf', cursor[2] or ''
+-- The lower bound is inclusive: skip what the last call already emitted at
+-- exactly the cursor score (ties are ordered by member)
+local offset = 0
+if cursor[1] then
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], low, low)) do
+        if member <= last then
+            offset = offset + 1
+        end
+    end
+end
+local entries = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], low, cutoff, 'WITHSCORES', 'LIMIT', offset, ARGV[2]
+)
+for i = 1, #entries, 2 do
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*',
+        'event', 'abandoned', 'session_id', entries[i], 'touched_at', entries[i + 1])
+end
+if #entries > 0 then
+    redis.call('HSET', KEYS[3], 'score', entries[#entries], 'member', entries[#entries - 1])
+end
+return #entries / 2
+"""
+
+
+# KEYS = cart hash (the qty hash in the split layout), holds, available,
+# reserved, holders. ARGV = session id.
+# Gives back the units held by a cart that no longer exists (expired); a
+# cart that is still there keeps its holds. Returns 1 if anything was released.
+RELEASE_HOLDS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local holds = redis.call('HGETALL', KEYS[2])
+for i = 1, #holds, 2 do
+    local pid, held = holds[i], tonumber(holds[i + 1])
+    if redis.call('HEXISTS', KEYS[3], pid) == 1 then
+        redis.call('HINCRBY', KEYS[3], pid, held)
+    end
+    redis.call('HINCRBY', KEYS[4], pid, -held)
+end
+redis.call('DEL', KEYS[2])
+redis.call('SREM', KEYS[5], ARGV[1])
+return #holds > 0 and 1 or 0
+"""
+
+
+# Write-behind scripts (cart.persistence), on the queue keys.
+
+# KEYS = dirty hash, changes stream. ARGV = session id, version pairs.
+# Marks the carts written to Postgres at the version the persister read as
+# clean; those changed since are queued again. Returns how many were.
+PERSISTED = """
+local requeued = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    else
+        redis.call('XADD', KEYS[2], '*', 'session_id', ARGV[i])
+        requeued = requeued + 1
+    end
+end
+return requeued
+"""
+
+# KEYS = dirty hash, restore marker. ARGV = session id, marker TTL.
+# Returns 1 if a cart missing from Redis should be restored from Postgres. A
+# cart with changes not written yet was emptied, not lost, and only the first
+# read to miss a cart queries Postgres for it.
+CLAIM_RESTORE = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
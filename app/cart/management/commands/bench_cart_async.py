@@ -0,0 +1,103 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment
+
+from core.benchmarking import HEADER, summarize
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the cart endpoints in-process: the sync views through the "
+        "WSGI handler on a thread pool against the async views through the "
+        "ASGI handler on one event loop. Needs Redis and a seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=50)
+
+    def handle(self, *args, **options):
+        setup_test_environment()  # lets the test clients through ALLOWED_HOSTS
+        total, concurrency = options["requests"], options["concurrency"]
+        product_id = (
+            Product.objects.filter(is_active=True).values_list("id", flat=True).first()
+        )
+        if product_id is None:
+            raise CommandError("No active product to add to the cart.")
+
+        self.stdout.write(f"{total} requests, concurrency {concurrency}\n")
+        self.stdout.write(HEADER)
+        for prefix, runner in (("", self._wsgi), ("async/", self._asgi)):
+            for endpoint in ("add/", "get/"):
+                samples, elapsed = runner(prefix, endpoint, product_id, total, concurrency)
+                name = f"{'ASGI' if prefix else 'WSGI'} {endpoint}"
+                self.stdout.write(summarize(name, samples, elapsed))
+
+    def _wsgi(self, prefix, endpoint, product_id, total, concurrency):
+        # One client (so one session cookie) per worker thread
+        clients = [Client() for _ in range(concurrency)]
+        for client in clients:
+            client.post(
+                f"/api/cart/{prefix}add/",
+                {"product_id": product_id},
+                content_type="application/json",
+            )
+
+        def call(i):
+            client = clients[i % concurrency]
+            start = time.perf_counter()
+            if endpoint == "add/":
+                client.post(
+                    f"/api/cart/{prefix}add/",
+                    {"product_id": product_id},
+                    content_type="application/json",
+                )
+            else:
+                client.get(f"/api/cart/{prefix}get/")
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(call, range(total)))
+        return samples, time.perf_counter() - start
+
+    def _asgi(self, prefix, endpoint, product_id, total, concurrency):
+        return asyncio.run(self._asgi_run(prefix, endpoint, product_id, total, concurrency))
+
+    async def _asgi_run(self, prefix, endpoint, product_id, total, concurrency):
+        clients = [AsyncClient() for _ in range(concurrency)]
+        for client in clients:
+            await client.post(
+                f"/api/cart/{prefix}add/",
+                {"product_id": product_id},
+                content_type="application/json",
+            )
+
+        samples = []
+
+        async def worker(client, count):
+            for _ in range(count):
+                start = time.perf_counter()
+                if endpoint == "add/":
+                    await client.post(
+                        f"/api/cart/{prefix}add/",
+                        {"product_id": product_id},
+                        content_type="application/json",
+                    )
+                else:
+                    await client.get(f"/api/cart/{prefix}get/")
+                samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                worker(client, total // concurrency + (i < total % concurrency))
+                for i, client in enumerate(clients)
+            )
+        )
+        return samples, time.perf_counter() - start
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import redis_cart, redis_cart_v1
+from core.benchmarking import REDIS_HEADER, count_redis_commands, seed_catalog, summarize
+
+
+def _operations(module, product_ids):
+    """(name, callable(session_id, i)) for each cart operation of a module."""
+    pid = product_ids[0]
+
+    if module is redis_cart:
+        add = lambda sid, i: module.add_to_cart(sid, product_ids[i % len(product_ids)], 1)
+    else:
+        add = lambda sid, i: module.add_to_cart(
+            sid, product_ids[i % len(product_ids)], 1, "Bench product", 9.99
+        )
+
+    return [
+        ("add_to_cart", add),
+        ("get_cart", lambda sid, i: module.get_cart(sid)),
+        ("increment_quantity", lambda sid, i: module.increment_quantity(sid, pid)),
+        ("decrement_quantity", lambda sid, i: module.decrement_quantity(sid, pid)),
+        ("set_quantity", lambda sid, i: module.set_quantity(sid, pid, 3)),
+        ("set_cart_promo_code", lambda sid, i: module.set_cart_promo_code(sid, "WELCOME10")),
+        ("get_cart_promo_code", lambda sid, i: module.get_cart_promo_code(sid)),
+        ("remove_from_cart", lambda sid, i: module.remove_from_cart(sid, product_ids[i % len(product_ids)])),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark the redis_cart storage functions against the original "
+        "redis_cart_v1 layout: latency and Redis commands/round trips per call."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=1000)
+        parser.add_argument("--lines", type=int, default=10, help="Lines per cart")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        product_ids = seed_catalog(options["lines"])
+
+        self.stdout.write(f"{iterations} calls per operation, {len(product_ids)} lines per cart\n")
+        self.stdout.write(REDIS_HEADER)
+
+        for module in (redis_cart_v1, redis_cart):
+            label = module.__name__.rsplit(".", 1)[-1]
+            session_id = f"bench-{label}"
+            module.clear_cart(session_id)
+            for pid in product_ids:
+                _operations(module, [pid])[0][1](session_id, 0)
+
+            for name, operation in _operations(module, product_ids):
+                samples = []
+                with count_redis_commands() as stats:
+                    start = time.perf_counter()
+                    for i in range(iterations):
+                        call_start = time.perf_counter()
+                        operation(session_id, i)
+                        samples.append(time.perf_counter() - call_start)
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(summarize(f"{label}.{name}", samples, elapsed, stats))
+
+            module.clear_cart(session_id)
+            self.stdout.write("")
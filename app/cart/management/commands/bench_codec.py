@@ -0,0 +1,99 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from cart import redis_cart
+from core import codec
+from core.benchmarking import HEADER, seed_catalog, summarize
+from core.renderers import ORJSONParser, ORJSONRenderer
+from inventory import catalog
+
+
+def _measure(operation, iterations):
+    """CPU time per call: the codec work, not the Redis round trips."""
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.process_time()
+        operation()
+        samples.append(time.process_time() - call_start)
+    return samples, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the json and orjson paths on one large cart: catalog snapshot "
+        "encode/decode, get_cart, response rendering and request parsing. "
+        "Latencies are CPU time per call."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=1000)
+        parser.add_argument("--lines", type=int, default=100, help="Lines per cart")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        product_ids = seed_catalog(options["lines"])
+
+        session_id = "bench-codec"
+        redis_cart.clear_cart(session_id)
+        redis_cart.apply_batch(
+            session_id,
+            [{"op": "add", "product_id": pid, "quantity": 2} for pid in product_ids],
+        )
+        items = redis_cart.get_cart(session_id)
+        response = {"items": items, "promo_code": "WELCOME10"}
+        batch = {
+            "operations": [
+                {"op": "set", "product_id": pid, "quantity": 3} for pid in product_ids
+            ]
+        }
+        snapshots = [
+            (product["name"], product["price"], product["category_id"])
+            for product in catalog.get_products(product_ids).values()
+        ]
+
+        def cold_get_cart():
+            for pid in product_ids:
+                catalog._local.discard(pid)
+            redis_cart.get_cart(session_id)
+
+        self.stdout.write(
+            f"{iterations} calls per case, {len(product_ids)} lines per cart\n"
+        )
+        self.stdout.write(HEADER)
+
+        original = codec.codec
+        try:
+            for name, implementation in codec.CODECS.items():
+                codec.codec = implementation
+                packed = [catalog._pack(*snapshot) for snapshot in snapshots]
+                cases = [
+                    ("snapshot encode", lambda: [catalog._pack(*s) for s in snapshots]),
+                    ("snapshot decode", lambda: [catalog._unpack(v) for v in packed]),
+                    ("get_cart, cold local cache", cold_get_cart),
+                ]
+                for case, operation in cases:
+                    samples, elapsed = _measure(operation, iterations)
+                    self.stdout.write(summarize(f"{name} {case}", samples, elapsed))
+        finally:
+            codec.codec = original
+
+        drf = [
+            ("drf json", JSONRenderer(), JSONParser()),
+            ("orjson", ORJSONRenderer(), ORJSONParser()),
+        ]
+        for label, renderer, parser in drf:
+            body = renderer.render(batch)
+            cases = [
+                ("render cart response", lambda: renderer.render(response)),
+                ("parse batch request", lambda: parser.parse(io.BytesIO(body))),
+            ]
+            for case, operation in cases:
+                samples, elapsed = _measure(operation, iterations)
+                self.stdout.write(summarize(f"{label} {case}", samples, elapsed))
+
+        redis_cart.clear_cart(session_id)
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment
+
+from cart.models import Promo
+from core.benchmarking import REDIS_HEADER, count_redis_commands, seed_catalog, summarize
+from inventory.search import rebuild_search_index
+
+
+def _cases(product_ids):
+    """(name, method, path, payload) for every endpoint in cart/ and inventory/ urls."""
+    pid = product_ids[0]
+    batch = {
+        "operations": [{"op": "add", "product_id": p, "quantity": 1} for p in product_ids[:5]]
+    }
+    cases = [
+        ("catalog products/", "get", "/api/products/", None),
+        ("catalog products/search/", "get", "/api/products/search/?q=bench+pro", None),
+    ]
+    for prefix in ("", "async/"):
+        cart = f"/api/cart/{prefix}"
+        cases += [
+            (f"{prefix}add/", "post", f"{cart}add/", {"product_id": pid}),
+            (f"{prefix}get/", "get", f"{cart}get/", None),
+            (f"{prefix}totals/", "get", f"{cart}totals/", None),
+            (f"{prefix}update/ inc", "post", f"{cart}update/", {"product_id": pid, "action": "inc"}),
+            (f"{prefix}update/ dec", "post", f"{cart}update/", {"product_id": pid, "action": "dec"}),
+            (f"{prefix}update/quantity", "post", f"{cart}update/quantity", {"product_id": pid, "quantity": 3}),
+            (f"{prefix}promo/", "post", f"{cart}promo/", {"promo_code": "WELCOME10"}),
+            (f"{prefix}batch/", "post", f"{cart}batch/", batch),
+            (f"{prefix}checkout/", "post", f"{cart}checkout/", None),
+            (f"{prefix}delete/", "post", f"{cart}delete/", {"product_id": pid}),
+            (f"{prefix}get/ (clear)", "delete", f"{cart}get/", None),
+        ]
+    return cases
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every cart and catalog endpoint in-process and report throughput, "
+        "p50/p99 latency and Redis commands/round trips per request. Sync views "
+        "go through the WSGI handler on a thread pool, async views through the "
+        "ASGI handler on one event loop. Use DJANGO_SETTINGS_MODULE="
+        "core.settings_bench to run against SQLite and fakeredis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--lines", type=int, default=5, help="Lines per cart")
+        parser.add_argument("--products", type=int, default=100)
+
+    def handle(self, *args, **options):
+        setup_test_environment()  # lets the test clients through ALLOWED_HOSTS
+        product_ids = seed_catalog(options["products"])
+        rebuild_search_index()  # seed_catalog's bulk insert skips the signals
+        Promo.objects.get_or_create(code="WELCOME10", defaults={"value": 10})
+        self.lines = product_ids[: options["lines"]]
+        total, concurrency = options["requests"], options["concurrency"]
+
+        self.stdout.write(
+            f"{total} requests per case, concurrency {concurrency}, "
+            f"{len(self.lines)} lines per cart\n"
+        )
+        self.stdout.write(REDIS_HEADER)
+        for name, method, path, payload in _cases(product_ids):
+            runner = self._asgi if "/async/" in path else self._wsgi
+            samples, elapsed, stats = runner(method, path, payload, total, concurrency)
+            self.stdout.write(summarize(name, samples, elapsed, stats))
+
+    def _fill_payload(self):
+        return {
+            "operations": [{"op": "add", "product_id": p, "quantity": 2} for p in self.lines]
+        }
+
+    def _wsgi(self, method, path, payload, total, concurrency):
+        # One client (so one session and one cart) per worker
+        clients = [Client() for _ in range(concurrency)]
+        fill = self._fill_payload()
+        for client in clients:
+            client.post("/api/cart/batch/", fill, content_type="application/json")
+
+        def call(i):
+            client = clients[i % concurrency]
+            start = time.perf_counter()
+            if method == "get":
+                client.get(path)
+            else:
+                getattr(client, method)(path, payload, content_type="application/json")
+            return time.perf_counter() - start
+
+        with count_redis_commands() as stats:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(call, range(total)))
+            elapsed = time.perf_counter() - start
+        return samples, elapsed, stats
+
+    def _asgi(self, method, path, payload, total, concurrency):
+        return asyncio.run(self._asgi_run(method, path, payload, total, concurrency))
+
+    async def _asgi_run(self, method, path, payload, total, concurrency):
+        clients = [AsyncClient() for _ in range(concurrency)]
+        fill = self._fill_payload()
+        for client in clients:
+            await client.post("/api/cart/async/batch/", fill, content_type="application/json")
+
+        samples = []
+
+        async def worker(client, count):
+            for _ in range(count):
+                start = time.perf_counter()
+                if method == "get":
+                    await client.get(path)
+                else:
+                    await getattr(client, method)(
+                        path, payload, content_type="application/json"
+                    )
+                samples.append(time.perf_counter() - start)
+
+        with count_redis_commands() as stats:
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    worker(client, total // concurrency + (i < total % concurrency))
+                    for i, client in enumerate(clients)
+                )
+            )
+            elapsed = time.perf_counter() - start
+        return samples, elapsed, stats
@@ -0,0 +1,102 @@
+import json
+
+import redis
+from django.core.management.base import BaseCommand
+
+from core.redis_client import get_redis
+
+r = get_redis()
+
+PREFIX = "bench:layout"
+
+
+def _details_cart(pipe, cart_id, lines, promo_code):
+    # The original layout, before carts stopped storing product details:
+    # name and price of every line, as JSON, next to the quantities
+    qty_key = f"{PREFIX}:{cart_id}:qty"
+    details_key = f"{PREFIX}:{cart_id}:details"
+    promo_key = f"{PREFIX}:{cart_id}:promo_code"
+    for pid, quantity in lines:
+        pipe.hset(qty_key, pid, quantity)
+        pipe.hset(
+            details_key,
+            pid,
+            json.dumps({"product_id": pid, "name": f"Product {pid}", "price": 9.99 + pid}),
+        )
+    pipe.set(promo_key, promo_code)
+    return [qty_key, details_key, promo_key]
+
+
+def _split_cart(pipe, cart_id, lines, promo_code):
+    qty_key = f"{PREFIX}:{cart_id}:qty"
+    promo_key = f"{PREFIX}:{cart_id}:promo_code"
+    for pid, quantity in lines:
+        pipe.hset(qty_key, pid, quantity)
+    pipe.set(promo_key, promo_code)
+    return [qty_key, promo_key]
+
+
+def _compact_cart(pipe, cart_id, lines, promo_code):
+    cart_key = f"{PREFIX}:{cart_id}"
+    for pid, quantity in lines:
+        pipe.hset(cart_key, pid, quantity)
+    pipe.hset(cart_key, "_promo", promo_code)
+    return [cart_key]
+
+
+def _has_memory_usage():
+    try:
+        r.memory_usage(f"{PREFIX}:probe")
+    except redis.ResponseError:
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Write sample carts in the details (baseline), split and compact "
+        "layouts and compare the Redis memory used per cart, extrapolated to "
+        "a million carts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--carts", type=int, default=1000)
+        parser.add_argument("--lines", type=int, default=5)
+
+    def _measure(self, writer, carts, lines):
+        pipe = r.pipeline(transaction=False)
+        keys = []
+        for cart_id in range(carts):
+            sample = [(pid, 1 + pid % 3) for pid in range(cart_id, cart_id + lines)]
+            keys.extend(writer(pipe, cart_id, sample, "WELCOME10"))
+        pipe.execute()
+
+        for key in keys:
+            pipe.memory_usage(key, samples=0)
+        total = sum(pipe.execute())
+        encodings = {r.object("encoding", key) for key in keys[:3]}
+
+        r.delete(*keys)
+        return total / carts, len(keys) // carts, encodings
+
+    def handle(self, *args, **options):
+        if not _has_memory_usage():
+            self.stderr.write(
+                "This Redis server doesn't support MEMORY USAGE (the fakeredis "
+                "stand-in of core.settings_bench doesn't): run against a real Redis."
+            )
+            return
+
+        carts, lines = options["carts"], options["lines"]
+        self.stdout.write(f"{carts} carts, {lines} lines each\n")
+        self.stdout.write(
+            f"{'layout':<10}{'keys/cart':>10}{'bytes/cart':>12}{'1M carts':>12}  encoding"
+        )
+
+        layouts = (("details", _details_cart), ("split", _split_cart), ("compact", _compact_cart))
+        for name, writer in layouts:
+            per_cart, keys_per_cart, encodings = self._measure(writer, carts, lines)
+            self.stdout.write(
+                f"{name:<10}{keys_per_cart:>10}{per_cart:>12.0f}"
+                f"{per_cart * 1_000_000 / 2**20:>10.0f}MB  {', '.join(sorted(encodings))}"
+            )
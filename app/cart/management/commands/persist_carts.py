@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.persistence import default_consumer, persist, persist_batch, prune
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the carts queued on the carts:changes stream to Postgres. Runs "
+        "until the queue is empty, or forever with --follow."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=None, help="Carts per Postgres write")
+        parser.add_argument("--consumer", default=None, help="Consumer name, one per worker")
+        parser.add_argument("--follow", action="store_true", help="Keep waiting for changes")
+        parser.add_argument("--prune", action="store_true", help="First delete expired copies")
+
+    def handle(self, *args, **options):
+        if not settings.CART_PERSISTENCE:
+            raise CommandError("CART_PERSISTENCE is off")
+        if options["prune"]:
+            self.stdout.write(f"pruned: {prune()}")
+
+        consumer = options["consumer"] or default_consumer()
+        written = persist(consumer, options["batch"])
+        self.stdout.write(f"written: {written}")
+        while options["follow"]:
+            persist_batch(consumer, options["batch"], block=5000)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from cart.redis_cart import release_orphaned_holds
+from inventory.models import Product
+from inventory.stock import iter_reserved, sync_many
+
+
+class Command(BaseCommand):
+    help = (
+        "Release the stock held by carts that no longer exist, push "
+        "Product.stock into Redis and write the reserved counts back to "
+        "Product.reserved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1000, help="Rows per pipeline/UPDATE")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch"]
+
+        released = release_orphaned_holds(batch_size)
+
+        rows = Product.objects.values_list("id", "stock").iterator(chunk_size=batch_size)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                sync_many(batch)
+                batch = []
+        sync_many(batch)
+
+        reserved = dict(iter_reserved(batch_size))
+        changed = [
+            product
+            for product in Product.objects.only("id", "reserved").iterator(chunk_size=batch_size)
+            if product.reserved != reserved.get(product.id, 0)
+        ]
+        for product in changed:
+            product.reserved = reserved.get(product.id, 0)
+        Product.objects.bulk_update(changed, ["reserved"], batch_size=batch_size)
+
+        self.stdout.write(
+            f"released: {released} carts, reserved updated: {len(changed)} products"
+        )
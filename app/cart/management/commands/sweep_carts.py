@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.expiry import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Report abandoned and expired carts on the carts:events stream. Runs "
+        "once, or forever with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=None, help="Index entries per script call")
+        parser.add_argument("--interval", type=float, default=0, help="Seconds between sweeps, 0 to run once")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = sweep(options["batch"])
+            self.stdout.write(
+                f"expired: {counts['expired']}, abandoned: {counts['abandoned']}"
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 09:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('cart_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('promo_code', models.CharField(blank=True, max_length=30, null=True)),
+                ('updated_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CartLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='cart.cart')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product_id'), name='cart_line_unique')],
+            },
+        ),
+    ]
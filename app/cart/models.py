@@ -1,3 +1,49 @@
 from django.db import models
 
-# Create your models here.
+from inventory.models import Category
+
+
+# Promo Model
+class Promo(models.Model):
+    PERCENTAGE = "percentage"
+    FIXED = "fixed"
+    KIND_CHOICES = [(PERCENTAGE, "Percentage"), (FIXED, "Fixed amount")]
+
+    code = models.CharField(max_length=30, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=PERCENTAGE)
+    # Percent off for PERCENTAGE, amount off for FIXED
+    value = models.DecimalField(max_digits=10, decimal_places=2)
+    # When set, only lines of products in this category or its subcategories
+    # are discounted
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True, related_name="promos"
+    )
+    is_active = models.BooleanField(default=True)
+    valid_from = models.DateTimeField(null=True, blank=True)
+    valid_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.code
+
+
+# Write-behind copy of a Redis cart, see cart/persistence.py
+class Cart(models.Model):
+    # The Redis cart id: a session key, or user:<pk>
+    cart_id = models.CharField(max_length=64, primary_key=True)
+    promo_code = models.CharField(max_length=30, null=True, blank=True)
+    updated_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.cart_id
+
+
+class CartLine(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="lines")
+    # Not a foreign key: a cart can still hold products deleted since
+    product_id = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product_id"], name="cart_line_unique")
+        ]
@@ -0,0 +1,69 @@
+# owners.py
+#
+# Who a cart belongs to. The cart modules take a cart id where they say
+# session_id:
+#
+#   <session key>  anonymous cart, lives as long as the session
+#   user:<pk>      cart of a signed in user, kept across sessions and devices
+#                  for CART_USER_TTL
+#
+# Session keys never contain ":", so the two can't collide. On login the
+# anonymous cart is merged into the user's (signals.merge_cart_on_login).
+#
+# The cart scripts refresh the session along with the cart. An anonymous
+# cart's id is its session key; for a user cart, cart_id() records the
+# request's session key in a ContextVar, which follows the view into the
+# cart functions (sync and async) without changing their signatures.
+from contextvars import ContextVar
+
+USER_PREFIX = "user:"
+
+# (user cart id, session key) of the current request
+_session = ContextVar("cart_session", default=None)
+
+
+def user_cart_id(user_id):
+    return f"{USER_PREFIX}{user_id}"
+
+
+def is_user_cart(cart):
+    return cart is not None and cart.startswith(USER_PREFIX)
+
+
+def bind_session(cart, session_key):
+    """Refresh session_key along with the user cart for the rest of the request."""
+    _session.set((cart, session_key))
+
+
+def session_key(cart):
+    """The key of the session to keep alive with the cart, if there is one."""
+    if not is_user_cart(cart):
+        return cart
+    bound = _session.get()
+    return bound[1] if bound is not None and bound[0] == cart else None
+
+
+def cart_id(request, create=False):
+    """
+    The id of the request's cart. With create, an anonymous request without
+    a session gets one, so the cart has a key to live under.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        cart = user_cart_id(user.pk)
+        bind_session(cart, request.session.session_key)
+        return cart
+    if create and not request.session.session_key:
+        request.session.create()
+    return request.session.session_key
+
+
+async def acart_id(request, create=False):
+    user = await request.auser()
+    if user.is_authenticated:
+        cart = user_cart_id(user.pk)
+        bind_session(cart, request.session.session_key)
+        return cart
+    if create and not request.session.session_key:
+        await request.session.acreate()
+    return request.session.session_key
@@ -0,0 +1,235 @@
+# persistence.py
+#
+# Write-behind copies of the Redis carts in Postgres (Cart, CartLine), so a
+# Redis restart or eviction doesn't lose them. Enabled by CART_PERSISTENCE.
+#
+#   carts:changes          stream  {session_id}, one entry per cart that
+#                                  changed since it was last written
+#   carts:dirty            hash    session_id -> change counter, until the
+#                                  cart is written at its latest version
+#   cart:{sid}:restored    string  set for CART_TTL once a request found the
+#                                  cart missing, so Postgres is asked only once
+#
+# Only user carts (cart.owners) are copied. An anonymous cart is found through
+# its session, which is kept in the same Redis: a Redis that lost the cart
+# lost the session too, and nothing would ask for the copy again.
+#
+# The cart scripts fill the queue in the same call as the change (changed()
+# in lua_scripts), so no cart request runs SQL to stay durable. The
+# persist_carts command reads the stream with a consumer group, writes the
+# current state of each queued cart in one transaction per batch and clears
+# the carts that didn't change meanwhile. A cart read, or a cart script about
+# to change a cart, that finds nothing in Redis for a cart without pending
+# changes replays the copy through the cart scripts first (restore), unless
+# the copy is older than the cart's TTL: that cart expired, it wasn't lost. Carts emptied or cleared are deleted from
+# Postgres the same way.
+import os
+import socket
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.redis_client import get_redis, hash_tag
+
+from . import lua_scripts
+from .models import Cart, CartLine
+from .owners import is_user_cart
+
+r = get_redis()
+
+CHANGES_KEY = f"{hash_tag('carts')}:changes"
+DIRTY_KEY = f"{hash_tag('carts')}:dirty"
+GROUP = "persisters"
+
+_persisted = r.register_script(lua_scripts.PERSISTED)
+_claim_restore = r.register_script(lua_scripts.CLAIM_RESTORE)
+
+
+def default_consumer():
+    # Unacknowledged entries are only re-read by the consumer they went to
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def create_group():
+    try:
+        r.xgroup_create(CHANGES_KEY, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as error:
+        if not str(error).startswith("BUSYGROUP"):
+            raise
+
+
+def _read_states(session_ids):
+    """
+    {session_id: (version, promo_code, lines)} of the queued carts, read in
+    one MULTI so each version matches the state read with it. Carts already
+    written at their latest version (duplicate entries) are left out.
+    """
+    from .redis_cart import _cart_key, _compact, _parse_lines, _promo_key, _qty_key
+
+    compact = _compact()
+    pipe = r.pipeline(transaction=True)
+    pipe.hmget(DIRTY_KEY, session_ids)
+    for session_id in session_ids:
+        if compact:
+            pipe.hgetall(_cart_key(session_id))
+        else:
+            pipe.hgetall(_qty_key(session_id))
+            pipe.get(_promo_key(session_id))
+    versions, *replies = pipe.execute()
+
+    states = {}
+    step = 1 if compact else 2
+    for i, (session_id, version) in enumerate(zip(session_ids, versions)):
+        if version is None:
+            continue
+        fields = replies[i * step]
+        promo_code = fields.get("_promo") if compact else replies[i * step + 1]
+        states[session_id] = (version, promo_code, _parse_lines(fields))
+    return states
+
+
+def _write(states):
+    """Upsert the non-empty carts with their lines, delete the empty ones."""
+    now = timezone.now()
+    kept = {
+        session_id: (promo_code, lines)
+        for session_id, (_, promo_code, lines) in states.items()
+        if lines or promo_code
+    }
+    with transaction.atomic():
+        Cart.objects.filter(pk__in=[sid for sid in states if sid not in kept]).delete()
+        Cart.objects.bulk_create(
+            [
+                Cart(cart_id=session_id, promo_code=promo_code, updated_at=now)
+                for session_id, (promo_code, _) in kept.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["cart_id"],
+            update_fields=["promo_code", "updated_at"],
+        )
+        CartLine.objects.filter(cart__in=list(kept)).delete()
+        CartLine.objects.bulk_create(
+            CartLine(cart_id=session_id, product_id=pid, quantity=quantity)
+            for session_id, (_, lines) in kept.items()
+            for pid, quantity in lines.items()
+        )
+
+
+def persist_batch(consumer, batch_size=None, block=None, pending=False):
+    """
+    Write up to batch_size queued carts to Postgres. With pending, re-read the
+    entries this consumer was handed but never acknowledged (it stopped
+    mid-batch) instead of new ones. block is how long to wait for entries,
+    in milliseconds. Returns the number of stream entries handled.
+    """
+    batch_size = batch_size or settings.CART_PERSIST_BATCH
+    try:
+        reply = r.xreadgroup(
+            GROUP,
+            consumer,
+            {CHANGES_KEY: "0" if pending else ">"},
+            count=batch_size,
+            block=None if pending else block,
+        )
+    except redis.ResponseError as error:
+        if not str(error).startswith("NOGROUP"):
+            raise
+        # Redis lost the stream (restart): start over with a new group
+        create_group()
+        return 0
+    entries = reply[0][1] if reply else []
+    if not entries:
+        return 0
+
+    # A pending entry deleted from the stream comes back without fields
+    session_ids = list(
+        dict.fromkeys(fields["session_id"] for _, fields in entries if fields)
+    )
+    states = _read_states(session_ids) if session_ids else {}
+    if states:
+        _write(states)
+        args = []
+        for session_id, (version, _, _) in states.items():
+            args.extend((session_id, version))
+        _persisted(keys=[DIRTY_KEY, CHANGES_KEY], args=args)
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipe = r.pipeline(transaction=False)
+    pipe.xack(CHANGES_KEY, GROUP, *entry_ids)
+    pipe.xdel(CHANGES_KEY, *entry_ids)
+    pipe.execute()
+    return len(entries)
+
+
+def persist(consumer, batch_size=None):
+    """
+    Write every queued cart, starting with this consumer's unacknowledged
+    entries. Returns the number of stream entries handled.
+    """
+    create_group()
+    total = 0
+    for pending in (True, False):
+        while handled := persist_batch(consumer, batch_size, pending=pending):
+            total += handled
+    return total
+
+
+def prune(retention=None):
+    """Delete the copies of carts unchanged for longer than the retention."""
+    retention = retention or settings.CART_PERSIST_RETENTION
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    _, deleted = Cart.objects.filter(updated_at__lt=cutoff).delete()
+    return deleted.get("cart.Cart", 0)
+
+
+def restored_key(session_id):
+    # Next to the cart's own keys (redis_cart._cart_key), in the same slot
+    return f"cart:{hash_tag(session_id)}:restored"
+
+
+def _snapshot(session_id, ttl):
+    # A cart's TTL runs from its last change, which the copy was written
+    # just after: an older copy belongs to a cart that expired in Redis
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    rows = Cart.objects.filter(pk=session_id, updated_at__gte=cutoff).values_list(
+        "promo_code", "lines__product_id", "lines__quantity"
+    )
+    promo_code, lines = None, {}
+    for promo_code, pid, quantity in rows:
+        if pid is not None:
+            lines[pid] = quantity
+    return promo_code, lines
+
+
+def restore(session_id):
+    """
+    Rebuild a cart that Redis lost from its Postgres copy, through the cart
+    scripts so the totals and stock holds are redone. Returns True if
+    anything was restored.
+    """
+    from .redis_cart import _ttl, apply_batch, release_holds, set_cart_promo_code
+
+    if not is_user_cart(session_id):
+        return False
+    claimed = _claim_restore(
+        keys=[DIRTY_KEY, restored_key(session_id)],
+        args=[session_id, settings.CART_TTL],
+    )
+    if not claimed:
+        return False
+    promo_code, lines = _snapshot(session_id, _ttl(session_id))
+    if settings.STOCK_RESERVATIONS:
+        # Holds have no TTL and may have outlived an evicted cart: give them
+        # back before the lines hold their units again
+        release_holds([session_id])
+    if lines:
+        apply_batch(
+            session_id,
+            [{"op": "add", "product_id": pid, "quantity": qty} for pid, qty in lines.items()],
+        )
+    if promo_code:
+        set_cart_promo_code(session_id, promo_code)
+    return bool(lines or promo_code)
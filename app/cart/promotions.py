@@ -0,0 +1,165 @@
+# promotions.py
+#
+# Promo code rules. Active Promo rows are compiled into Rule objects and kept
+# in a process-local dict, so validating a code (CartPromoView) and pricing a
+# cart (the CART_PROMO_EVALUATOR hook, see totals.py) run no SQL:
+#
+#   promo:version  counter bumped on every Promo change, and on every
+#                  Category change (a rule covers its category's subtree)
+#
+# Each process checks the version at most once every PROMO_RULES_TTL seconds
+# and reloads all the rules, with the category subtrees they cover, in two
+# queries when it moved.
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.redis_client import get_redis
+from inventory.models import Category
+
+from .models import Promo
+from .totals import cents
+
+r = get_redis()
+
+PROMO_VERSION_KEY = "promo:version"
+
+
+@dataclass(frozen=True)
+class Rule:
+    code: str
+    kind: str
+    value: Decimal  # percent off, or amount off in cents
+    category_ids: frozenset | None  # the promo's category and its descendants
+    valid_from: datetime | None
+    valid_until: datetime | None
+
+    def is_valid(self, now):
+        return (self.valid_from is None or self.valid_from <= now) and (
+            self.valid_until is None or now < self.valid_until
+        )
+
+    def discount(self, lines, products):
+        """Discount in cents over all the lines, in one pass."""
+        eligible = 0
+        for pid, quantity in lines.items():
+            product = products.get(pid)
+            if product is None:
+                continue
+            if self.category_ids is None or product["category_id"] in self.category_ids:
+                eligible += quantity * cents(product["price"])
+        if self.kind == Promo.PERCENTAGE:
+            return round(eligible * self.value / 100)
+        return min(int(self.value), eligible)
+
+
+def _compile(code, kind, value, category_id, category_path, valid_from, valid_until, paths):
+    if kind == Promo.FIXED:
+        value = cents(value)
+    category_ids = None
+    if category_id is not None:
+        category_ids = frozenset(
+            [category_id]
+            + [pk for pk, path in paths if category_path and path.startswith(category_path)]
+        )
+    return Rule(code, kind, value, category_ids, valid_from, valid_until)
+
+
+def _load_rules():
+    rows = list(
+        Promo.objects.filter(is_active=True).values_list(
+            "code", "kind", "value", "category_id", "category__path", "valid_from", "valid_until"
+        )
+    )
+    # The subtrees of the promo categories, in one more query
+    prefixes = {row[4] for row in rows if row[4]}
+    paths = []
+    if prefixes:
+        subtrees = Q(*[("path__startswith", prefix) for prefix in prefixes], _connector=Q.OR)
+        paths = list(Category.objects.filter(subtrees).values_list("id", "path"))
+    return {row[0].upper(): _compile(*row, paths) for row in rows}
+
+
+class _Rules:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._rules = {}
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        checked_at = self._checked_at
+        return checked_at is not None and time.monotonic() - checked_at < self.ttl
+
+    def get(self, code):
+        if not self.is_fresh():
+            self._refresh()
+        return self._rules.get(code.upper())
+
+    def version(self):
+        if not self.is_fresh():
+            self._refresh()
+        return self._version or "0"
+
+    def _refresh(self):
+        with self._lock:
+            if self.is_fresh():
+                return
+            # Read before loading: a change landing in between bumps the
+            # version again and gets picked up by the next check
+            version = r.get(PROMO_VERSION_KEY)
+            if self._checked_at is None or version != self._version:
+                self._rules = _load_rules()
+                self._version = version
+            self._checked_at = time.monotonic()
+
+
+_rules = _Rules(settings.PROMO_RULES_TTL)
+
+
+def bump_promo_version():
+    return r.incr(PROMO_VERSION_KEY)
+
+
+def validate(promo_code):
+    """The Rule for promo_code if it is active and valid now, else None."""
+    rule = _rules.get(promo_code)
+    if rule is None or not rule.is_valid(timezone.now()):
+        return None
+    return rule
+
+
+async def avalidate(promo_code):
+    if _rules.is_fresh():
+        return validate(promo_code)
+    return await sync_to_async(validate)(promo_code)
+
+
+def version(promo_code):
+    """
+    Changes whenever the discount for promo_code may have: the rules were
+    reloaded, or the code's rule started or stopped being valid. Cached
+    discounts computed at another version are evaluated again (totals.py).
+    """
+    valid = validate(promo_code) is not None
+    return f"{_rules.version()}:{int(valid)}"
+
+
+async def aversion(promo_code):
+    if _rules.is_fresh():
+        return version(promo_code)
+    return await sync_to_async(version)(promo_code)
+
+
+def evaluate(promo_code, lines, products):
+    """CART_PROMO_EVALUATOR: discount in cents, 0 for an invalid code."""
+    rule = validate(promo_code)
+    return rule.discount(lines, products) if rule else 0
@@ -1,21 +1,44 @@
 # redis_cart.py
-import json
+import functools
 
+import redis
 from django.conf import settings
+from redis.cache import CacheKey
 
-r = settings.REDIS_CLIENT
+from core.redis_client import (
+    get_cached_redis,
+    get_redis,
+    get_replica_redis,
+    hash_tag,
+    is_cluster,
+)
+from core.redis_session import session_redis_key
+from inventory.catalog import get_catalog_version, get_products
+from inventory.stock import HOLDERS_KEY, holds_key, stock_keys
 
-CART_TTL = 60 * 30  # 30 minutes
+from . import expiry, idempotency, lua_scripts, owners, persistence, promotions, totals
 
+r = get_redis()
 
-def _refresh_cart_ttl_pipe(pipe, session_id):
-    pipe.expire(_qty_key(session_id), CART_TTL)
-    pipe.expire(_details_key(session_id), CART_TTL)
-    pipe.expire(f"{_cart_key(session_id)}:promo_code", CART_TTL)
+# Cart reads go through the near-cache client, or to replicas, when enabled
+reader = get_cached_redis() if settings.CART_NEAR_CACHE else get_replica_redis()
+_near_cache = reader.get_cache() if hasattr(reader, "get_cache") else None
+
+CART_TTL = settings.CART_TTL
+CART_USER_TTL = settings.CART_USER_TTL
+
+# Returned by the line scripts when the product doesn't have enough stock left
+OUT_OF_STOCK = -1
+
+
+class InsufficientStock(Exception):
+    pass
 
 
 def _cart_key(session_id):
-    return f"cart:{session_id}"
+    # Tagged with the session id in cluster mode, like the session key, so
+    # all the keys of one cart script share a slot
+    return f"cart:{hash_tag(session_id)}"
 
 
 def _qty_key(session_id):
@@ -26,173 +49,476 @@ def _details_key(session_id):
     return f"{_cart_key(session_id)}:details"
 
 
-def add_to_cart(session_id, product_id, quantity, name, price):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-
-    pipe = r.pipeline()
-    pipe.hincrby(qty_key, product_id, quantity)
-
-    if not r.hexists(details_key, product_id):
-        product_data = {
-            "product_id": product_id,
-            "name": name,
-            "price": float(price),
-        }
-        pipe.hset(details_key, product_id, json.dumps(product_data))
-
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
-
+def _promo_key(session_id):
+    return f"{_cart_key(session_id)}:promo_code"
+
+
+def _compact():
+    # Read on every call, not at import, so tests can switch layouts
+    return settings.CART_LAYOUT == "compact"
+
+
+@functools.cache
+def _script_sources(layout, persist, session_ttl):
+    if layout == "compact":
+        prelude, lua = lua_scripts.COMPACT_PRELUDE, lua_scripts.COMPACT
+    else:
+        prelude, lua = lua_scripts.SPLIT_PRELUDE, lua_scripts.SPLIT
+    prelude = lua_scripts.SETTINGS_PRELUDE % (str(persist).lower(), session_ttl) + prelude
+
+    def head(name):
+        if name in lua_scripts.RESTORING:
+            return prelude + lua_scripts.RESTORE_CHECK
+        return prelude
+
+    sources = {name: head(name) + body for name, body in lua.items()}
+    for name in lua_scripts.IDEMPOTENT_OPS:
+        sources[("idempotent", name)] = (
+            lua_scripts.IDEMPOTENT_PRELUDE
+            + head(name)
+            + lua_scripts.IDEMPOTENT_BEGIN
+            + lua[name]
+            + lua_scripts.IDEMPOTENT_END
+        )
+    return sources
+
+
+def script_sources():
+    """
+    {name: Lua source} of the cart scripts for the current layout and
+    persistence settings; ("idempotent", name) for the idempotent variants.
+    """
+    return _script_sources(
+        settings.CART_LAYOUT, settings.CART_PERSISTENCE, settings.SESSION_COOKIE_AGE
+    )
+
+
+# register_script only hashes the source; redis-py sends EVALSHA and reloads
+# the script by itself if the server answers NOSCRIPT (restart, SCRIPT FLUSH).
+@functools.cache
+def _script(source):
+    return r.register_script(source)
+
+
+_release_holds = r.register_script(lua_scripts.RELEASE_HOLDS)
+
+
+def load_scripts():
+    # Called once at startup so the first request doesn't pay the NOSCRIPT retry.
+    sources = script_sources().values()
+    try:
+        if is_cluster():
+            # SCRIPT LOAD goes to every primary; cluster pipelines can't route it
+            for source in sources:
+                r.script_load(source)
+            return
+        pipe = r.pipeline(transaction=False)
+        for source in sources:
+            pipe.script_load(source)
+        pipe.execute()
+    except redis.ConnectionError:
+        pass  # Redis not up yet, scripts get loaded lazily on first use
+
+
+def _cart_keys(session_id):
+    keys = [_qty_key(session_id), _details_key(session_id), _promo_key(session_id)]
+    if _compact():
+        keys.insert(0, _cart_key(session_id))
+    return keys
+
+
+def _ttl(session_id):
+    return CART_USER_TTL if owners.is_user_cart(session_id) else CART_TTL
+
+
+def _session_key(session_id):
+    # The session refreshed by the cart scripts. A user cart without one, or
+    # whose session is in another slot (cluster), names its own session key,
+    # which never exists; _after_write refreshes the session in cluster mode.
+    session_key = owners.session_key(session_id)
+    if session_key is None or (session_key != session_id and is_cluster()):
+        return session_redis_key(session_id)
+    return session_redis_key(session_key)
+
+
+def _keys(session_id):
+    keys = _cart_keys(session_id)
+    # The session key is refreshed with the cart so both expire together
+    keys.append(_session_key(session_id))
+    if not is_cluster():
+        keys.extend(
+            (
+                expiry.index_key(session_id),
+                persistence.CHANGES_KEY,
+                persistence.DIRTY_KEY,
+                persistence.restored_key(session_id),
+            )
+        )
+    if settings.STOCK_RESERVATIONS:
+        keys.extend(stock_keys(session_id))
+    return keys
+
+
+def _forget(session_id):
+    # Our own writes don't wait for Redis to push the invalidation
+    if _compact():
+        cart_key = _cart_key(session_id)
+        cached = [CacheKey("HGETALL", (cart_key,)), CacheKey("HMGET", (cart_key,))]
+    else:
+        qty_key = _qty_key(session_id)
+        cached = [
+            CacheKey("HGETALL", (qty_key,)),
+            CacheKey("HMGET", (qty_key,)),
+            CacheKey("GET", (_promo_key(session_id),)),
+        ]
+    _near_cache.delete_by_cache_keys(cached)
+
+
+def _call(source, session_id, keys, args):
+    script = _script(source)
+    reply = script(keys=keys, args=args)
+    if reply == lua_scripts.NEEDS_RESTORE:
+        # A user cart Redis lost: bring its copy back, then apply the change
+        persistence.restore(session_id)
+        reply = script(keys=keys, args=args)
+    return reply
+
+
+def _run(name, session_id, *args):
+    keys, args = _keys(session_id), [_ttl(session_id), *args]
+    request = idempotency.claim(name)
+    if request is not None:
+        keys, args = idempotency.script_args(request, session_id, keys, args)
+        reply = _call(script_sources()[("idempotent", name)], session_id, keys, args)
+        result = idempotency.result(request, reply)
+        if request.replayed:
+            return result
+    else:
+        result = _call(script_sources()[name], session_id, keys, args)
+    if name != "get":
+        _after_write(name, session_id)
+    return result
+
+
+def _after_write(name, session_id):
+    if _near_cache is not None:
+        _forget(session_id)
+    if is_cluster() and name not in lua_scripts.MAINTENANCE:
+        if name == "clear":
+            expiry.record_clear(session_id)
+        else:
+            expiry.record_touch(session_id)
+            session_key = owners.session_key(session_id)
+            if session_key not in (None, session_id):
+                r.expire(session_redis_key(session_key), settings.SESSION_COOKIE_AGE)
+
+
+def _get_compact_cart(session_id):
+    fields = _run("get", session_id)
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+def _parse_lines(cart):
+    # Compact lines written before product details moved to the catalog
+    # cache are packed as "quantity|price|name".
+    return {
+        int(pid): int(value.split("|", 1)[0])
+        for pid, value in cart.items()
+        if not pid.startswith("_")
+    }
 
-def get_cart(session_id):
-    qtys = r.hgetall(_qty_key(session_id))
-    details = r.hgetall(_details_key(session_id))
 
+def _cart_items(lines, products):
     cart_items = []
 
-    for pid, qty in qtys.items():
-        detail_json = details.get(pid)
-        if not detail_json:
+    for pid, qty in lines.items():
+        product = products.get(pid)
+        if not product:
             continue
 
-        data = json.loads(detail_json)
-        data["quantity"] = int(qty)
-        cart_items.append(data)
+        cart_items.append(
+            {
+                "product_id": pid,
+                "name": product["name"],
+                "price": product["price"],
+                "quantity": qty,
+            }
+        )
 
     return cart_items
 
 
-def remove_from_cart(session_id, product_id):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-    promo_key = f"{_cart_key(session_id)}:promo_code"
+def _read_compact_cart(session_id):
+    if reader is r:
+        return _get_compact_cart(session_id)
+    # A plain HGETALL can be cached and served by replicas, the migrating get
+    # script can't. An empty answer may be a split layout cart (or one the
+    # replica hasn't caught up with), so ask the primary.
+    cart = reader.hgetall(_cart_key(session_id))
+    return cart or _get_compact_cart(session_id)
 
-    pipe = r.pipeline()
-    pipe.hdel(qty_key, product_id)
-    pipe.hdel(details_key, product_id)
 
-    if r.hlen(qty_key) == 0:  # 1 left before deletion
-        pipe.delete(promo_key)
+def _read_cart(session_id):
+    # The hash holding the lines and the totals (and the promo code, compact)
+    compact = _compact()
+    if compact:
+        fields = _read_compact_cart(session_id)
+    else:
+        fields = reader.hgetall(_qty_key(session_id))
+    if not fields and settings.CART_PERSISTENCE and persistence.restore(session_id):
+        # From the primary: replicas may not have the restored cart yet
+        fields = _get_compact_cart(session_id) if compact else r.hgetall(_qty_key(session_id))
+    return fields
 
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
 
+def get_cart_lines(session_id):
+    """Return the raw {product_id: quantity} lines of a cart."""
+    return _parse_lines(_read_cart(session_id))
 
-def clear_cart(session_id):
-    pipe = r.pipeline()
-    pipe.delete(_qty_key(session_id))
-    pipe.delete(_details_key(session_id))
-    pipe.delete(f"{_cart_key(session_id)}:promo_code")
-    pipe.execute()
 
+def get_cart(session_id):
+    lines = get_cart_lines(session_id)
+    return _cart_items(lines, get_products(lines))
+
+
+def get_cart_summary(session_id):
+    """
+    {"items", "promo_code", "totals"} from one read of the cart. Totals that
+    drifted from the current prices are corrected, and the promo discount is
+    only evaluated again if the cart changed since the last time.
+    """
+    fields = _read_cart(session_id)
+    promo_code = fields.get("_promo") if _compact() else reader.get(_promo_key(session_id))
+    lines = _parse_lines(fields)
+    # Read before the prices, so the totals are never stamped newer than them
+    catalog_version = get_catalog_version()
+    products = get_products(lines)
+    version = promotions.version(promo_code) if promo_code else ""
+    cart_totals, writes = totals.settle(
+        fields, lines, products, promo_code, version, catalog_version
+    )
+    for name, args in writes:
+        _run(name, session_id, *args)
+    return {
+        "items": _cart_items(lines, products),
+        "promo_code": promo_code,
+        "totals": cart_totals,
+    }
 
-def increment_quantity(session_id, product_id, step=1):
-    pipe = r.pipeline()
-    pipe.hincrby(_qty_key(session_id), product_id, step)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
-    return True
 
+def _totals_fields(session_id):
+    names = totals.TOTAL_FIELDS
+    compact = _compact()
+    if compact:
+        names += ("_promo",)
+        values = reader.hmget(_cart_key(session_id), names)
+    else:
+        values = reader.hmget(_qty_key(session_id), names)
+    fields = {name: value for name, value in zip(names, values) if value is not None}
+    if not compact:
+        fields["_promo"] = reader.get(_promo_key(session_id))
+    return fields
 
-def decrement_quantity(session_id, product_id, step=1):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
 
-    MAX_ATTEMPTS = 5
+def get_cart_totals(session_id):
+    """
+    {"items", "subtotal", "discount", "total"} from the running totals, without
+    reading the lines. Carts without totals yet, or whose totals or discount
+    are out of date, go through get_cart_summary.
+    """
+    fields = _totals_fields(session_id)
+    stored = totals.stored(fields, get_catalog_version())
+    promo_code = fields.get("_promo")
+    discount = 0
+    if promo_code:
+        discount = totals.stored_discount(fields, promotions.version(promo_code))
+    if stored is None or discount is None:
+        return get_cart_summary(session_id)["totals"]
+    return totals.as_response(*stored, discount)
 
-    for attempt in range(MAX_ATTEMPTS):
-        try:
-            with r.pipeline() as pipe:
-                pipe.watch(qty_key)
 
-                # Use direct client method (not through pipe)
-                current_qty = r.hget(qty_key, product_id)
-                if current_qty is None:
-                    pipe.unwatch()
-                    return False
+def _check_stock(result):
+    if result == OUT_OF_STOCK:
+        raise InsufficientStock()
+    return bool(result)
 
-                current_qty = int(current_qty)
-                new_qty = current_qty - step
 
-                pipe.multi()
+def _price(products, product_id):
+    # Unit price in cents for the running subtotal; 0 for a product that
+    # isn't available, whose line doesn't count
+    product = products.get(product_id)
+    return totals.cents(product["price"]) if product else 0
 
-                if new_qty < 1:
-                    pipe.hdel(qty_key, product_id)
-                    pipe.hdel(details_key, product_id)
-                else:
-                    pipe.hset(qty_key, product_id, new_qty)
 
-                _refresh_cart_ttl_pipe(pipe, session_id)
-                pipe.execute()
-                return True
+def _unit_price(product_id):
+    return _price(get_products([product_id]), product_id)
 
-        except r.WatchError:
-            continue
 
+def add_to_cart(session_id, product_id, quantity):
+    price = _unit_price(product_id)
+    _check_stock(_run("add", session_id, product_id, quantity, price))
 
-# def decrement_quantity(session_id, product_id, step=1):
-#     qty_key = _qty_key(session_id)
-#     details_key = _details_key(session_id)
 
-#     # First, decrement and get new quantity
-#     new_qty = r.hincrby(qty_key, product_id, -step)
+def remove_from_cart(session_id, product_id):
+    _run("remove", session_id, product_id, 0, _unit_price(product_id))
+
+
+def _batch_args(operations, products):
+    args = []
+    for operation in operations:
+        product_id = operation["product_id"]
+        args.extend(
+            (
+                operation["op"],
+                product_id,
+                operation.get("quantity", 1),
+                _price(products, product_id),
+            )
+        )
+    return args
+
+
+def _batch_result(operation, result):
+    outcome = {
+        "op": operation["op"],
+        "product_id": operation["product_id"],
+        "applied": result == 1,
+    }
+    if result == OUT_OF_STOCK:
+        outcome["error"] = "Not enough stock."
+    return outcome
 
-#     if new_qty < 1:
-#         # Quantity too low, clean up
-#         pipe = r.pipeline()
-#         pipe.hdel(qty_key, product_id)
-#         pipe.hdel(details_key, product_id)
-#         _refresh_cart_ttl_pipe(pipe, session_id)
-#         pipe.execute()
-#     else:
-#         # Just refresh TTL
-#         pipe = r.pipeline()
-#         _refresh_cart_ttl_pipe(session_id)
-#         pipe.execute()
 
-#     return True
+def _batch_results(operations, applied):
+    return [
+        _batch_result(operation, result)
+        for operation, result in zip(operations, applied)
+    ]
 
 
-def set_quantity(session_id, product_id, quantity):
-    key = _cart_key(session_id)
-    existing = r.hget(key, product_id)
+def apply_batch(session_id, operations):
+    """
+    Apply a list of {"op", "product_id", "quantity"} line operations (op is
+    one of add, remove, inc, dec, set) in a single atomic script call, in
+    order. Returns one {"op", "product_id", "applied"} result per operation;
+    an add/inc/set refused for lack of stock also carries an "error".
+    """
+    if not operations:
+        return []
+    products = get_products({operation["product_id"] for operation in operations})
+    applied = _run("batch", session_id, *_batch_args(operations, products))
+    return _batch_results(operations, applied)
 
-    if not existing:
-        return False  # Nothing to update
 
-    data = json.loads(existing)
-    data["quantity"] = quantity
-    r.hset(key, product_id, json.dumps(data))
+def clear_cart(session_id):
+    _run("clear", session_id)
 
-    pipe = r.pipeline()
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
 
-    return True
+def increment_quantity(session_id, product_id, step=1):
+    price = _unit_price(product_id)
+    return _check_stock(_run("inc", session_id, product_id, step, price))
 
 
-def set_cart_promo_code(session_id, promo_code):
-    pipe = r.pipeline()
-    pipe.set(f"{_cart_key(session_id)}:promo_code", promo_code)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def decrement_quantity(session_id, product_id, step=1):
+    return bool(_run("dec", session_id, product_id, step, _unit_price(product_id)))
 
 
-def get_cart_promo_code(session_id):
-    key = f"cart:{session_id}:promo_code"
-    return r.get(key)
+def set_quantity(session_id, product_id, quantity):
+    price = _unit_price(product_id)
+    return _check_stock(_run("set", session_id, product_id, quantity, price))
 
 
-def update_cart_item(session_id, product_id, name, price, quantity):
-    pipe = r.pipeline()
-    details = {
-        "product_id": product_id,
-        "name": name,
-        "price": float(price),
-    }
+def set_cart_promo_code(session_id, promo_code):
+    _run("promo", session_id, promo_code)
+
 
-    pipe.hset(_details_key(session_id), product_id, json.dumps(details))
-    pipe.hset(_qty_key(session_id), product_id, quantity)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def get_cart_promo_code(session_id):
+    if _compact():
+        return _read_compact_cart(session_id).get("_promo")
+    return reader.get(_promo_key(session_id))
+
+
+def merge_carts(source_id, target_id):
+    """
+    Move every line of the source cart into the target cart in one atomic
+    script call, adding up the quantities of the products in both, and delete
+    the source cart. Its promo code, if it has one, replaces the target's.
+    Returns the number of lines merged.
+    """
+    if not source_id or source_id == target_id:
+        return 0
+    if is_cluster():
+        return _merge_across_slots(source_id, target_id)
+    keys = _keys(target_id)
+    source_keys = _cart_keys(source_id)
+    if settings.STOCK_RESERVATIONS:
+        source_keys.append(holds_key(source_id))
+    source_keys.append(expiry.index_key(source_id))
+    merged = _call(
+        script_sources()["merge"],
+        target_id,
+        keys + source_keys,
+        [_ttl(target_id), source_id, len(keys) + 1],
+    )
+    _after_write("merge", target_id)
+    if _near_cache is not None:
+        _forget(source_id)
+    return merged
+
+
+def _merge_across_slots(source_id, target_id):
+    # The carts hash to different slots, so no script sees both. Nothing
+    # writes to the source any more (its session was rotated at login):
+    # replay its lines as adds, then drop it.
+    if _compact():
+        fields = _get_compact_cart(source_id)
+        promo_code = fields.get("_promo")
+    else:
+        fields = r.hgetall(_qty_key(source_id))
+        promo_code = r.get(_promo_key(source_id))
+    lines = _parse_lines(fields)
+    if not lines:
+        return 0
+    apply_batch(
+        target_id,
+        [{"op": "add", "product_id": pid, "quantity": qty} for pid, qty in lines.items()],
+    )
+    if promo_code:
+        set_cart_promo_code(target_id, promo_code)
+    clear_cart(source_id)
+    return len(lines)
+
+
+def release_holds(session_ids):
+    """
+    Give back the stock held by carts that no longer exist (expired). Carts
+    still alive keep their holds. Returns how many carts released something.
+    """
+    if not session_ids:
+        return 0
+    compact = _compact()
+    pipe = r.pipeline(transaction=False)
+    for session_id in session_ids:
+        cart_key = _cart_key(session_id) if compact else _qty_key(session_id)
+        _release_holds(
+            keys=[cart_key, *stock_keys(session_id)],
+            args=[session_id],
+            client=pipe,
+        )
+    return sum(pipe.execute())
+
+
+def release_orphaned_holds(batch_size):
+    """
+    Safety net for holds the expiry sweep missed (e.g. carts that expired
+    while the sweeper was down): walk stock:holders and release every cart
+    that is gone.
+    """
+    released = 0
+    batch = []
+    for session_id in r.sscan_iter(HOLDERS_KEY, count=batch_size):
+        batch.append(session_id)
+        if len(batch) == batch_size:
+            released += release_holds(batch)
+            batch = []
+    return released + release_holds(batch)
@@ -0,0 +1,218 @@
+# redis_cart_async.py
+#
+# redis.asyncio version of the redis_cart API, for the ASGI cart views. Same
+# keys, same Lua scripts, so sync and async views can serve the same carts.
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core.redis_async import get_async_redis, get_async_replica_redis
+from core.redis_client import is_cluster
+from core.redis_session import session_redis_key
+from inventory.catalog import aget_catalog_version, aget_products
+
+from . import idempotency, owners, persistence, promotions, totals
+from .expiry import index_key
+from .lua_scripts import MAINTENANCE, NEEDS_RESTORE
+from .redis_cart import (
+    _batch_args,
+    _batch_results,
+    _cart_key,
+    _check_stock,
+    _cart_items,
+    _compact,
+    _keys,
+    _parse_lines,
+    _price,
+    _promo_key,
+    _qty_key,
+    _ttl,
+    script_sources,
+)
+
+# AsyncScript objects are bound to a client, so keep one set per client,
+# by source.
+_scripts = weakref.WeakKeyDictionary()
+
+
+def _script(client, name):
+    source = script_sources()[name]
+    scripts = _scripts.get(client)
+    if scripts is None:
+        scripts = _scripts[client] = {}
+    script = scripts.get(source)
+    if script is None:
+        script = scripts[source] = client.register_script(source)
+    return script
+
+
+async def _call(client, name, session_id, keys, args):
+    script = _script(client, name)
+    reply = await script(keys=keys, args=args)
+    if reply == NEEDS_RESTORE:
+        await sync_to_async(persistence.restore)(session_id)
+        reply = await script(keys=keys, args=args)
+    return reply
+
+
+async def _run(name, session_id, *args):
+    client = get_async_redis()
+    keys, args = _keys(session_id), [_ttl(session_id), *args]
+    request = idempotency.claim(name)
+    if request is not None:
+        keys, args = idempotency.script_args(request, session_id, keys, args)
+        reply = await _call(client, ("idempotent", name), session_id, keys, args)
+        result = idempotency.result(request, reply)
+        if request.replayed:
+            return result
+    else:
+        result = await _call(client, name, session_id, keys, args)
+    if name != "get" and name not in MAINTENANCE and is_cluster():
+        # The index is in another slot, see cart.expiry
+        if name == "clear":
+            await client.zrem(index_key(session_id), session_id)
+        else:
+            await client.zadd(index_key(session_id), {session_id: time.time()})
+            session_key = owners.session_key(session_id)
+            if session_key not in (None, session_id):
+                await client.expire(session_redis_key(session_key), settings.SESSION_COOKIE_AGE)
+    return result
+
+
+async def _get_compact_cart(session_id):
+    fields = await _run("get", session_id)
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+async def _read_compact_cart(session_id):
+    replica = get_async_replica_redis()
+    if replica is get_async_redis():
+        return await _get_compact_cart(session_id)
+    cart = await replica.hgetall(_cart_key(session_id))
+    return cart or await _get_compact_cart(session_id)
+
+
+async def _read_cart(session_id):
+    compact = _compact()
+    if compact:
+        fields = await _read_compact_cart(session_id)
+    else:
+        fields = await get_async_replica_redis().hgetall(_qty_key(session_id))
+    if not fields and settings.CART_PERSISTENCE:
+        if await sync_to_async(persistence.restore)(session_id):
+            if compact:
+                return await _get_compact_cart(session_id)
+            return await get_async_redis().hgetall(_qty_key(session_id))
+    return fields
+
+
+async def get_cart_lines(session_id):
+    return _parse_lines(await _read_cart(session_id))
+
+
+async def get_cart(session_id):
+    lines = await get_cart_lines(session_id)
+    return _cart_items(lines, await aget_products(lines))
+
+
+async def get_cart_summary(session_id):
+    fields = await _read_cart(session_id)
+    if _compact():
+        promo_code = fields.get("_promo")
+    else:
+        promo_code = await get_async_replica_redis().get(_promo_key(session_id))
+    lines = _parse_lines(fields)
+    catalog_version = await aget_catalog_version()
+    products = await aget_products(lines)
+    if promo_code:
+        # The promo evaluator may have to reload its rules from Postgres
+        version = await promotions.aversion(promo_code)
+        settle = sync_to_async(totals.settle)
+        cart_totals, writes = await settle(
+            fields, lines, products, promo_code, version, catalog_version
+        )
+    else:
+        cart_totals, writes = totals.settle(
+            fields, lines, products, promo_code, "", catalog_version
+        )
+    for name, args in writes:
+        await _run(name, session_id, *args)
+    return {
+        "items": _cart_items(lines, products),
+        "promo_code": promo_code,
+        "totals": cart_totals,
+    }
+
+
+async def get_cart_totals(session_id):
+    replica = get_async_replica_redis()
+    names = totals.TOTAL_FIELDS
+    compact = _compact()
+    if compact:
+        names += ("_promo",)
+        values = await replica.hmget(_cart_key(session_id), names)
+    else:
+        values = await replica.hmget(_qty_key(session_id), names)
+    fields = {name: value for name, value in zip(names, values) if value is not None}
+    if not compact:
+        fields["_promo"] = await replica.get(_promo_key(session_id))
+    stored = totals.stored(fields, await aget_catalog_version())
+    promo_code = fields.get("_promo")
+    discount = 0
+    if promo_code:
+        discount = totals.stored_discount(fields, await promotions.aversion(promo_code))
+    if stored is None or discount is None:
+        return (await get_cart_summary(session_id))["totals"]
+    return totals.as_response(*stored, discount)
+
+
+async def _unit_price(product_id):
+    return _price(await aget_products([product_id]), product_id)
+
+
+async def add_to_cart(session_id, product_id, quantity):
+    price = await _unit_price(product_id)
+    _check_stock(await _run("add", session_id, product_id, quantity, price))
+
+
+async def remove_from_cart(session_id, product_id):
+    await _run("remove", session_id, product_id, 0, await _unit_price(product_id))
+
+
+async def apply_batch(session_id, operations):
+    if not operations:
+        return []
+    products = await aget_products({operation["product_id"] for operation in operations})
+    applied = await _run("batch", session_id, *_batch_args(operations, products))
+    return _batch_results(operations, applied)
+
+
+async def clear_cart(session_id):
+    await _run("clear", session_id)
+
+
+async def increment_quantity(session_id, product_id, step=1):
+    price = await _unit_price(product_id)
+    return _check_stock(await _run("inc", session_id, product_id, step, price))
+
+
+async def decrement_quantity(session_id, product_id, step=1):
+    price = await _unit_price(product_id)
+    return bool(await _run("dec", session_id, product_id, step, price))
+
+
+async def set_quantity(session_id, product_id, quantity):
+    price = await _unit_price(product_id)
+    return _check_stock(await _run("set", session_id, product_id, quantity, price))
+
+
+async def set_cart_promo_code(session_id, promo_code):
+    await _run("promo", session_id, promo_code)
+
+
+async def get_cart_promo_code(session_id):
+    if _compact():
+        return (await _read_compact_cart(session_id)).get("_promo")
+    return await get_async_replica_redis().get(_promo_key(session_id))
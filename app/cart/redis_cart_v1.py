@@ -1,8 +1,8 @@
-from django.conf import settings
+from core.redis_client import get_redis
 import json
 
 
-r = settings.REDIS_CLIENT
+r = get_redis()
 
 CART_TTL = 60 * 30  # 30 minutes
 
@@ -9,10 +9,21 @@ class CartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1, default=1)
 
 
+class CartTotalsSerializer(serializers.Serializer):
+    items = serializers.IntegerField()
+    subtotal = serializers.FloatField()
+    discount = serializers.FloatField()
+    total = serializers.FloatField()
+
+
+class CartSummarySerializer(serializers.Serializer):
+    items = CartItemSerializer(many=True)
+    promo_code = serializers.CharField(allow_null=True)
+    totals = CartTotalsSerializer()
+
+
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
-    name = serializers.CharField()
-    price = serializers.FloatField()
     quantity = serializers.IntegerField(min_value=1, default=1)
 
 
@@ -34,6 +45,25 @@ class CartPromoSerializer(serializers.Serializer):
     promo_code = serializers.CharField()
 
 
+class CartBatchOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=["add", "remove", "inc", "dec", "set"])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartBatchOperationSerializer(
+        many=True, allow_empty=False, max_length=100
+    )
+
+
+class CartBatchResultSerializer(serializers.Serializer):
+    op = serializers.CharField()
+    product_id = serializers.IntegerField()
+    applied = serializers.BooleanField()
+    error = serializers.CharField(required=False)
+
+
 class CheckoutResponseItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     name = serializers.CharField()
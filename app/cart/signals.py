@@ -0,0 +1,32 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from inventory.models import Category
+
+from .models import Promo
+from .owners import bind_session, user_cart_id
+from .promotions import bump_promo_version
+from .redis_cart import merge_carts
+
+
+# Every process reloads its compiled rules once it sees the new version. The
+# rules hold the category subtrees, so category changes count too.
+@receiver(post_save, sender=Promo)
+@receiver(post_delete, sender=Promo)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_promo_rules(sender, **kwargs):
+    transaction.on_commit(bump_promo_version)
+
+
+# login() rotates the session key, which would orphan the anonymous cart
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    session = getattr(request, "session", None)
+    anonymous_id = getattr(session, "previous_session_key", None)
+    if anonymous_id:
+        cart = user_cart_id(user.pk)
+        bind_session(cart, session.session_key)
+        merge_carts(anonymous_id, cart)
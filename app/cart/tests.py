@@ -1,3 +1,824 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.utils import timezone
+from redis.cache import CacheConfig, CacheEntry, CacheEntryStatus, CacheKey, DefaultCache
+
+from core.redis_client import get_redis
+from inventory.models import Category, Product
+from inventory.stock import AVAILABLE_KEY
+
+from . import expiry, persistence, promotions, redis_cart
+from .models import Cart, Promo
+from .owners import user_cart_id
+
+r = get_redis()
+
+
+class CartTestCase(TestCase):
+    """Cart endpoint tests, on the fakeredis server of core.settings_bench."""
+
+    def setUp(self):
+        r.flushall()
+        self.category = Category.objects.create(name="Audio", slug="audio", is_active=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tracked = Product.objects.create(
+                category=self.category,
+                name="Amp",
+                slug="amp",
+                price="9.99",
+                stock=5,
+                is_active=True,
+            )
+            self.untracked = Product.objects.create(
+                category=self.category, name="Cable", slug="cable", price="1.50", is_active=True
+            )
+
+    def _post(self, path, data, **headers):
+        return self.client.post(
+            f"/api/cart/{path}", data, content_type="application/json", **headers
+        )
+
+    def _add(self, product, quantity=1, **headers):
+        return self._post("add/", {"product_id": product.id, "quantity": quantity}, **headers)
+
+    def _lines(self):
+        summary = self.client.get("/api/cart/get/").json()
+        return {item["product_id"]: item["quantity"] for item in summary["items"]}
+
+
+class CartLineTests(CartTestCase):
+    def test_line_operations(self):
+        self.assertEqual(self._add(self.tracked, 2).status_code, 200)
+        self._add(self.tracked)
+        self._add(self.untracked, 4)
+        self.assertEqual(self._lines(), {self.tracked.id: 3, self.untracked.id: 4})
+
+        self._post("update/", {"product_id": self.tracked.id, "action": "inc"})
+        self._post("update/", {"product_id": self.untracked.id, "action": "dec"})
+        self.assertEqual(self._lines(), {self.tracked.id: 4, self.untracked.id: 3})
+
+        response = self._post("update/quantity", {"product_id": self.tracked.id, "quantity": 1})
+        self.assertEqual(response.status_code, 200)
+        response = self._post("update/quantity", {"product_id": 999, "quantity": 1})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self._lines(), {self.tracked.id: 1, self.untracked.id: 3})
+
+        # The last unit going removes the line
+        self._post("update/", {"product_id": self.tracked.id, "action": "dec"})
+        self.assertEqual(self._lines(), {self.untracked.id: 3})
+        self._post("delete/", {"product_id": self.untracked.id})
+        self.assertEqual(self._lines(), {})
+
+    def test_unknown_products_are_refused(self):
+        self.assertEqual(self._add(Product(id=999)).status_code, 404)
+        response = self._post("update/", {"product_id": 999, "action": "inc"})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self._lines(), {})
+
+    def test_clear(self):
+        self._add(self.tracked, 2)
+        self.assertEqual(self.client.delete("/api/cart/get/").status_code, 204)
+        self.assertEqual(self._lines(), {})
+        self.assertEqual(r.keys("cart:*"), [])
+
+    def test_cart_keys_expire(self):
+        self._add(self.tracked)
+        keys = r.keys("cart:*")
+        self.assertTrue(keys)
+        for key in keys:
+            self.assertGreater(r.ttl(key), 0)
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutCartLineTests(CartLineTests):
+    def test_lines_are_kept_in_the_qty_hash(self):
+        self._add(self.tracked, 2)
+        session_id = self.client.session.session_key
+        self.assertEqual(r.hget(f"cart:{session_id}:qty", self.tracked.id), "2")
+        self.assertFalse(r.exists(f"cart:{session_id}"))
+
+
+class LayoutMigrationTests(CartTestCase):
+    def _split_cart(self, cart, lines, promo_code):
+        if lines:
+            r.hset(f"cart:{cart}:qty", mapping=lines)
+        r.set(f"cart:{cart}:promo_code", promo_code)
+
+    def test_split_carts_are_rewritten_compact(self):
+        self._split_cart("old", {self.tracked.id: 2}, "SAVE10")
+        self.assertEqual(redis_cart.get_cart_lines("old"), {self.tracked.id: 2})
+        self.assertEqual(redis_cart.get_cart_promo_code("old"), "SAVE10")
+        self.assertEqual(r.keys("cart:old*"), ["cart:old"])
+        self.assertGreater(r.ttl("cart:old"), 0)
+
+    def test_a_promo_without_lines_is_kept(self):
+        self._split_cart("old", {}, "SAVE10")
+        self.assertEqual(redis_cart.get_cart_promo_code("old"), "SAVE10")
+        self.assertEqual(r.keys("cart:old*"), ["cart:old"])
+
+
+class CartBatchTests(CartTestCase):
+    def _batch(self, *operations, path="batch/"):
+        response = self._post(path, {"operations": list(operations)})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_operations_apply_in_order(self):
+        results = self._batch(
+            {"op": "add", "product_id": self.tracked.id, "quantity": 2},
+            {"op": "add", "product_id": self.untracked.id, "quantity": 3},
+            {"op": "inc", "product_id": self.tracked.id},
+            {"op": "dec", "product_id": self.untracked.id},
+            {"op": "set", "product_id": self.untracked.id, "quantity": 5},
+            {"op": "remove", "product_id": self.tracked.id},
+            {"op": "add", "product_id": self.tracked.id},
+        )
+        self.assertTrue(all(result["applied"] for result in results))
+        self.assertEqual(self._lines(), {self.tracked.id: 1, self.untracked.id: 5})
+
+    def test_results_per_operation(self):
+        results = self._batch(
+            {"op": "add", "product_id": 999},
+            {"op": "add", "product_id": self.tracked.id, "quantity": 6},
+            {"op": "inc", "product_id": self.untracked.id},
+            {"op": "add", "product_id": self.tracked.id, "quantity": 5},
+        )
+        self.assertEqual(
+            results,
+            [
+                {"op": "add", "product_id": 999, "applied": False, "error": "Product not found."},
+                {
+                    "op": "add",
+                    "product_id": self.tracked.id,
+                    "applied": False,
+                    "error": "Not enough stock.",
+                },
+                {"op": "inc", "product_id": self.untracked.id, "applied": False},
+                {"op": "add", "product_id": self.tracked.id, "applied": True},
+            ],
+        )
+        self.assertEqual(self._lines(), {self.tracked.id: 5})
+
+    def test_invalid_batches_are_refused(self):
+        self.assertEqual(self._post("batch/", {"operations": []}).status_code, 400)
+        operations = [{"op": "add", "product_id": self.tracked.id}] * 101
+        self.assertEqual(self._post("batch/", {"operations": operations}).status_code, 400)
+        response = self._post("batch/", {"operations": [{"op": "swap", "product_id": 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._lines(), {})
+
+    def test_async_batch(self):
+        results = self._batch(
+            {"op": "add", "product_id": self.tracked.id, "quantity": 2},
+            {"op": "add", "product_id": 999},
+            path="async/batch/",
+        )
+        self.assertEqual([result["applied"] for result in results], [True, False])
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutCartBatchTests(CartBatchTests):
+    pass
+
+class AsyncCartTests(CartTestCase):
+    async def _apost(self, path, data, client=None, **kwargs):
+        client = client or self.async_client
+        return await client.post(
+            f"/api/cart/async/{path}", data, content_type="application/json", **kwargs
+        )
+
+    async def _alines(self):
+        summary = (await self.async_client.get("/api/cart/async/get/")).json()
+        return {item["product_id"]: item["quantity"] for item in summary["items"]}
+
+    async def test_line_operations(self):
+        add = {"product_id": self.tracked.id, "quantity": 2}
+        self.assertEqual((await self._apost("add/", add)).status_code, 200)
+        await self._apost("add/", {"product_id": self.untracked.id, "quantity": 1})
+        await self._apost("update/", {"product_id": self.tracked.id, "action": "inc"})
+        set_quantity = {"product_id": self.untracked.id, "quantity": 4}
+        response = await self._apost("update/quantity", set_quantity)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self._alines(), {self.tracked.id: 3, self.untracked.id: 4})
+
+        response = await self._apost("delete/", {"product_id": self.untracked.id})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(await self._alines(), {self.tracked.id: 3})
+        totals = (await self.async_client.get("/api/cart/async/totals/")).json()
+        self.assertEqual(totals["items"], 3)
+
+        self.assertEqual((await self.async_client.delete("/api/cart/async/get/")).status_code, 204)
+        self.assertEqual(await self._alines(), {})
+
+    async def test_errors(self):
+        response = await self._apost("add/", {"product_id": self.tracked.id, "quantity": 6})
+        self.assertEqual(response.status_code, 409)
+        response = await self._apost("add/", {"product_id": 999, "quantity": 1})
+        self.assertEqual(response.status_code, 404)
+        response = await self._apost("add/", {"product_id": self.tracked.id, "quantity": 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity", response.json())
+        response = await self.async_client.post(
+            "/api/cart/async/add/", "not json", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_json_only(self):
+        response = await self.async_client.post(
+            "/api/cart/async/add/", f"product_id={self.tracked.id}", content_type="text/plain"
+        )
+        self.assertEqual(response.status_code, 415)
+
+    async def test_signed_in_users_need_a_csrf_token(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        add = {"product_id": self.tracked.id, "quantity": 1}
+        self.assertEqual((await self._apost("add/", add, client)).status_code, 200)
+
+        user = await get_user_model().objects.acreate_user("shopper", password="secret")
+        await client.aforce_login(user)
+        self.assertEqual((await self._apost("add/", add, client)).status_code, 403)
+
+        token = "a" * 32
+        client.cookies[settings.CSRF_COOKIE_NAME] = token
+        response = await self._apost("add/", add, client, headers={"X-CSRFToken": token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_sync_and_async_views_share_carts(self):
+        self._add(self.tracked, 2)
+        self.async_client.cookies = self.client.cookies
+
+        async def add_and_read():
+            await self._apost("update/", {"product_id": self.tracked.id, "action": "inc"})
+            return await self._alines()
+
+        self.assertEqual(async_to_sync(add_and_read)(), {self.tracked.id: 3})
+        self.assertEqual(self._lines(), {self.tracked.id: 3})
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutAsyncCartTests(AsyncCartTests):
+    pass
+
+
+class NearCacheTests(CartTestCase):
+    """
+    fakeredis has no client-side caching, so a redis-py cache stands in for
+    the near-cache client's: the cart drops its own cached reads on writes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cache = DefaultCache(CacheConfig())
+        patcher = mock.patch.object(redis_cart, "_near_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cache_reads(self, session_id):
+        if redis_cart._compact():
+            cart_key = redis_cart._cart_key(session_id)
+            reads = [("HGETALL", cart_key), ("HMGET", cart_key)]
+        else:
+            qty_key = redis_cart._qty_key(session_id)
+            reads = [("HGETALL", qty_key), ("HMGET", qty_key)]
+            reads.append(("GET", redis_cart._promo_key(session_id)))
+        cache_keys = [CacheKey(command, (key,)) for command, key in reads]
+        for cache_key in cache_keys:
+            self.cache.set(CacheEntry(cache_key, b"stale", CacheEntryStatus.VALID, None))
+        return cache_keys
+
+    def test_writes_drop_cached_reads(self):
+        self._add(self.tracked)
+        session_id = self.client.session.session_key
+        for write in (
+            lambda: self._add(self.untracked),
+            lambda: self._post("update/", {"product_id": self.tracked.id, "action": "inc"}),
+            lambda: self._post("delete/", {"product_id": self.untracked.id}),
+            lambda: self.client.delete("/api/cart/get/"),
+        ):
+            cache_keys = self._cache_reads(session_id)
+            write()
+            self.assertEqual([self.cache.get(key) for key in cache_keys], [None] * len(cache_keys))
+
+    def test_reads_keep_cached_reads(self):
+        self._add(self.tracked)
+        # The first read stamps the totals with the catalog version
+        self._lines()
+        session_id = self.client.session.session_key
+        cache_keys = self._cache_reads(session_id)
+        self._lines()
+        self.assertTrue(all(self.cache.get(key) for key in cache_keys))
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutNearCacheTests(NearCacheTests):
+    pass
+
+
+class StockTests(CartTestCase):
+    def _available(self, product):
+        return int(r.hget(AVAILABLE_KEY, product.id))
+
+    def test_lines_hold_stock(self):
+        self._add(self.tracked, 3)
+        self.assertEqual(self._available(self.tracked), 2)
+        self._post("update/quantity", {"product_id": self.tracked.id, "quantity": 5})
+        self.assertEqual(self._available(self.tracked), 0)
+        self._post("update/", {"product_id": self.tracked.id, "action": "dec"})
+        self.assertEqual(self._available(self.tracked), 1)
+        self._post("delete/", {"product_id": self.tracked.id})
+        self.assertEqual(self._available(self.tracked), 5)
+        self._add(self.tracked, 2)
+        self.client.delete("/api/cart/get/")
+        self.assertEqual(self._available(self.tracked), 5)
+
+    def test_out_of_stock_is_a_conflict(self):
+        self.assertEqual(self._add(self.tracked, 6).status_code, 409)
+        self._add(self.tracked, 5)
+        response = self._post("update/", {"product_id": self.tracked.id, "action": "inc"})
+        self.assertEqual(response.status_code, 409)
+        response = self._post("update/quantity", {"product_id": self.tracked.id, "quantity": 6})
+        self.assertEqual(response.status_code, 409)
+        # Nothing changed, untracked products are never short
+        self.assertEqual(self._lines(), {self.tracked.id: 5})
+        self.assertEqual(self._available(self.tracked), 0)
+        self.assertEqual(self._add(self.untracked, 1000).status_code, 200)
+
+    def test_stock_changes_keep_the_holds(self):
+        self._add(self.tracked, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tracked.stock = 10
+            self.tracked.save()
+        self.assertEqual(self._available(self.tracked), 8)
+
+    def test_reconcile_stock(self):
+        self._add(self.tracked, 2)
+        session_id = self.client.session.session_key
+        r.delete(*r.keys(f"cart:{session_id}*"))
+        r.hdel(AVAILABLE_KEY, self.tracked.id)
+
+        out = StringIO()
+        call_command("reconcile_stock", stdout=out)
+        self.assertEqual(out.getvalue(), "released: 1 carts, reserved updated: 0 products\n")
+        self.assertEqual(self._available(self.tracked), 5)
+
+        # Reserved counts are written back to Postgres
+        self._add(self.tracked, 3)
+        call_command("reconcile_stock", stdout=StringIO())
+        self.tracked.refresh_from_db()
+        self.assertEqual(self.tracked.reserved, 3)
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutStockTests(StockTests):
+    pass
+
+
+class CartTotalsTests(CartTestCase):
+    def _totals(self, path="totals/"):
+        return self.client.get(f"/api/cart/{path}").json()
+
+    def _reprice(self, product, price):
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = price
+            product.save()
+
+    def test_totals_follow_the_lines(self):
+        self._add(self.tracked, 2)
+        self._add(self.untracked, 3)
+        self._post("update/", {"product_id": self.tracked.id, "action": "inc"})
+        self._post("delete/", {"product_id": self.untracked.id})
+        totals = self._totals()
+        self.assertEqual(totals["items"], 3)
+        self.assertAlmostEqual(totals["subtotal"], 29.97)
+        self.assertEqual(totals, self.client.get("/api/cart/get/").json()["totals"])
+        self.assertEqual(totals, self._totals("async/totals/"))
+
+        self._post("delete/", {"product_id": self.tracked.id})
+        self.assertEqual(self._totals()["items"], 0)
+
+    def test_price_changes_dont_skew_the_totals(self):
+        self._add(self.tracked)
+        self._add(self.untracked)
+        self.assertAlmostEqual(self._totals()["subtotal"], 11.49)
+
+        # Added at 9.99, removed at 20: the running subtotal goes negative
+        self._reprice(self.tracked, "20.00")
+        self._post("delete/", {"product_id": self.tracked.id})
+        self.assertEqual(self._totals()["subtotal"], 1.5)
+        self.assertEqual(self._totals("async/totals/")["subtotal"], 1.5)
+
+        self._reprice(self.untracked, "2.00")
+        self.assertEqual(self._totals("async/totals/")["subtotal"], 2.0)
+        self.assertEqual(self._totals()["total"], 2.0)
+
+    def test_checkout_drops_unavailable_lines(self):
+        self._add(self.tracked, 2)
+        self._add(self.untracked)
+        self.assertAlmostEqual(self._totals()["subtotal"], 21.48)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.untracked.is_active = False
+            self.untracked.save()
+
+        response = self._post("checkout/", {})
+        self.assertEqual([line["product_id"] for line in response.json()], [self.tracked.id])
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+        totals = self._totals()
+        self.assertEqual(totals["items"], 2)
+        self.assertAlmostEqual(totals["subtotal"], 19.98)
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutCartTotalsTests(CartTotalsTests):
+    pass
+
+
+class PromoTests(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        # Rules checked against promo:version on every lookup
+        patcher = mock.patch.object(promotions, "_rules", promotions._Rules(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _promo(self, code, value, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Promo.objects.create(code=code, value=value, **fields)
+
+    def _apply(self, code):
+        return self._post("promo/", {"promo_code": code})
+
+    def _discount(self):
+        return self.client.get("/api/cart/totals/").json()["discount"]
+
+    def test_only_valid_codes_apply(self):
+        self._add(self.tracked)
+        self._promo("OLD", 10, valid_until=timezone.now() - timedelta(days=1))
+        self._promo("OFF", 10, is_active=False)
+        for code in ("NOPE", "OLD", "OFF"):
+            self.assertEqual(self._apply(code).status_code, 400)
+        self._promo("SAVE10", 10)
+        self.assertEqual(self._apply("save10").status_code, 200)
+        self.assertEqual(self.client.get("/api/cart/get/").json()["promo_code"], "SAVE10")
+
+    def test_discounts(self):
+        self._add(self.tracked, 2)
+        self._promo("SAVE10", 10)
+        self._apply("SAVE10")
+        totals = self.client.get("/api/cart/totals/").json()
+        self.assertAlmostEqual(totals["discount"], 2.0)
+        self.assertAlmostEqual(totals["total"], 17.98)
+
+        # Never more than the subtotal
+        self._promo("BIG", 100, kind=Promo.FIXED)
+        self._apply("BIG")
+        self.assertAlmostEqual(self._discount(), 19.98)
+
+    def test_promo_edits_reach_cached_discounts(self):
+        self._add(self.tracked, 2)
+        promo = self._promo("SAVE10", 10)
+        self._apply("SAVE10")
+        self.assertAlmostEqual(self._discount(), 2.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            promo.value = 50
+            promo.save()
+        self.assertAlmostEqual(self._discount(), 9.99)
+
+    def test_category_promos_cover_subcategories(self):
+        speakers = Category.objects.create(
+            name="Speakers", slug="speakers", parent=self.category, is_active=True
+        )
+        books = Category.objects.create(name="Books", slug="books", is_active=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            speaker = Product.objects.create(
+                category=speakers, name="Speaker", slug="speaker", price="20.00", is_active=True
+            )
+            book = Product.objects.create(
+                category=books, name="Book", slug="book", price="40.00", is_active=True
+            )
+        for product in (self.tracked, speaker, book):
+            self._add(product)
+        self._promo("AUDIO", 50, category=self.category)
+        self._apply("AUDIO")
+        self.assertAlmostEqual(self._discount(), 15.0)
+
+        # Moving a category changes what the rule covers
+        with self.captureOnCommitCallbacks(execute=True):
+            books.parent = speakers
+            books.save()
+        self.assertAlmostEqual(self._discount(), 35.0)
+
+
+class CartMergeTests(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user("shopper", password="secret")
+        self.user_cart = user_cart_id(self.user.pk)
+
+    def _totals(self):
+        return self.client.get("/api/cart/totals/").json()
+
+    def test_login_merges_the_anonymous_cart(self):
+        self.client.force_login(self.user)
+        self._add(self.tracked, 1)
+        self.client.logout()
+
+        self._add(self.tracked, 2)
+        self._add(self.untracked, 1)
+        anonymous_id = self.client.session.session_key
+        self.client.force_login(self.user)
+
+        self.assertEqual(self._lines(), {self.tracked.id: 3, self.untracked.id: 1})
+        self.assertEqual(redis_cart.get_cart_lines(anonymous_id), {})
+        self.assertEqual(redis_cart.get_cart_lines(self.user_cart), self._lines())
+        # The holds moved with the lines, and the totals with them
+        self.assertEqual(r.hget(AVAILABLE_KEY, self.tracked.id), "2")
+        totals = self._totals()
+        self.assertEqual(totals["items"], 4)
+        self.assertAlmostEqual(totals["subtotal"], 31.47)
+
+    def test_the_promo_code_comes_along(self):
+        self._add(self.tracked)
+        redis_cart.set_cart_promo_code(self.client.session.session_key, "SAVE10")
+        self.client.force_login(self.user)
+        self.assertEqual(redis_cart.get_cart_promo_code(self.user_cart), "SAVE10")
+
+    def test_user_carts_outlive_the_session(self):
+        self.client.force_login(self.user)
+        self._add(self.tracked, 2)
+        self.assertGreater(r.ttl(redis_cart._cart_keys(self.user_cart)[0]), settings.CART_TTL)
+
+        # Another device signs in to the same cart
+        self.client = self.client_class()
+        self.client.force_login(self.user)
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+
+    def test_logging_in_without_a_cart(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self._lines(), {})
+        self.assertEqual(r.keys("cart:*"), [])
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutCartMergeTests(CartMergeTests):
+    pass
+
+
+@override_settings(CART_PERSISTENCE=True)
+class CartPersistenceTests(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user("shopper", password="secret")
+        self.client.force_login(self.user)
+
+    def _lose_carts(self):
+        r.delete(*r.keys("cart:*"))
+
+    def _copy(self):
+        persistence.persist("tests")
+        cart = Cart.objects.filter(pk=user_cart_id(self.user.pk)).first()
+        return cart and dict(cart.lines.values_list("product_id", "quantity"))
+
+    def test_lost_carts_are_restored(self):
+        self._add(self.tracked, 2)
+        self._add(self.untracked, 1)
+        self.assertEqual(self._copy(), {self.tracked.id: 2, self.untracked.id: 1})
+        self._lose_carts()
+
+        self.assertEqual(self._lines(), {self.tracked.id: 2, self.untracked.id: 1})
+        totals = self.client.get("/api/cart/totals/").json()
+        self.assertAlmostEqual(totals["subtotal"], 21.48)
+
+    def test_changes_to_a_lost_cart_keep_the_copy(self):
+        self._add(self.tracked, 3)
+        self._copy()
+        self._lose_carts()
+
+        self._add(self.untracked, 1)
+        expected = {self.tracked.id: 3, self.untracked.id: 1}
+        self.assertEqual(self._lines(), expected)
+        self.assertEqual(self._copy(), expected)
+        # The holds that outlived the cart were given back, not doubled
+        self.assertEqual(r.hget(AVAILABLE_KEY, self.tracked.id), "2")
+
+    def test_async_changes_to_a_lost_cart_keep_the_copy(self):
+        self._add(self.tracked, 3)
+        self._copy()
+        self._lose_carts()
+
+        self.async_client.cookies = self.client.cookies
+        add = {"product_id": self.untracked.id, "quantity": 1}
+        async_to_sync(self.async_client.post)(
+            "/api/cart/async/add/", add, content_type="application/json"
+        )
+        self.assertEqual(self._lines(), {self.tracked.id: 3, self.untracked.id: 1})
+
+    def test_expired_carts_are_not_restored(self):
+        self._add(self.tracked, 2)
+        self._copy()
+        self._lose_carts()
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(self._lines(), {})
+        self._add(self.untracked)
+        self.assertEqual(self._copy(), {self.untracked.id: 1})
+
+    def test_cleared_carts_are_deleted(self):
+        self._add(self.tracked)
+        self._copy()
+        self.client.delete("/api/cart/get/")
+        self.assertIsNone(self._copy())
+
+    def test_anonymous_carts_are_not_copied(self):
+        self.client.logout()
+        with self.assertNumQueries(0):
+            self._add(self.tracked)
+            self._lose_carts()
+            self._add(self.untracked)
+            self.assertEqual(self._lines(), {self.untracked.id: 1})
+        persistence.persist("tests")
+        self.assertFalse(Cart.objects.exists())
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutCartPersistenceTests(CartPersistenceTests):
+    pass
+
+
+class IdempotencyTests(CartTestCase):
+    def test_requests_apply_once(self):
+        first = self._add(self.tracked, 2, HTTP_IDEMPOTENCY_KEY="k1")
+        with mock.patch("cart.views.get_products") as get_products:
+            again = self._add(self.tracked, 2, HTTP_IDEMPOTENCY_KEY="k1")
+        get_products.assert_not_called()
+        self.assertEqual((again.status_code, again.json()), (first.status_code, first.json()))
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+
+        # A conflict is replayed as a conflict, even once the stock is there
+        self.assertEqual(self._add(self.tracked, 4, HTTP_IDEMPOTENCY_KEY="k2").status_code, 409)
+        self._post("delete/", {"product_id": self.tracked.id})
+        response = self._add(self.tracked, 4, HTTP_IDEMPOTENCY_KEY="k2")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(self._lines(), {})
+
+    def test_keys_are_tied_to_the_request(self):
+        self._add(self.tracked, 2, HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(self._add(self.tracked, 3, HTTP_IDEMPOTENCY_KEY="k1").status_code, 422)
+        update = {"product_id": self.tracked.id, "action": "inc"}
+        response = self._post("update/", update, HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+
+        response = self._add(self.tracked, 2, HTTP_IDEMPOTENCY_KEY="x" * 256)
+        self.assertEqual(response.status_code, 400)
+
+    def test_form_posts_are_fingerprinted(self):
+        # The CSRF check of a signed in user reads the multipart body first
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(get_user_model().objects.create_user("shopper"))
+        token = "a" * 32
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = token
+
+        def add(quantity):
+            data = {
+                "product_id": self.tracked.id,
+                "quantity": quantity,
+                "csrfmiddlewaretoken": token,
+            }
+            return self.client.post("/api/cart/add/", data, HTTP_IDEMPOTENCY_KEY="k1")
+
+        self.assertEqual(add(2).status_code, 200)
+        self.assertEqual(add(2)["Idempotent-Replayed"], "true")
+        self.assertEqual(add(3).status_code, 422)
+        self.assertEqual(self._lines(), {self.tracked.id: 2})
+
+    async def test_async_conflicts_are_replayed(self):
+        async def add(quantity):
+            return await self.async_client.post(
+                "/api/cart/async/add/",
+                {"product_id": self.tracked.id, "quantity": quantity},
+                content_type="application/json",
+                headers={"Idempotency-Key": "k1"},
+            )
+
+        first = await add(6)
+        self.assertEqual(first.status_code, 409)
+        self.assertNotIn("Idempotent-Replayed", first)
+        again = await add(6)
+        self.assertEqual((again.status_code, again.json()), (409, first.json()))
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertEqual((await add(1)).status_code, 422)
+
+
+@override_settings(CART_LAYOUT="split")
+class SplitLayoutIdempotencyTests(IdempotencyTests):
+    pass
+
+
+@override_settings(CART_THROTTLING=True)
+class ThrottlingTests(CartTestCase):
+    # cart/urls.py: PROMO = limit("promo", "10/m", per_ip="100/m")
+    def _promo(self, client=None, path="promo/"):
+        client = client or self.client
+        return client.post(
+            f"/api/cart/{path}", {"promo_code": "NOPE"}, content_type="application/json"
+        )
+
+    def test_carts_are_limited(self):
+        self._add(self.tracked)
+        for i in range(10):
+            path = "promo/" if i % 2 else "async/promo/"
+            self.assertEqual(self._promo(path=path).status_code, 400)
+        response = self._promo()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        self.assertEqual(self._promo(path="async/promo/").status_code, 429)
+
+        # Other carts have their own bucket
+        self.assertEqual(self._promo(self.client_class()).status_code, 400)
+
+    def test_client_ips_are_limited(self):
+        for _ in range(10):
+            client = self.client_class()
+            client.post(
+                "/api/cart/add/",
+                {"product_id": self.untracked.id, "quantity": 1},
+                content_type="application/json",
+            )
+            for _ in range(10):
+                self.assertEqual(self._promo(client).status_code, 400)
+        self.assertEqual(self._promo(self.client_class()).status_code, 429)
+
+    def test_rejected_requests_keep_their_cart_token(self):
+        self._add(self.tracked)
+        with mock.patch("cart.throttling.is_cluster", return_value=True):
+            self._promo()
+            [ip_bucket] = r.keys("throttle:127.0.0.1:promo")
+            [cart_bucket] = set(r.keys("throttle:*:promo")) - {ip_bucket}
+            self.assertEqual(float(r.hget(cart_bucket, "tokens")), 9)
+
+            r.hset(ip_bucket, "tokens", 0)
+            self.assertEqual(self._promo().status_code, 429)
+            self.assertEqual(self._promo(path="async/promo/").status_code, 429)
+        self.assertGreaterEqual(float(r.hget(cart_bucket, "tokens")), 9)
+        self.assertLess(float(r.hget(cart_bucket, "tokens")), 10)
+
+
+class ExpirySweepTests(CartTestCase):
+    def _idle(self, seconds):
+        # Backdates the cart's last change in the index
+        session_id = self.client.session.session_key
+        score = r.zscore(expiry.TOUCHED_KEY, session_id)
+        r.zadd(expiry.TOUCHED_KEY, {session_id: score - seconds})
+        return session_id
+
+    def _events(self):
+        return [fields for _, fields in r.xrange(expiry.EVENTS_KEY)]
+
+    def test_cart_changes_touch_the_index(self):
+        self._add(self.tracked)
+        session_id = self.client.session.session_key
+        self.assertIsNotNone(r.zscore(expiry.TOUCHED_KEY, session_id))
+        self.client.delete("/api/cart/get/")
+        self.assertIsNone(r.zscore(expiry.TOUCHED_KEY, session_id))
+
+    def test_idle_carts_are_reported_abandoned_once(self):
+        self._add(self.tracked)
+        self.assertEqual(expiry.sweep(), {"expired": 0, "abandoned": 0})
+        session_id = self._idle(settings.CART_ABANDONED_AFTER + 1)
+        self.assertEqual(expiry.sweep(), {"expired": 0, "abandoned": 1})
+        self.assertEqual(expiry.sweep(), {"expired": 0, "abandoned": 0})
+        [event] = self._events()
+        self.assertEqual((event["event"], event["session_id"]), ("abandoned", session_id))
+
+        # A change starts a new idle period
+        self._add(self.tracked)
+        self._idle(settings.CART_ABANDONED_AFTER + 1)
+        self.assertEqual(expiry.sweep(), {"expired": 0, "abandoned": 1})
+
+    def test_expired_carts_give_back_their_stock(self):
+        self._add(self.tracked, 2)
+        self.assertEqual(r.hget(AVAILABLE_KEY, self.tracked.id), "3")
+        session_id = self._idle(settings.CART_TTL + 1)
+        r.delete(*r.keys(f"cart:{session_id}*"))
+
+        self.assertEqual(expiry.sweep(batch_size=1), {"expired": 1, "abandoned": 0})
+        self.assertEqual(r.zcard(expiry.TOUCHED_KEY), 0)
+        self.assertEqual(r.hget(AVAILABLE_KEY, self.tracked.id), "5")
+        [event] = self._events()
+        self.assertEqual((event["event"], event["session_id"]), ("expired", session_id))
+
+    def test_sweep_carts_command(self):
+        out = StringIO()
+        call_command("sweep_carts", stdout=out)
+        self.assertEqual(out.getvalue(), "expired: 0, abandoned: 0\n")
@@ -0,0 +1,163 @@
+# throttling.py
+#
+# Token bucket rate limits for the cart endpoints, kept in Redis so every
+# worker shares them. A request takes one token from its cart's bucket and
+# one from its client IP's; buckets refill continuously at the configured
+# rate, and a request finding either one empty is rejected with 429 before
+# the view parses or validates anything. The check is one script call, and a
+# rejected request writes nothing, so a bot looping on one cart never reaches
+# the cart's keys, however many IPs it comes from.
+#
+#   throttle:{cart}:<scope>  hash  tokens, ts (ms): the cart's bucket
+#   throttle:{ip}:<scope>    hash  the same for the client IP
+#
+# The keys expire once the bucket would be full again. In cluster mode they
+# are in different slots, so each bucket is its own script call, the cart's
+# first; a request the IP bucket rejects gets its cart token back
+# (REFUND_TOKEN). Limits are set per endpoint in cart/urls.py with limit().
+import weakref
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from core.redis_async import get_async_redis
+from core.redis_client import get_redis, hash_tag, is_cluster
+
+from .owners import acart_id, cart_id
+
+r = get_redis()
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+# KEYS = buckets. ARGV = capacity, period in ms for each bucket.
+# Returns 0 and takes a token from every bucket, or, if one is empty, the
+# milliseconds until it has a token again.
+TAKE_TOKEN = """
+local time = redis.call('TIME')
+local now = time[1] * 1000 + math.floor(time[2] / 1000)
+local tokens, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local capacity, period = tonumber(ARGV[i * 2 - 1]), tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local left, last = tonumber(bucket[1]), tonumber(bucket[2])
+    if left then
+        left = math.min(capacity, left + (now - last) * capacity / period)
+    else
+        left = capacity
+    end
+    if left < 1 then
+        wait = math.max(wait, math.ceil((1 - left) * period / capacity))
+    end
+    tokens[i] = left
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, ARGV[i * 2])
+end
+return 0
+"""
+
+# KEYS = bucket. ARGV = capacity, period in ms.
+# Gives back a token taken by TAKE_TOKEN, for a request another bucket
+# rejected afterwards (cluster mode).
+REFUND_TOKEN = """
+local left = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if left then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), left + 1))
+end
+return 0
+"""
+
+_take_token = r.register_script(TAKE_TOKEN)
+_refund_token = r.register_script(REFUND_TOKEN)
+
+# AsyncScript objects are bound to a client, so keep one pair per client
+_async_scripts = weakref.WeakKeyDictionary()
+
+
+def parse_rate(rate):
+    """"20/s" -> (20, 1000): requests, and the period in milliseconds."""
+    count, period = rate.split("/")
+    return int(count), PERIODS[period[0]] * 1000
+
+
+class CartRateThrottle(BaseThrottle):
+    scope = None  # the bucket name, shared by the sync and async views
+    rate = None  # per cart, "<requests>/<s|m|h|d>"
+    ip_rate = None  # per client IP
+
+    retry_after = None  # milliseconds, after a rejected request
+
+    def _buckets(self, request, cart):
+        """
+        [(keys, args)] of the TAKE_TOKEN calls to make: one for all the
+        buckets, or one per bucket in cluster mode.
+        """
+        ip_bucket = f"throttle:{hash_tag(self.get_ident(request))}:{self.scope}"
+        keys, args = [], []
+        if self.rate and cart:
+            keys.append(f"throttle:{hash_tag(cart)}:{self.scope}")
+            args.extend(parse_rate(self.rate))
+        if self.ip_rate:
+            keys.append(ip_bucket)
+            args.extend(parse_rate(self.ip_rate))
+        elif self.rate and not cart:
+            # Requests without a cart yet count against their IP, at the cart
+            # rate when the endpoint has no IP limit
+            keys.append(ip_bucket)
+            args.extend(parse_rate(self.rate))
+        if not is_cluster():
+            return [(keys, args)]
+        return [([key], args[i * 2 : i * 2 + 2]) for i, key in enumerate(keys)]
+
+    def allow_request(self, request, view):
+        if not settings.CART_THROTTLING:
+            return True
+        taken = []
+        for keys, args in self._buckets(request, cart_id(request)):
+            self.retry_after = _take_token(keys=keys, args=args)
+            if self.retry_after:
+                for keys, args in taken:
+                    _refund_token(keys=keys, args=args)
+                return False
+            taken.append((keys, args))
+        return True
+
+    async def aallow_request(self, request, view):
+        if not settings.CART_THROTTLING:
+            return True
+        client = get_async_redis()
+        scripts = _async_scripts.get(client)
+        if scripts is None:
+            scripts = _async_scripts[client] = (
+                client.register_script(TAKE_TOKEN),
+                client.register_script(REFUND_TOKEN),
+            )
+        take_token, refund_token = scripts
+        taken = []
+        for keys, args in self._buckets(request, await acart_id(request)):
+            self.retry_after = await take_token(keys=keys, args=args)
+            if self.retry_after:
+                for keys, args in taken:
+                    await refund_token(keys=keys, args=args)
+                return False
+            taken.append((keys, args))
+        return True
+
+    def wait(self):
+        return self.retry_after / 1000 if self.retry_after else None
+
+
+def limit(scope, rate, per_ip=None):
+    """
+    A CartRateThrottle for as_view(throttle_classes=[...]): rate per cart and
+    per_ip per client IP, in buckets named scope.
+    """
+    for value in (rate, per_ip):
+        if value:
+            parse_rate(value)  # fail at import, not on the first request
+    attrs = {"scope": scope, "rate": rate, "ip_rate": per_ip}
+    return type(f"{scope.title()}RateThrottle", (CartRateThrottle,), attrs)
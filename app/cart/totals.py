@@ -0,0 +1,116 @@
+# totals.py
+#
+# Cart totals. The cart scripts keep a running unit count and subtotal (in
+# cents) in the cart hash, adjusted in the same script as every line change,
+# so reading them doesn't need the lines (see lua_scripts.TOTALS_PRELUDE).
+# They are stamped with the catalog version they were last checked at and
+# only trusted while it is current: a price change in between makes the
+# running subtotal drift.
+#
+# Promo discounts go through the CART_PROMO_EVALUATOR hook. Its result is
+# stored next to the totals with the cart revision and the promo rules
+# version it was computed at (promotions.version), so it only runs again once
+# the lines, the promo code or the rules change.
+from functools import cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+TOTAL_FIELDS = (
+    "_items",
+    "_subtotal",
+    "_rev",
+    "_discount",
+    "_discount_rev",
+    "_discount_ver",
+    "_catalog",
+)
+
+
+def cents(price):
+    return round(price * 100)
+
+
+def no_discount(promo_code, lines, products):
+    return 0
+
+
+@cache
+def _evaluator():
+    return import_string(settings.CART_PROMO_EVALUATOR)
+
+
+def evaluate_promo(promo_code, lines, products):
+    """Discount in cents for promo_code, never more than the subtotal."""
+    if not promo_code:
+        return 0
+    discount = _evaluator()(promo_code, lines, products)
+    return max(0, min(discount, compute(lines, products)[1]))
+
+
+def compute(lines, products):
+    """(units, subtotal in cents) of the lines, from current catalog prices."""
+    units = sum(lines.values())
+    subtotal = sum(
+        quantity * cents(products[pid]["price"])
+        for pid, quantity in lines.items()
+        if pid in products
+    )
+    return units, subtotal
+
+
+def stored(fields, catalog_version):
+    """
+    The (units, subtotal) kept in the cart hash, or None for a cart written
+    before the totals existed or whose totals weren't checked against the
+    current catalog version.
+    """
+    if "_items" not in fields or "_subtotal" not in fields:
+        return None
+    if fields.get("_catalog") != str(catalog_version):
+        return None
+    return int(fields["_items"]), int(fields["_subtotal"])
+
+
+def stored_discount(fields, version):
+    """
+    The cached discount, or None if the cart or the promo rules (version)
+    changed since it was computed.
+    """
+    if "_discount_rev" not in fields or fields["_discount_rev"] != fields.get("_rev"):
+        return None
+    if fields.get("_discount_ver") != version:
+        return None
+    return int(fields["_discount"])
+
+
+def as_response(units, subtotal, discount):
+    return {
+        "items": units,
+        "subtotal": subtotal / 100,
+        "discount": discount / 100,
+        "total": (subtotal - discount) / 100,
+    }
+
+
+def settle(fields, lines, products, promo_code, version, catalog_version):
+    """
+    Totals of a cart that was read in full and hydrated, checked against the
+    stored ones, version being the promo rules version and catalog_version
+    the catalog version read before the products. Returns the totals and the
+    cart scripts that bring the stored values up to date, as [(name, args)]:
+    usually none.
+    """
+    writes = []
+    rev = fields.get("_rev", "")
+    units, subtotal = compute(lines, products)
+    discount = stored_discount(fields, version)
+    if lines and stored(fields, catalog_version) != (units, subtotal):
+        writes.append(("reprice", (rev, units, subtotal, catalog_version)))
+        discount = None
+    if not promo_code:
+        discount = 0
+    elif discount is None:
+        discount = evaluate_promo(promo_code, lines, products)
+        writes.append(("discount", (rev, discount, version)))
+    return as_response(units, subtotal, discount), writes
@@ -1,21 +1,54 @@
 from django.urls import path
 
+from .async_views import (
+    AsyncAddToCartView,
+    AsyncCartView,
+    AsyncCartTotalsView,
+    AsyncRemoveFromCartView,
+    AsyncUpdateQuantityView,
+    AsyncSetQuantityView,
+    AsyncCartPromoView,
+    AsyncCartBatchView,
+    AsyncCheckoutPromoView,
+)
+from .throttling import limit
 from .views import (
     AddToCartView,
     CartView,
+    CartTotalsView,
     RemoveFromCartView,
     UpdateQuantityView,
     SetQuantityView,
     CartPromoView,
+    CartBatchView,
     CheckoutPromoView,
 )
 
+# Token buckets per cart and per client IP, shared by the sync and async views.
+# The IP limits leave room for many shoppers behind one NAT.
+LINE = limit("line", "20/s", per_ip="200/s")
+BATCH = limit("batch", "5/s", per_ip="50/s")
+PROMO = limit("promo", "10/m", per_ip="100/m")
+
 urlpatterns = [
-    path("add/", AddToCartView.as_view()),
+    path("add/", AddToCartView.as_view(throttle_classes=[LINE])),
     path("get/", CartView.as_view()),
-    path("delete/", RemoveFromCartView.as_view()),
-    path("update/quantity", SetQuantityView.as_view()),  # More specific first
-    path("update/", UpdateQuantityView.as_view()),  # Less specific after
-    path("promo/", CartPromoView.as_view()),
+    path("totals/", CartTotalsView.as_view()),
+    path("delete/", RemoveFromCartView.as_view(throttle_classes=[LINE])),
+    # More specific first, less specific after
+    path("update/quantity", SetQuantityView.as_view(throttle_classes=[LINE])),
+    path("update/", UpdateQuantityView.as_view(throttle_classes=[LINE])),
+    path("promo/", CartPromoView.as_view(throttle_classes=[PROMO])),
+    path("batch/", CartBatchView.as_view(throttle_classes=[BATCH])),
     path("checkout/", CheckoutPromoView.as_view()),
+    # Async variants, served concurrently when running under ASGI
+    path("async/add/", AsyncAddToCartView.as_view(throttle_classes=[LINE])),
+    path("async/get/", AsyncCartView.as_view()),
+    path("async/totals/", AsyncCartTotalsView.as_view()),
+    path("async/delete/", AsyncRemoveFromCartView.as_view(throttle_classes=[LINE])),
+    path("async/update/quantity", AsyncSetQuantityView.as_view(throttle_classes=[LINE])),
+    path("async/update/", AsyncUpdateQuantityView.as_view(throttle_classes=[LINE])),
+    path("async/promo/", AsyncCartPromoView.as_view(throttle_classes=[PROMO])),
+    path("async/batch/", AsyncCartBatchView.as_view(throttle_classes=[BATCH])),
+    path("async/checkout/", AsyncCheckoutPromoView.as_view()),
 ]
@@ -1,51 +1,69 @@
 from rest_framework.views import APIView
 from .serializer import (
     AddToCartSerializer,
-    CartItemSerializer,
+    CartSummarySerializer,
+    CartTotalsSerializer,
     RemoveFromCartSerializer,
     UpdateQuantitySerializer,
     SetQuantitySerializer,
     CartPromoSerializer,
+    CartBatchSerializer,
+    CartBatchResultSerializer,
     CheckoutResponseItemSerializer,
 )
+from .idempotency import idempotent
+from .owners import cart_id
+from .promotions import validate as validate_promo
 from .redis_cart import (
+    InsufficientStock,
     add_to_cart,
-    get_cart,
+    apply_batch,
+    get_cart_lines,
+    get_cart_summary,
+    get_cart_totals,
     remove_from_cart,
     clear_cart,
     increment_quantity,
     decrement_quantity,
     set_quantity,
     set_cart_promo_code,
-    get_cart_promo_code,
-    update_cart_item,
 )
 from rest_framework.response import Response
 from rest_framework import status
 from drf_spectacular.utils import extend_schema
-from inventory.models import Product
+from inventory.catalog import get_products
+
+
+def out_of_stock():
+    return Response({"error": "Not enough stock."}, status=status.HTTP_409_CONFLICT)
 
 
 # Get, clear cart
 class CartView(APIView):
     @extend_schema(
-        responses={200: CartItemSerializer(many=True)}, description="Get cart products"
+        responses={200: CartSummarySerializer}, description="Get cart products and totals"
     )
     def get(self, request):
-        session_id = request.session.session_key
-        cart_data = get_cart(session_id)
-        promo_code = get_cart_promo_code(session_id)
-
-        return Response(
-            {"items": cart_data, "promo_code": promo_code}, status=status.HTTP_200_OK
-        )
+        session_id = cart_id(request)
+        return Response(get_cart_summary(session_id), status=status.HTTP_200_OK)
 
+    @idempotent
     def delete(self, request):
-        session_id = request.session.session_key
+        session_id = cart_id(request)
         clear_cart(session_id)
         return Response({"message": "Cart cleared"}, status=status.HTTP_204_NO_CONTENT)
 
 
+# Item count and amounts only, without reading the lines
+class CartTotalsView(APIView):
+    @extend_schema(
+        responses={200: CartTotalsSerializer}, description="Get cart totals"
+    )
+    def get(self, request):
+        session_id = cart_id(request)
+        return Response(get_cart_totals(session_id), status=status.HTTP_200_OK)
+
+
 # Create your views here.
 class AddToCartView(APIView):
     @extend_schema(
@@ -53,27 +71,29 @@ class AddToCartView(APIView):
         responses={200: None},
         description="Add a product to the cart",
     )
+    @idempotent
     def post(self, request):
-        if not request.session.session_key:
-            request.session.create()
-        session_id = request.session.session_key
+        session_id = cart_id(request, create=True)
 
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # product_id = serializer.validated_data["product_id"]
-        # name = serializer.validated_data["name"]
-        # price = serializer.validated_data["price"]
-        # quantity = serializer.validated_data["quantity"]
         data = serializer.validated_data
 
-        add_to_cart(
-            session_id,
-            product_id=data["product_id"],
-            name=data["name"],
-            price=data["price"],
-            quantity=data["quantity"],
-        )
+        # Name and price come from the catalog cache, not from the client
+        if not get_products([data["product_id"]]):
+            return Response(
+                {"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            add_to_cart(
+                session_id,
+                product_id=data["product_id"],
+                quantity=data["quantity"],
+            )
+        except InsufficientStock:
+            return out_of_stock()
 
         return Response({"message": "Added to cart."}, status=status.HTTP_200_OK)
 
@@ -85,8 +105,9 @@ class RemoveFromCartView(APIView):
         responses={204: None},
         description="Remove product from current cart session",
     )
+    @idempotent
     def post(self, request):
-        session_id = request.session.session_key
+        session_id = cart_id(request)
         serializer = RemoveFromCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
@@ -102,13 +123,20 @@ class UpdateQuantityView(APIView):
         responses={200: None},
         description="Update product quantity",
     )
+    @idempotent
     def post(self, request):
-        session_id = request.session.session_key
-        product_id = request.data.get("product_id")
-        action = request.data.get("action", "inc")
+        session_id = cart_id(request)
+        serializer = UpdateQuantitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        product_id = serializer.validated_data["product_id"]
+        action = serializer.validated_data["action"]
 
         if action == "inc":
-            increment_quantity(session_id, product_id)
+            try:
+                increment_quantity(session_id, product_id)
+            except InsufficientStock:
+                return out_of_stock()
         else:
             decrement_quantity(session_id, product_id)
 
@@ -122,8 +150,9 @@ class SetQuantityView(APIView):
         responses={200: None},
         description="Set product quantity",
     )
+    @idempotent
     def post(self, request):
-        session_id = request.session.session_key
+        session_id = cart_id(request)
 
         serializer = SetQuantitySerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -131,7 +160,10 @@ class SetQuantityView(APIView):
         product_id = serializer.validated_data["product_id"]
         quantity = serializer.validated_data["quantity"]
 
-        updated = set_quantity(session_id, product_id, quantity)
+        try:
+            updated = set_quantity(session_id, product_id, quantity)
+        except InsufficientStock:
+            return out_of_stock()
         if not updated:
             return Response({"error": "Product not found in cart."}, status=404)
 
@@ -145,63 +177,113 @@ class CartPromoView(APIView):
     @extend_schema(
         request=CartPromoSerializer,
         responses={200: None},
-        description="Set product quantity",
+        description="Apply a promo code to the cart",
     )
+    @idempotent
     def post(self, request):
-        session_id = request.session.session_key
+        session_id = cart_id(request)
 
         serializer = CartPromoSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        promo_code = serializer.validated_data["promo_code"]
-        set_cart_promo_code(session_id, promo_code)
+        # Checked against the compiled rules in memory, no query
+        rule = validate_promo(serializer.validated_data["promo_code"])
+        if rule is None:
+            return Response(
+                {"error": "Invalid promo code."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        set_cart_promo_code(session_id, rule.code)
 
         return Response({"message": "Promo code applied"}, status=200)
 
 
+def split_unknown_products(operations, products):
+    """
+    Split batch operations into the ones to apply and failed results, keyed by
+    position, for adds of products that aren't in the catalog.
+    """
+    valid, rejected = [], {}
+    for index, operation in enumerate(operations):
+        if operation["op"] == "add" and operation["product_id"] not in products:
+            rejected[index] = {
+                "op": operation["op"],
+                "product_id": operation["product_id"],
+                "applied": False,
+                "error": "Product not found.",
+            }
+        else:
+            valid.append(operation)
+    return valid, rejected
+
+
+def merge_batch_results(operations, applied, rejected):
+    # One result per requested operation, in request order
+    applied = iter(applied)
+    return [rejected.get(index) or next(applied) for index in range(len(operations))]
+
+
+# Apply several line operations in one call
+class CartBatchView(APIView):
+    @extend_schema(
+        request=CartBatchSerializer,
+        responses={200: CartBatchResultSerializer(many=True)},
+        description="Apply add/remove/inc/dec/set operations to the cart in one atomic call",
+    )
+    @idempotent
+    def post(self, request):
+        session_id = cart_id(request, create=True)
+
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data["operations"]
+
+        added = {op["product_id"] for op in operations if op["op"] == "add"}
+        valid, rejected = split_unknown_products(operations, get_products(added))
+
+        applied = apply_batch(session_id, valid)
+        results = merge_batch_results(operations, applied, rejected)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class CheckoutPromoView(APIView):
     @extend_schema(
         responses={200: CheckoutResponseItemSerializer(many=True)},
         description="Valid and sanitize cart before checkout. Remove missing products, update price/name if needed.",
     )
     def post(self, request):
-        session_id = request.session.session_key
-        cart_items = get_cart(session_id)
+        session_id = cart_id(request)
+        lines = get_cart_lines(session_id)
 
-        if not cart_items:
+        if not lines:
             return Response([], status=status.HTTP_200_OK)
 
-        product_ids = [item["product_id"] for item in cart_items]
-        products = Product.objects.filter(id__in=product_ids, is_active=True)
-
-        product_map = {product.id: product for product in products}
+        # Name and price are hydrated from the catalog cache, so only lines
+        # whose product is gone or inactive need fixing up.
+        products = get_products(lines)
 
         cleaned_cart = []
+        stale = []
 
-        for item in cart_items:
-            product_id = item["product_id"]
-            product = product_map.get(product_id)
+        for product_id, quantity in lines.items():
+            product = products.get(product_id)
 
             if not product:
-                remove_from_cart(session_id, product_id)
+                stale.append({"op": "remove", "product_id": product_id})
                 continue
 
-            # Check if Redis-stored name/price differs
-            if item["name"] != product.name or float(item["price"]) != float(
-                product.price
-            ):
-                update_cart_item(
-                    session_id,
-                    product_id,
-                    product.name,
-                    product.price,
-                    item["quantity"],
-                )
-                item["name"] = product.name
-                item["price"] = float(product.price)
-
-            item["valid"] = True
-            item["error"] = ""
-            cleaned_cart.append(item)
+            cleaned_cart.append(
+                {
+                    "product_id": product_id,
+                    "name": product["name"],
+                    "price": product["price"],
+                    "quantity": quantity,
+                    "valid": True,
+                    "error": "",
+                }
+            )
+
+        # All corrections go out in one scripted call, whatever the cart size
+        if stale:
+            apply_batch(session_id, stale)
 
         return Response(cleaned_cart, status=status.HTTP_200_OK)
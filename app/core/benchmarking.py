@@ -0,0 +1,90 @@
+# benchmarking.py
+#
+# Small helpers shared by the benchmark management commands.
+import statistics
+from contextlib import contextmanager
+
+from .instrumentation import end_request, metrics, start_request
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+HEADER = f"{'case':<36}{'requests':>8}{'throughput':>12}{'mean':>9}{'p50':>9}{'p99':>9}"
+
+REDIS_HEADER = f"{HEADER}{'cmds':>7}{'rtts':>7}"
+
+
+def summarize(name, samples, elapsed, redis_stats=None):
+    """
+    One report line: throughput and latency percentiles in milliseconds, plus
+    Redis commands and round trips per request when redis_stats is given.
+    """
+    count = len(samples)
+    line = (
+        f"{name:<36}{count:>8}{count / elapsed if elapsed else 0:>10.0f}/s"
+        f"{statistics.mean(samples) * 1000 if samples else 0:>9.2f}"
+        f"{percentile(samples, 50) * 1000:>9.2f}"
+        f"{percentile(samples, 99) * 1000:>9.2f}"
+    )
+    if redis_stats is not None and count:
+        line += (
+            f"{redis_stats['commands'] / count:>7.1f}"
+            f"{redis_stats['round_trips'] / count:>7.1f}"
+        )
+    return line
+
+
+@contextmanager
+def count_redis_commands():
+    """
+    Count the Redis commands and round trips sent while the block runs, from
+    the request instrumentation: calls made in the block itself, and requests
+    served meanwhile through the instrumentation middleware. A pipeline is one
+    round trip carrying all of its commands; a script call is one command.
+    """
+    names = ("redis_commands_total", "redis_round_trips_total")
+    before = [metrics.total(name) for name in names]
+    stats = {"commands": 0, "round_trips": 0}
+    direct, token = start_request()
+    try:
+        yield stats
+    finally:
+        end_request(token)
+        served = [metrics.total(name) - count for name, count in zip(names, before)]
+        stats["commands"] = direct.redis_commands + served[0]
+        stats["round_trips"] = direct.redis_round_trips + served[1]
+
+
+def seed_catalog(products):
+    """Make sure there are at least `products` active products to work with."""
+    from inventory.models import Category, Product
+
+    existing = list(
+        Product.objects.filter(is_active=True).values_list("id", flat=True)[:products]
+    )
+    if len(existing) >= products:
+        return existing
+
+    category, _ = Category.objects.get_or_create(
+        slug="bench", defaults={"name": "Bench", "is_active": True}
+    )
+    start = Product.objects.count()
+    Product.objects.bulk_create(
+        Product(
+            category=category,
+            name=f"Bench product {i}",
+            slug=f"bench-product-{i}",
+            price=f"{1 + i % 500}.99",
+            is_active=True,
+        )
+        for i in range(start, start + products - len(existing))
+    )
+    return list(
+        Product.objects.filter(is_active=True).values_list("id", flat=True)[:products]
+    )
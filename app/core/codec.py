@@ -0,0 +1,46 @@
+# codec.py
+#
+# Encoding of the JSON values kept in Redis: catalog snapshots and cached
+# catalog pages. REDIS_CODEC picks the implementation:
+#
+#   "orjson"  default, several times faster than the stdlib on both sides
+#   "json"    stdlib
+#
+# Both write plain UTF-8 JSON, so a value written by one (or by older code
+# using json.dumps) reads back with the other and codecs can be switched on a
+# live Redis. Binary formats like msgpack are left out on purpose: they can't
+# be read back through the decode_responses clients.
+import json
+
+import orjson
+from django.conf import settings
+
+
+class JSONCodec:
+    @staticmethod
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(value):
+        return json.loads(value)
+
+
+class ORJSONCodec:
+    dumps = staticmethod(orjson.dumps)
+    loads = staticmethod(orjson.loads)
+
+
+CODECS = {"json": JSONCodec, "orjson": ORJSONCodec}
+
+codec = CODECS[settings.REDIS_CODEC]
+
+
+def dumps(value):
+    """Encode value to JSON bytes."""
+    return codec.dumps(value)
+
+
+def loads(value):
+    """Decode JSON from str or bytes."""
+    return codec.loads(value)
@@ -0,0 +1,253 @@
+# instrumentation.py
+#
+# Per-request accounting of the time spent in Redis and in the ORM.
+#
+# The Redis clients below count every command, pipeline and script call made
+# while a request is active, plus an estimate of the bytes sent and received.
+# SQL is counted by an execute wrapper installed on every DB connection. The
+# numbers are kept in a ContextVar, so they follow the request through
+# threads (sync_to_async) and async tasks alike.
+#
+# InstrumentationMiddleware (core/middleware.py) reports them as Server-Timing
+# headers and feeds the process-wide counters exposed on /metrics.
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import redis
+import redis.asyncio
+import redis.asyncio.client
+import redis.asyncio.cluster
+import redis.client
+import redis.cluster
+from redis.cache import CacheEntryStatus, CacheKey
+
+
+@dataclass
+class RequestStats:
+    redis_commands: int = 0
+    redis_round_trips: int = 0
+    redis_pipelines: int = 0
+    redis_cache_hits: int = 0
+    redis_bytes_sent: int = 0
+    redis_bytes_received: int = 0
+    redis_seconds: float = 0.0
+    db_queries: int = 0
+    db_seconds: float = 0.0
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def _size(value):
+    # Rough payload size: string lengths, numbers as their decimal width
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, (list, tuple, set)):
+        return sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.items())
+    if value is None:
+        return 0
+    return len(str(value))
+
+
+def _record_redis(commands, sent, result, elapsed, pipeline=False):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.redis_commands += commands
+    stats.redis_round_trips += 1
+    stats.redis_pipelines += pipeline
+    stats.redis_bytes_sent += sent
+    stats.redis_bytes_received += _size(result)
+    stats.redis_seconds += elapsed
+
+
+def _record_cache_hit():
+    stats = _current.get()
+    if stats is not None:
+        stats.redis_cache_hits += 1
+
+
+def _is_cache_hit(client, args):
+    # Reads answered by client-side caching (get_cached_redis) never reach
+    # the server, so they are not counted as commands
+    get_cache = getattr(client, "get_cache", None)
+    cache = get_cache() if get_cache else None
+    if cache is None or len(args) < 2:
+        return False
+    entry = cache.get(CacheKey(command=args[0], redis_keys=(args[1],)))
+    return entry is not None and entry.status == CacheEntryStatus.VALID
+
+
+def _stack_size(command_stack):
+    return sum(_size(args) for args, _ in command_stack)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        commands, sent = len(self.command_stack), _stack_size(self.command_stack)
+        start = time.perf_counter()
+        result = super().execute(raise_on_error)
+        _record_redis(commands, sent, result, time.perf_counter() - start, True)
+        return result
+
+
+class InstrumentedCommandsMixin:
+    def execute_command(self, *args, **options):
+        if _is_cache_hit(self, args):
+            _record_cache_hit()
+            return super().execute_command(*args, **options)
+        start = time.perf_counter()
+        result = super().execute_command(*args, **options)
+        _record_redis(1, _size(args), result, time.perf_counter() - start)
+        return result
+
+
+class InstrumentedRedisMixin(InstrumentedCommandsMixin):
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class InstrumentedRedis(InstrumentedRedisMixin, redis.Redis):
+    pass
+
+
+# Cluster pipelines fan out per node and are left uncounted
+class InstrumentedRedisCluster(InstrumentedCommandsMixin, redis.cluster.RedisCluster):
+    pass
+
+
+class InstrumentedAsyncPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        commands, sent = len(self.command_stack), _stack_size(self.command_stack)
+        start = time.perf_counter()
+        result = await super().execute(raise_on_error)
+        _record_redis(commands, sent, result, time.perf_counter() - start, True)
+        return result
+
+
+class InstrumentedAsyncCommandsMixin:
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        result = await super().execute_command(*args, **options)
+        _record_redis(1, _size(args), result, time.perf_counter() - start)
+        return result
+
+
+class InstrumentedAsyncRedis(InstrumentedAsyncCommandsMixin, redis.asyncio.Redis):
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedAsyncPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class InstrumentedAsyncRedisCluster(
+    InstrumentedAsyncCommandsMixin, redis.asyncio.cluster.RedisCluster
+):
+    pass
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    # connection_created receiver: wrap every new DB connection once
+    if sql_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_execute_wrapper)
+
+
+class Metrics:
+    """
+    Process-local counters rendered in the Prometheus text format. Each worker
+    process exposes its own numbers; the scraper sums them per instance.
+    """
+
+    COUNTERS = {
+        "http_requests_total": "Requests served",
+        "http_request_duration_seconds_total": "Time spent serving requests",
+        "redis_commands_total": "Redis commands sent",
+        "redis_round_trips_total": "Redis round trips",
+        "redis_pipelines_total": "Redis pipelines executed",
+        "redis_cache_hits_total": "Redis reads served by client-side caching",
+        "redis_bytes_sent_total": "Approximate bytes sent to Redis",
+        "redis_bytes_received_total": "Approximate bytes received from Redis",
+        "redis_seconds_total": "Time spent waiting on Redis",
+        "db_queries_total": "SQL queries executed",
+        "db_seconds_total": "Time spent in SQL queries",
+    }
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, duration, stats):
+        labels = (("route", route), ("method", method))
+        request_labels = labels + (("status", str(status)),)
+        samples = {
+            "http_requests_total": 1,
+            "http_request_duration_seconds_total": duration,
+            "redis_commands_total": stats.redis_commands,
+            "redis_round_trips_total": stats.redis_round_trips,
+            "redis_pipelines_total": stats.redis_pipelines,
+            "redis_cache_hits_total": stats.redis_cache_hits,
+            "redis_bytes_sent_total": stats.redis_bytes_sent,
+            "redis_bytes_received_total": stats.redis_bytes_received,
+            "redis_seconds_total": stats.redis_seconds,
+            "db_queries_total": stats.db_queries,
+            "db_seconds_total": stats.db_seconds,
+        }
+        with self._lock:
+            for name, value in samples.items():
+                if name == "http_requests_total":
+                    key = (name, request_labels)
+                else:
+                    key = (name, labels)
+                self._values[key] = self._values.get(key, 0) + value
+
+    def total(self, name):
+        """The sum of a counter over all of its labels."""
+        with self._lock:
+            return sum(
+                value for (metric, _), value in self._values.items() if metric == name
+            )
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+
+        lines = []
+        for name, help_text in self.COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
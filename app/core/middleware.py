@@ -0,0 +1,78 @@
+# middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+from .instrumentation import end_request, install_sql_wrapper, metrics, start_request
+
+connection_created.connect(install_sql_wrapper, dispatch_uid="core.instrumentation")
+
+
+def _wrap_open_connections():
+    # Connections opened before the middleware was loaded (management
+    # commands, test clients) never fired connection_created for us
+    for connection in connections.all(initialized_only=True):
+        install_sql_wrapper(None, connection)
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+
+def _finish(request, response, stats, started):
+    total = time.perf_counter() - started
+    app = max(total - stats.redis_seconds - stats.db_seconds, 0.0)
+
+    response["Server-Timing"] = ", ".join(
+        (
+            f'redis;dur={_ms(stats.redis_seconds)};desc="{stats.redis_commands} cmds, '
+            f'{stats.redis_round_trips} rtts, {stats.redis_bytes_received} B in, '
+            f'{stats.redis_cache_hits} cached"',
+            f'db;dur={_ms(stats.db_seconds)};desc="{stats.db_queries} queries"',
+            f"app;dur={_ms(app)}",
+            f"total;dur={_ms(total)}",
+        )
+    )
+
+    match = getattr(request, "resolver_match", None)
+    route = match.route if match else "unmatched"
+    metrics.observe(route, request.method, response.status_code, total, stats)
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """
+    Count the Redis commands, round trips and SQL queries of each request.
+    The totals go out as a Server-Timing header and into the /metrics counters,
+    labelled by URL route.
+    """
+    _wrap_open_connections()
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started = time.perf_counter()
+            stats, token = start_request()
+            try:
+                response = await get_response(request)
+            finally:
+                end_request(token)
+            _finish(request, response, stats, started)
+            return response
+
+    else:
+
+        def middleware(request):
+            started = time.perf_counter()
+            stats, token = start_request()
+            try:
+                response = get_response(request)
+            finally:
+                end_request(token)
+            _finish(request, response, stats, started)
+            return response
+
+    return middleware
@@ -0,0 +1,92 @@
+# redis_async.py
+#
+# redis.asyncio clients for the async views, built from the same settings as
+# core/redis_client.py. Connections belong to the event loop that opened
+# them, so there is one bounded pool per running loop: under an ASGI server
+# that is a single pool shared by every request of the worker.
+import asyncio
+import random
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from redis.asyncio.cluster import ClusterNode
+from redis.asyncio.sentinel import Sentinel
+
+from .instrumentation import InstrumentedAsyncRedis, InstrumentedAsyncRedisCluster
+from .redis_client import connection_options, is_cluster
+
+_clients = weakref.WeakKeyDictionary()
+_replica_clients = weakref.WeakKeyDictionary()
+
+
+def _standalone(host, port):
+    # BlockingConnectionPool makes callers wait for a free connection
+    # instead of opening more than max_connections.
+    options = {
+        "host": host,
+        "port": port,
+        "db": settings.REDIS_DB,
+        "max_connections": settings.REDIS_ASYNC_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_ASYNC_POOL_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **connection_options(),
+        **settings.REDIS_ASYNC_POOL_OPTIONS,
+    }
+    pool = aioredis.BlockingConnectionPool(**options)
+    return InstrumentedAsyncRedis(connection_pool=pool)
+
+
+def _sentinel():
+    return Sentinel(
+        settings.REDIS_SENTINELS,
+        sentinel_kwargs={"socket_timeout": settings.REDIS_SOCKET_TIMEOUT},
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **connection_options(),
+    )
+
+
+def _build_primary():
+    if is_cluster():
+        return InstrumentedAsyncRedisCluster(
+            startup_nodes=[ClusterNode(h, p) for h, p in settings.REDIS_CLUSTER_NODES],
+            read_from_replicas=settings.REDIS_REPLICA_READS,
+            max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS,
+            **connection_options(),
+        )
+    if settings.REDIS_MODE == "sentinel":
+        return _sentinel().master_for(
+            settings.REDIS_SENTINEL_SERVICE, redis_class=InstrumentedAsyncRedis
+        )
+    return _standalone(settings.REDIS_HOST, settings.REDIS_PORT)
+
+
+def _build_replica():
+    if settings.REDIS_MODE == "sentinel":
+        return _sentinel().slave_for(
+            settings.REDIS_SENTINEL_SERVICE, redis_class=InstrumentedAsyncRedis
+        )
+    if settings.REDIS_MODE == "standalone" and settings.REDIS_REPLICAS:
+        return _standalone(*random.choice(settings.REDIS_REPLICAS))
+    return get_async_redis()
+
+
+def get_async_redis():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = _build_primary()
+    return client
+
+
+def get_async_replica_redis():
+    if not settings.REDIS_REPLICA_READS:
+        return get_async_redis()
+
+    loop = asyncio.get_running_loop()
+    client = _replica_clients.get(loop)
+    if client is None:
+        client = _replica_clients[loop] = _build_replica()
+    return client
@@ -0,0 +1,132 @@
+# redis_client.py
+#
+# Builds the process-wide Redis clients from settings (REDIS_MODE and the
+# REDIS_* pool/timeout knobs), so the cart, session and catalog modules never
+# construct connections themselves.
+#
+#   get_redis()          primary: every write and every script call
+#   get_replica_redis()  reads that can tolerate replication lag; the primary
+#                        unless REDIS_REPLICA_READS is on
+#   get_cached_redis()   primary over RESP3 with client-side caching: Redis
+#                        tracks the keys read through it and pushes an
+#                        invalidation when one changes (CART_NEAR_CACHE)
+#
+# In cluster mode the session key is used as a hash tag in the cart and
+# session keys (cart:{sid}, session:{sid}), so every key a cart script touches
+# lives in one slot.
+import random
+from functools import cache
+
+import redis
+from django.conf import settings
+from redis.cache import CacheConfig
+from redis.cluster import ClusterNode
+from redis.sentinel import Sentinel
+
+from .instrumentation import InstrumentedRedis, InstrumentedRedisCluster
+
+
+def is_cluster():
+    return settings.REDIS_MODE == "cluster"
+
+
+def hash_tag(value):
+    return f"{{{value}}}" if is_cluster() else value
+
+
+def connection_options():
+    return {
+        "decode_responses": settings.REDIS_DECODE_RESPONSES,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+    }
+
+
+def _standalone(host, port, **options):
+    # BlockingConnectionPool makes callers wait for a free connection instead
+    # of opening more than max_connections.
+    pool = redis.BlockingConnectionPool(
+        host=host,
+        port=port,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **connection_options(),
+        **options,
+    )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+@cache
+def _sentinel():
+    return Sentinel(
+        settings.REDIS_SENTINELS,
+        sentinel_kwargs={"socket_timeout": settings.REDIS_SOCKET_TIMEOUT},
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **connection_options(),
+    )
+
+
+@cache
+def get_redis():
+    if settings.REDIS_CLIENT is not None:
+        return settings.REDIS_CLIENT
+
+    if is_cluster():
+        # Replica routing is built into the cluster client: read-only
+        # commands go to replicas, scripts always run on the primaries.
+        return InstrumentedRedisCluster(
+            startup_nodes=[ClusterNode(h, p) for h, p in settings.REDIS_CLUSTER_NODES],
+            read_from_replicas=settings.REDIS_REPLICA_READS,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            **connection_options(),
+        )
+    if settings.REDIS_MODE == "sentinel":
+        return _sentinel().master_for(
+            settings.REDIS_SENTINEL_SERVICE, redis_class=InstrumentedRedis
+        )
+    return _standalone(settings.REDIS_HOST, settings.REDIS_PORT)
+
+
+@cache
+def get_replica_redis():
+    if settings.REDIS_CLIENT is not None or not settings.REDIS_REPLICA_READS:
+        return get_redis()
+
+    if settings.REDIS_MODE == "sentinel":
+        # Round-robins over the replicas, falls back to the primary
+        return _sentinel().slave_for(
+            settings.REDIS_SENTINEL_SERVICE, redis_class=InstrumentedRedis
+        )
+    if settings.REDIS_MODE == "standalone" and settings.REDIS_REPLICAS:
+        # One replica per process spreads the workers over all of them
+        return _standalone(*random.choice(settings.REDIS_REPLICAS))
+    # Cluster: the primary client already reads from replicas
+    return get_redis()
+
+
+@cache
+def get_cached_redis():
+    if settings.REDIS_CLIENT is not None or not settings.CART_NEAR_CACHE:
+        return get_redis()
+
+    # Tracking and its invalidation pushes need RESP3 (Redis 7.4+)
+    options = {
+        "protocol": 3,
+        "cache_config": CacheConfig(max_size=settings.CART_NEAR_CACHE_SIZE),
+    }
+    if is_cluster():
+        return InstrumentedRedisCluster(
+            startup_nodes=[ClusterNode(h, p) for h, p in settings.REDIS_CLUSTER_NODES],
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            **connection_options(),
+            **options,
+        )
+    if settings.REDIS_MODE == "sentinel":
+        return _sentinel().master_for(
+            settings.REDIS_SENTINEL_SERVICE, redis_class=InstrumentedRedis, **options
+        )
+    return _standalone(settings.REDIS_HOST, settings.REDIS_PORT, **options)
@@ -0,0 +1,120 @@
+# redis_session.py
+#
+# Session engine storing sessions in Redis on the same client (and pool) as
+# the cart, so a cart request never touches Postgres.
+#
+#   session:{session_key}  string  encoded session data, expires with the cart
+#
+# When login rotates the key, the old one is kept on previous_session_key, so
+# the user_logged_in receivers can find what belonged to the anonymous
+# session (its cart).
+#
+# Enable with SESSION_ENGINE = "core.redis_session".
+from django.contrib.sessions.backends.base import CreateError, SessionBase
+
+from .redis_async import get_async_redis
+from .redis_client import get_redis, hash_tag
+
+r = get_redis()
+
+
+def session_redis_key(session_key):
+    return f"session:{hash_tag(session_key)}"
+
+
+class SessionStore(SessionBase):
+    previous_session_key = None
+
+    def _redis_key(self, session_key=None):
+        return session_redis_key(session_key or self._get_or_create_session_key())
+
+    def load(self):
+        data = r.get(self._redis_key()) if self.session_key else None
+        return self._decode_or_reset(data)
+
+    async def aload(self):
+        data = None
+        if self.session_key:
+            data = await get_async_redis().get(self._redis_key())
+        return self._decode_or_reset(data)
+
+    def _decode_or_reset(self, data):
+        if data is None:
+            # Unknown or expired key: start a fresh session on the next save
+            self._session_key = None
+            return {}
+        return self.decode(data)
+
+    def exists(self, session_key):
+        return bool(session_key) and r.exists(session_redis_key(session_key)) > 0
+
+    async def aexists(self, session_key):
+        if not session_key:
+            return False
+        return await get_async_redis().exists(session_redis_key(session_key)) > 0
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue  # Key collision, try another one
+            self.modified = True
+            return
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self.encode(self._get_session(no_load=must_create))
+        stored = r.set(
+            self._redis_key(), data, ex=self.get_expiry_age(), nx=must_create
+        )
+        if must_create and not stored:
+            raise CreateError
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        data = self.encode(await self._aget_session(no_load=must_create))
+        stored = await get_async_redis().set(
+            self._redis_key(), data, ex=await self.aget_expiry_age(), nx=must_create
+        )
+        if must_create and not stored:
+            raise CreateError
+
+    def cycle_key(self):
+        self.previous_session_key = self.session_key
+        super().cycle_key()
+
+    async def acycle_key(self):
+        self.previous_session_key = self.session_key
+        await super().acycle_key()
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key:
+            r.delete(session_redis_key(session_key))
+
+    async def adelete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key:
+            await get_async_redis().delete(session_redis_key(session_key))
+
+    @classmethod
+    def clear_expired(cls):
+        pass  # Redis expires the keys itself
+
+    @classmethod
+    async def aclear_expired(cls):
+        pass
@@ -0,0 +1,47 @@
+# renderers.py
+#
+# orjson based DRF renderer and parser, set as the defaults in REST_FRAMEWORK.
+# Output is compact JSON like DRF's JSONRenderer (no whitespace, unicode
+# unescaped); types orjson doesn't know (Decimal, lazy strings, ...) go
+# through DRF's own encoder.
+import orjson
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_fallback = JSONEncoder().default
+
+
+def render_json(data):
+    return orjson.dumps(data, default=_fallback)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return render_json(data)
+
+
+class ORJSONParser(BaseParser):
+    media_type = "application/json"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class ORJSONResponse(HttpResponse):
+    """JsonResponse equivalent for the plain Django (async) views."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=render_json(data), **kwargs)
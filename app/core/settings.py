@@ -10,7 +10,6 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
-import redis
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,11 +38,13 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "inventory",
+    "cart",
     "rest_framework",
     "drf_spectacular",
 ]
 
 MIDDLEWARE = [
+    "core.middleware.instrumentation_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -87,17 +88,111 @@ DATABASES = {
     }
 }
 
+# Redis topology, see core/redis_client.py
+#   "standalone"  REDIS_HOST/REDIS_PORT, reads optionally from REDIS_REPLICAS
+#   "sentinel"    primary and replicas discovered through REDIS_SENTINELS
+#   "cluster"     Redis Cluster seeded from REDIS_CLUSTER_NODES
+REDIS_MODE = "standalone"
 REDIS_HOST = "redis"
 REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_DECODE_RESPONSES = True
 
-REDIS_CLIENT = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB,
-    decode_responses=REDIS_DECODE_RESPONSES,
-)
+REDIS_SENTINELS = [("sentinel", 26379)]
+REDIS_SENTINEL_SERVICE = "mymaster"
+REDIS_CLUSTER_NODES = [("redis", 6379)]
+
+# Send cart reads (get_cart, get_cart_promo_code) and catalog lookups to
+# replicas. Replicas lag a little behind, so a read right after a write may
+# not see it yet.
+REDIS_REPLICA_READS = False
+REDIS_REPLICAS = []  # [(host, port)], standalone mode only
+
+REDIS_MAX_CONNECTIONS = 50  # per process (per node in cluster mode)
+REDIS_POOL_TIMEOUT = 5  # seconds to wait for a free connection
+REDIS_SOCKET_TIMEOUT = 2
+REDIS_SOCKET_CONNECT_TIMEOUT = 1
+REDIS_HEALTH_CHECK_INTERVAL = 30  # ping idle connections before reuse
+
+# Near-cache for cart reads (sync views): cart hashes are read over a RESP3
+# connection with client-side caching, and Redis pushes an invalidation to
+# every process holding a copy when the cart changes. Needs Redis 7.4+.
+CART_NEAR_CACHE = False
+CART_NEAR_CACHE_SIZE = 10_000  # carts per process
+
+# A prebuilt client used instead of the ones above (benchmark stand-ins)
+REDIS_CLIENT = None
+
+# Pool used by the async (ASGI) cart views, see core/redis_async.py
+REDIS_ASYNC_MAX_CONNECTIONS = 50
+REDIS_ASYNC_POOL_TIMEOUT = 5  # seconds to wait for a free connection
+REDIS_ASYNC_POOL_OPTIONS = {}  # extra connection pool kwargs
+
+# Carts and sessions expire together: the cart scripts slide the session
+# key's TTL along with the cart, and the cookie lives until the browser closes.
+CART_TTL = 60 * 30  # 30 minutes
+
+SESSION_ENGINE = "core.redis_session"
+SESSION_COOKIE_AGE = CART_TTL
+SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+
+# Carts of signed in users (cart/owners.py) outlive their sessions, so they
+# follow the user across logins and devices. Their stock holds, with
+# STOCK_RESERVATIONS, last as long.
+CART_USER_TTL = 60 * 60 * 24 * 7  # 7 days
+
+# Encoding of the JSON values stored in Redis: "orjson" or "json", see
+# core/codec.py. Both read what the other wrote.
+REDIS_CODEC = "orjson"
+
+# Idle carts are reported on the carts:events stream by the sweep_carts
+# command, see cart/expiry.py
+CART_ABANDONED_AFTER = 60 * 10  # 10 minutes without a change
+CART_EVENTS_MAXLEN = 100_000  # approximate stream length cap
+CART_SWEEP_BATCH = 500  # index entries per sweeper script call
+
+# Reserve Product.stock in Redis when carts add units, see inventory/stock.py.
+# The reservation runs inside the cart scripts, so it can't be used with
+# REDIS_MODE = "cluster" (the stock keys live in other slots).
+STOCK_RESERVATIONS = True
+
+# Called as evaluator(promo_code, lines, products) -> discount in cents, only
+# when the cart lines, the promo code or the promo rules version changed since
+# the last evaluation.
+# See cart/totals.py; cart/promotions.py evaluates the Promo rules.
+CART_PROMO_EVALUATOR = "cart.promotions.evaluate"
+PROMO_RULES_TTL = 5  # seconds between checks of the promo rules version
+
+# Process-local product snapshot cache in front of the Redis catalog hash
+CATALOG_LOCAL_CACHE_SIZE = 10_000
+CATALOG_LOCAL_CACHE_TTL = 5  # seconds
+
+# Per cart and per client IP rate limits on the cart endpoints, set per
+# endpoint in cart/urls.py, see cart/throttling.py. Behind a proxy, set
+# REST_FRAMEWORK["NUM_PROXIES"] so the client IP is read from X-Forwarded-For.
+CART_THROTTLING = True
+
+# How long the result of a cart request sent with an Idempotency-Key is kept
+# for its retries, see cart/idempotency.py
+CART_IDEMPOTENCY_TTL = 60 * 10  # 10 minutes
+
+# Write-behind copies of the carts in Postgres, see cart/persistence.py. The
+# cart scripts queue changed carts on a stream and the persist_carts command
+# writes them in batches, so no cart request waits on SQL. A request that
+# finds a user cart missing from Redis restores the last copy, unless the
+# cart's TTL ran out since it was written. Anonymous carts aren't copied. Not supported with REDIS_MODE = "cluster" (the queue keys
+# live in another slot).
+CART_PERSISTENCE = False
+CART_PERSIST_BATCH = 500  # queued carts per Postgres write
+CART_PERSIST_RETENTION = 60 * 60 * 24 * 30  # 30 days; older copies are pruned
+
+# Bearer token the Prometheus scraper sends to GET /metrics (Authorization:
+# Bearer <token>). The endpoint answers 404 while it is unset.
+METRICS_TOKEN = None
+
+# "compact": one hash per cart, "split": separate qty/details/promo_code keys.
+# Carts written in the split layout are migrated on first touch.
+CART_LAYOUT = "compact"
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,6 +237,15 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_RENDERER_CLASSES": [
+        "core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "core.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -0,0 +1,50 @@
+"""
+Stand-in settings for the benchmark commands when no Redis or Postgres is at
+hand: SQLite and an in-process fakeredis server shared by the sync and async
+clients. Needs the packages in requirements-bench.txt.
+
+    DJANGO_SETTINGS_MODULE=core.settings_bench python manage.py migrate
+    DJANGO_SETTINGS_MODULE=core.settings_bench python manage.py bench_endpoints
+
+Numbers measured here only make sense relative to each other; run against
+the docker-compose services for absolute latencies.
+"""
+
+import fakeredis
+from fakeredis.aioredis import FakeAsyncRedisConnection
+
+from .instrumentation import InstrumentedRedisMixin
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, REDIS_DECODE_RESPONSES
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "bench.sqlite3",
+    }
+}
+
+FAKE_REDIS_SERVER = fakeredis.FakeServer()
+
+
+class InstrumentedFakeRedis(InstrumentedRedisMixin, fakeredis.FakeRedis):
+    pass
+
+
+REDIS_CLIENT = InstrumentedFakeRedis(
+    server=FAKE_REDIS_SERVER, decode_responses=REDIS_DECODE_RESPONSES
+)
+
+# fakeredis connections fail the health check PING
+REDIS_HEALTH_CHECK_INTERVAL = 0
+
+REDIS_ASYNC_POOL_OPTIONS = {
+    "connection_class": FakeAsyncRedisConnection,
+    "server": FAKE_REDIS_SERVER,
+}
+
+# The covering indexes' INCLUDE columns only matter on PostgreSQL
+SILENCED_SYSTEM_CHECKS = ["models.W040"]
+
+# The benchmarks send every request from one client
+CART_THROTTLING = False
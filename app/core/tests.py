@@ -0,0 +1,116 @@
+from unittest import mock
+
+from django.contrib.sessions.backends.base import CreateError
+from django.test import SimpleTestCase, TestCase, override_settings
+from redis.cache import CacheConfig, CacheEntry, CacheEntryStatus, CacheKey, DefaultCache
+
+from inventory.models import Category, Product
+
+from .instrumentation import end_request, start_request
+from .redis_client import get_redis
+from .redis_session import SessionStore, session_redis_key
+
+r = get_redis()
+
+
+class RedisSessionTests(TestCase):
+    def setUp(self):
+        r.flushall()
+
+    def test_round_trip(self):
+        session = SessionStore()
+        session["cart"] = "abc"
+        session.save()
+        key = session_redis_key(session.session_key)
+        self.assertGreater(r.ttl(key), 0)
+        self.assertLessEqual(r.ttl(key), session.get_expiry_age())
+
+        self.assertEqual(SessionStore(session.session_key)["cart"], "abc")
+        self.assertTrue(SessionStore().exists(session.session_key))
+
+    def test_unknown_keys_start_a_new_session(self):
+        session = SessionStore("x" * 32)
+        self.assertEqual(dict(session), {})
+        session["cart"] = "abc"
+        session.save()
+        self.assertNotEqual(session.session_key, "x" * 32)
+        self.assertFalse(r.exists(session_redis_key("x" * 32)))
+
+    def test_keys_are_never_reused(self):
+        session = SessionStore()
+        session.create()
+        taken = SessionStore(session.session_key)
+        with self.assertRaises(CreateError):
+            taken.save(must_create=True)
+
+    def test_cycle_key_remembers_the_previous_key(self):
+        session = SessionStore()
+        session["cart"] = "abc"
+        session.save()
+        old_key = session.session_key
+        session.cycle_key()
+        self.assertEqual(session.previous_session_key, old_key)
+        self.assertFalse(r.exists(session_redis_key(old_key)))
+        self.assertEqual(SessionStore(session.session_key)["cart"], "abc")
+
+    def test_delete(self):
+        session = SessionStore()
+        session.create()
+        session.delete()
+        self.assertFalse(session.exists(session.session_key))
+
+    async def test_async_round_trip(self):
+        session = SessionStore()
+        await session.aset("cart", "abc")
+        await session.asave()
+        self.assertTrue(await SessionStore().aexists(session.session_key))
+        self.assertEqual(await SessionStore(session.session_key).aget("cart"), "abc")
+        await session.acycle_key()
+        self.assertFalse(await SessionStore().aexists(session.previous_session_key))
+        await session.adelete()
+        self.assertFalse(await SessionStore().aexists(session.session_key))
+
+    def test_cart_requests_run_no_sql(self):
+        category = Category.objects.create(name="Audio", slug="audio", is_active=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                category=category, name="Amp", slug="amp", price="9.99", is_active=True
+            )
+        add = {"product_id": product.id, "quantity": 1}
+        with self.assertNumQueries(0):
+            self.client.post("/api/cart/add/", add, content_type="application/json")
+            response = self.client.get("/api/cart/get/")
+        self.assertEqual(len(response.json()["items"]), 1)
+
+
+class MetricsTests(TestCase):
+    def test_off_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_needs_the_token(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("Bearer", response["WWW-Authenticate"])
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"redis_round_trips_total", response.content)
+
+
+class CacheHitTests(SimpleTestCase):
+    def test_cached_reads_are_not_counted_as_commands(self):
+        cache = DefaultCache(CacheConfig())
+        cache.set(
+            CacheEntry(CacheKey("HGETALL", ("cart:a",)), b"", CacheEntryStatus.VALID, None)
+        )
+        stats, token = start_request()
+        try:
+            with mock.patch.object(r, "get_cache", return_value=cache, create=True):
+                r.hgetall("cart:a")
+                r.hgetall("cart:b")
+        finally:
+            end_request(token)
+        self.assertEqual((stats.redis_cache_hits, stats.redis_commands), (1, 1))
@@ -0,0 +1,26 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .instrumentation import metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint for the per-route request counters. Needs the
+    METRICS_TOKEN bearer token, and doesn't exist without one.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        credentials.encode(), token.encode()
+    ):
+        response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+        response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+        return response
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
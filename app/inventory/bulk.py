@@ -0,0 +1,222 @@
+# bulk.py
+#
+# Bulk catalog import/export over COPY (PostgreSQL only).
+#
+# An import streams the file into a temporary staging table, then upserts it
+# into the real table in id ordered batches of INSERT ... SELECT ... ON
+# CONFLICT, all in one transaction. Rows whose imported columns didn't change
+# aren't rewritten. The Product/Category signals don't fire, so what they
+# maintain is caught up after the commit: category paths are rebuilt, the
+# Redis snapshots of the changed products are evicted (reloaded on the next
+# miss), they are reindexed for search, their stock is pushed to Redis and
+# the catalog version is bumped.
+#
+# Formats:
+#
+#   csv    header row naming the columns, as in db-data/*.csv
+#   jsonl  one object per line, the keys of the first one name the columns
+#
+# Any subset of COLUMNS that includes "id" can be imported: existing rows only
+# get those columns updated, new rows get the model defaults for the others.
+import datetime
+import decimal
+from array import array
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from core import codec
+
+from .catalog import bump_catalog_version, evict_products
+from .models import Category, Product
+from .search import index_products
+from .stock import sync_many
+from .tree import rebuild_paths
+
+COLUMNS = {
+    Category: ["id", "parent_id", "name", "slug", "is_active", "level"],
+    Product: [
+        "id",
+        "category_id",
+        "name",
+        "slug",
+        "description",
+        "is_digital",
+        "is_active",
+        "created_at",
+        "updated_at",
+        "price",
+        "stock",
+    ],
+}
+
+# Accepted for round trips but recomputed from the tree by rebuild_paths
+DERIVED = {"level"}
+
+STAGING_TABLE = "catalog_staging"
+COPY_CHUNK = 1 << 20  # bytes per write to the COPY stream
+
+
+def _columns(model, columns):
+    unknown = set(columns) - set(COLUMNS[model])
+    if unknown:
+        raise ValueError(f"Unknown {model.__name__} columns: {', '.join(sorted(unknown))}")
+    if "id" not in columns:
+        raise ValueError(f"The {model.__name__} rows need an id column.")
+    return columns
+
+
+def _insert_defaults(model, columns):
+    """(column, SQL, params) for the NOT NULL columns a new row would miss."""
+    defaults = []
+    for field in model._meta.concrete_fields:
+        if field.column in columns or field.null or field.primary_key:
+            continue
+        if getattr(field, "auto_now_add", False):
+            defaults.append((field.column, "now()", []))
+        elif field.has_default():
+            defaults.append((field.column, "%s", [field.get_default()]))
+    return defaults
+
+
+def _copy_csv(cursor, model, stream):
+    header = stream.readline().decode().strip()
+    columns = _columns(model, [column.strip() for column in header.split(",")])
+    with cursor.copy(f"COPY {STAGING_TABLE} ({', '.join(columns)}) FROM STDIN (FORMAT csv)") as copy:
+        while chunk := stream.read(COPY_CHUNK):
+            copy.write(chunk)
+    return columns
+
+
+def _copy_jsonl(cursor, model, stream):
+    records = (codec.loads(line) for line in stream if line.strip())
+    first = next(records, None)
+    if first is None:
+        return None
+    columns = _columns(model, list(first))
+    with cursor.copy(f"COPY {STAGING_TABLE} ({', '.join(columns)}) FROM STDIN") as copy:
+        copy.write_row([first.get(column) for column in columns])
+        for record in records:
+            copy.write_row([record.get(column) for column in columns])
+    return columns
+
+
+def _upsert(cursor, model, columns, batch_size):
+    """Upsert the staging table, batch_size ids at a time. Returns the changed ids."""
+    table = model._meta.db_table
+    columns = [column for column in columns if column not in DERIVED]
+    defaults = _insert_defaults(model, columns)
+    updated = [column for column in columns if column != "id"]
+
+    insert_columns = ", ".join(columns + [column for column, _, _ in defaults])
+    select = ", ".join(columns + [sql for _, sql, _ in defaults])
+    params = [param for _, _, values in defaults for param in values]
+    if updated:
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in updated)
+        current = ", ".join(f"{table}.{column}" for column in updated)
+        excluded = ", ".join(f"EXCLUDED.{column}" for column in updated)
+        conflict = (
+            f"DO UPDATE SET {assignments} "
+            f"WHERE ({current}) IS DISTINCT FROM ({excluded})"
+        )
+    else:
+        conflict = "DO NOTHING"
+    upsert = (
+        f"INSERT INTO {table} ({insert_columns}) "
+        f"SELECT {select} FROM {STAGING_TABLE} WHERE id > %s AND id <= %s "
+        f"ON CONFLICT (id) {conflict} RETURNING id"
+    )
+    bound = (
+        f"SELECT max(id) FROM (SELECT id FROM {STAGING_TABLE} "
+        f"WHERE id > %s ORDER BY id LIMIT %s) AS batch"
+    )
+
+    changed = array("q")
+    last = 0
+    while True:
+        cursor.execute(bound, [last, batch_size])
+        (upper,) = cursor.fetchone()
+        if upper is None:
+            return changed
+        cursor.execute(upsert, params + [last, upper])
+        changed.extend(product_id for (product_id,) in cursor.fetchall())
+        last = upper
+
+
+def _load(cursor, model, stream, fmt, batch_size):
+    table = model._meta.db_table
+    # Same column types as the real table, none of its constraints
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {STAGING_TABLE} ON COMMIT DROP AS "
+        f"SELECT {', '.join(COLUMNS[model])} FROM {table} WITH NO DATA"
+    )
+    columns = (_copy_csv if fmt == "csv" else _copy_jsonl)(cursor, model, stream)
+    changed = array("q")
+    if columns:
+        cursor.execute(f"CREATE INDEX ON {STAGING_TABLE} (id)")
+        cursor.execute(f"ANALYZE {STAGING_TABLE}")
+        changed = _upsert(cursor, model, columns, batch_size)
+    cursor.execute(f"DROP TABLE {STAGING_TABLE}")
+    # Ids were given explicitly, so move the sequence past them
+    for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+        cursor.execute(sql)
+    return changed
+
+
+def _catch_up(product_ids, batch_size):
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start : start + batch_size].tolist()
+        evict_products(batch)
+        index_products(batch)
+        if settings.STOCK_RESERVATIONS:
+            sync_many(Product.objects.filter(id__in=batch).values_list("id", "stock"))
+    bump_catalog_version()
+
+
+def import_catalog(categories=None, products=None, fmt="csv", batch_size=10_000):
+    """
+    Upsert the category and product rows read from the given binary streams,
+    in one transaction. Returns {"categories": n, "products": n}, the rows
+    inserted or changed.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        changed_categories = array("q")
+        if categories is not None:
+            changed_categories = _load(cursor, Category, categories, fmt, batch_size)
+            rebuild_paths(batch_size)
+        changed_products = array("q")
+        if products is not None:
+            changed_products = _load(cursor, Product, products, fmt, batch_size)
+
+    _catch_up(changed_products, batch_size)
+    return {"categories": len(changed_categories), "products": len(changed_products)}
+
+
+def _jsonable(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def export_catalog(model, stream, fmt="csv"):
+    """Stream every row of model, in id order, to a binary stream."""
+    columns = COLUMNS[model]
+    query = f"SELECT {', '.join(columns)} FROM {model._meta.db_table} ORDER BY id"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if fmt == "csv":
+            with cursor.copy(f"COPY ({query}) TO STDOUT (FORMAT csv, HEADER)") as copy:
+                for chunk in copy:
+                    stream.write(chunk)
+            return
+
+        # The binary format comes back as typed rows, no text parsing
+        cursor.execute(f"{query} LIMIT 0")
+        types = [column.type_code for column in cursor.description]
+        with cursor.copy(f"COPY ({query}) TO STDOUT (FORMAT binary)") as copy:
+            copy.set_types(types)
+            for row in copy.rows():
+                record = {column: _jsonable(value) for column, value in zip(columns, row)}
+                stream.write(codec.dumps(record) + b"\n")
@@ -0,0 +1,203 @@
+# catalog.py
+#
+# Shared product snapshot used to hydrate carts. Carts only store
+# product_id -> quantity; name and price live once in this hash instead of
+# being copied into every cart.
+#
+#   catalog:products  hash  product_id -> {"name", "price", "category_id"}
+#
+# Only active products are cached. Entries are written by the Product
+# save/delete signals and filled from Postgres on a miss.
+#
+#   catalog:version  counter bumped on every Product/Category change, used to
+#                    key cached catalog pages so a bump invalidates them all
+#
+# In front of the Redis hash sits a small process-local LRU with a short TTL,
+# so hot products (and ids known to be unavailable) are resolved without any
+# network call. Other processes see a change after at most the TTL.
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core import codec
+from core.redis_async import get_async_redis, get_async_replica_redis
+from core.redis_client import get_redis, get_replica_redis
+
+from .models import Product
+
+r = get_redis()
+replica = get_replica_redis()
+
+CATALOG_KEY = "catalog:products"
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+class _SnapshotCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, product_ids):
+        """Return {product_id: snapshot or None} for the fresh entries."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for pid in product_ids:
+                entry = self._entries.get(pid)
+                if entry is None:
+                    continue
+                expires_at, snapshot = entry
+                if expires_at < now:
+                    del self._entries[pid]
+                    continue
+                self._entries.move_to_end(pid)
+                found[pid] = snapshot
+        return found
+
+    def set_many(self, snapshots):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for pid, snapshot in snapshots.items():
+                self._entries[pid] = (expires_at, snapshot)
+                self._entries.move_to_end(pid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, product_id):
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+
+_local = _SnapshotCache(
+    settings.CATALOG_LOCAL_CACHE_SIZE, settings.CATALOG_LOCAL_CACHE_TTL
+)
+
+
+def _pack(name, price, category_id):
+    return codec.dumps({"name": name, "price": str(price), "category_id": category_id})
+
+
+def _unpack(value):
+    data = codec.loads(value)
+    data["price"] = float(data["price"])
+    return data
+
+
+def cache_product(product):
+    _local.discard(product.id)
+    if product.is_active:
+        packed = _pack(product.name, product.price, product.category_id)
+        r.hset(CATALOG_KEY, product.id, packed)
+    else:
+        r.hdel(CATALOG_KEY, product.id)
+
+
+def evict_product(product_id):
+    _local.discard(product_id)
+    r.hdel(CATALOG_KEY, product_id)
+
+
+def evict_products(product_ids):
+    """Drop many snapshots at once, e.g. after a bulk import."""
+    if not product_ids:
+        return
+    for pid in product_ids:
+        _local.discard(pid)
+    r.hdel(CATALOG_KEY, *product_ids)
+
+
+def get_catalog_version():
+    return int(r.get(CATALOG_VERSION_KEY) or 0)
+
+
+async def aget_catalog_version():
+    return int(await get_async_redis().get(CATALOG_VERSION_KEY) or 0)
+
+
+def bump_catalog_version():
+    return r.incr(CATALOG_VERSION_KEY)
+
+
+def _split_hits(product_ids, values):
+    products, missing = {}, []
+    for pid, value in zip(product_ids, values):
+        snapshot = None if value is None else _unpack(value)
+        # Snapshots cached before they carried the category are reloaded
+        if snapshot is None or "category_id" not in snapshot:
+            missing.append(pid)
+        else:
+            products[pid] = snapshot
+    return products, missing
+
+
+def _remember(product_ids, products):
+    # Ids that weren't found are remembered as unavailable too
+    _local.set_many({pid: products.get(pid) for pid in product_ids})
+
+
+def get_products(product_ids):
+    """
+    Return {product_id: {"name", "price", "category_id"}} for the active
+    products among product_ids. Unknown or inactive ids are left out.
+
+    Lookups go local cache -> Redis hash -> one bulk Postgres query.
+    """
+    product_ids = list(product_ids)
+    local = _local.get_many(product_ids)
+    products = {pid: product for pid, product in local.items() if product}
+
+    remote_ids = [pid for pid in product_ids if pid not in local]
+    if not remote_ids:
+        return products
+
+    fetched, missing = _split_hits(remote_ids, replica.hmget(CATALOG_KEY, remote_ids))
+    if missing:
+        packed = _load_packed(missing)
+        if packed:
+            r.hset(CATALOG_KEY, mapping=packed)
+            fetched.update({pid: _unpack(value) for pid, value in packed.items()})
+
+    _remember(remote_ids, fetched)
+    products.update(fetched)
+    return products
+
+
+async def aget_products(product_ids):
+    """Async variant of get_products for the ASGI cart views."""
+    product_ids = list(product_ids)
+    local = _local.get_many(product_ids)
+    products = {pid: product for pid, product in local.items() if product}
+
+    remote_ids = [pid for pid in product_ids if pid not in local]
+    if not remote_ids:
+        return products
+
+    values = await get_async_replica_redis().hmget(CATALOG_KEY, remote_ids)
+    fetched, missing = _split_hits(remote_ids, values)
+    if missing:
+        packed = await sync_to_async(_load_packed)(missing)
+        if packed:
+            await get_async_redis().hset(CATALOG_KEY, mapping=packed)
+            fetched.update({pid: _unpack(value) for pid, value in packed.items()})
+
+    _remember(remote_ids, fetched)
+    products.update(fetched)
+    return products
+
+
+def snapshot_rows(product_ids):
+    # Only the columns the snapshot needs, never the description: all of them
+    # are in product_active_snapshot_idx, so this is an index-only scan
+    return Product.objects.filter(id__in=product_ids, is_active=True).values_list(
+        "id", "name", "price", "category_id"
+    )
+
+
+def _load_packed(product_ids):
+    rows = snapshot_rows(product_ids)
+    return {pid: _pack(name, price, category) for pid, name, price, category in rows}
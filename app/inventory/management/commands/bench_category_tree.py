@@ -0,0 +1,136 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from core.benchmarking import HEADER, summarize
+from inventory.models import Category, Product
+from inventory.tree import ancestor_ids, rebuild_paths, subtree_products
+
+
+def _seed_tree(categories, depth, roots):
+    """
+    A tree of `categories` categories, one product each: `roots` top level
+    categories, the rest spread evenly over the levels below. Inserted level
+    by level in bulk, so paths come from rebuild_paths. Returns a top level
+    category and one of the deepest.
+    """
+    prefix = f"tree-{categories}-{depth}-{roots}"
+    if Category.objects.filter(slug__startswith=f"{prefix}-").count() < categories:
+        per_level = max((categories - roots) // max(depth - 1, 1), 1)
+        parents, number = [None], 0
+        for level in range(depth):
+            if level == 0:
+                count = roots
+            elif level == depth - 1:
+                count = categories - number
+            else:
+                count = per_level
+            created = Category.objects.bulk_create(
+                Category(
+                    parent=parents[i % len(parents)],
+                    name=f"{prefix} {number + i}",
+                    slug=f"{prefix}-{number + i}",
+                    is_active=True,
+                    level=level + 1,
+                )
+                for i in range(count)
+            )
+            Product.objects.bulk_create(
+                Product(
+                    category=category,
+                    name=f"{prefix} product {number + i}",
+                    slug=f"{prefix}-product-{number + i}",
+                    price="9.99",
+                    is_active=True,
+                )
+                for i, category in enumerate(created)
+            )
+            parents, number = created, number + count
+        rebuild_paths()
+    tree = Category.objects.filter(slug__startswith=f"{prefix}-")
+    top = tree.order_by("level", "id").first()
+    leaf = tree.order_by("-level", "id").first()
+    return top, leaf
+
+
+def _adjacency_subtree(category_id):
+    # The walk the path replaces: one query per level, then the products
+    category_ids, frontier = [category_id], [category_id]
+    while frontier:
+        frontier = list(
+            Category.objects.filter(parent_id__in=frontier).values_list("id", flat=True)
+        )
+        category_ids += frontier
+    return list(
+        Product.objects.filter(category_id__in=category_ids, is_active=True).values_list(
+            "id", flat=True
+        )
+    )
+
+
+def _path_subtree(path):
+    return list(subtree_products(path).values_list("id", flat=True))
+
+
+def _adjacency_breadcrumbs(category_id):
+    crumbs = []
+    while category_id is not None:
+        category = Category.objects.only("id", "name", "slug", "parent_id").get(id=category_id)
+        crumbs.append(category)
+        category_id = category.parent_id
+    return crumbs[::-1]
+
+
+def _path_breadcrumbs(path):
+    return list(Category.objects.filter(id__in=ancestor_ids(path)).order_by("level"))
+
+
+class Command(BaseCommand):
+    help = (
+        "Subtree product listing and breadcrumbs on a deep category tree: "
+        "materialized paths against walking the parent links."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument("--categories", type=int, default=10_000)
+        parser.add_argument("--depth", type=int, default=12)
+        parser.add_argument("--roots", type=int, default=10, help="Top level categories")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+        top, leaf = _seed_tree(options["categories"], options["depth"], options["roots"])
+        client = Client()
+
+        cases = [
+            ("adjacency subtree, top level", lambda: _adjacency_subtree(top.id)),
+            ("path subtree, top level", lambda: _path_subtree(top.path)),
+            ("adjacency breadcrumbs, leaf", lambda: _adjacency_breadcrumbs(leaf.id)),
+            ("path breadcrumbs, leaf", lambda: _path_breadcrumbs(leaf.path)),
+            (
+                "GET categories/<top>/products/",
+                lambda: client.get(f"/api/categories/{top.slug}/products/"),
+            ),
+            (
+                "GET categories/<leaf>/breadcrumbs/",
+                lambda: client.get(f"/api/categories/{leaf.slug}/breadcrumbs/"),
+            ),
+        ]
+
+        self.stdout.write(
+            f"{iterations} calls per case, {options['categories']} categories, "
+            f"depth {options['depth']}, {len(_path_subtree(top.path))} products "
+            f"under the top level category\n"
+        )
+        self.stdout.write(HEADER)
+        for name, operation in cases:
+            samples = []
+            start = time.perf_counter()
+            for _ in range(iterations):
+                call_start = time.perf_counter()
+                operation()
+                samples.append(time.perf_counter() - call_start)
+            self.stdout.write(summarize(name, samples, time.perf_counter() - start))
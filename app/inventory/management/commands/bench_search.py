@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from core.benchmarking import REDIS_HEADER, count_redis_commands, summarize
+from inventory.models import Category, Product
+from inventory.search import rebuild_search_index
+
+ADJECTIVES = [
+    "classic", "compact", "deluxe", "ergonomic", "portable", "rugged", "smart", "wireless"
+]
+NOUNS = ["backpack", "blender", "camera", "headphones", "keyboard", "lamp", "speaker", "watch"]
+
+
+def _seed(products):
+    """At least `products` search bench products with varied multi-word names."""
+    existing = Product.objects.filter(slug__startswith="search-bench-").count()
+    if existing >= products:
+        return
+    category, _ = Category.objects.get_or_create(
+        slug="search-bench", defaults={"name": "Search bench", "is_active": True}
+    )
+    rng = random.Random(existing)
+    for start in range(existing, products, 10_000):
+        Product.objects.bulk_create(
+            Product(
+                category=category,
+                name=f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+                slug=f"search-bench-{i}",
+                price=f"{1 + i % 500}.99",
+                is_active=True,
+            )
+            for i in range(start, min(start + 10_000, products))
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Typeahead queries against GET /api/products/search/ on a large "
+        "catalog: one to three letter prefixes and multi-word queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--products", type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+        _seed(options["products"])
+        rebuild_search_index()
+        client = Client()
+
+        queries = ["w", "wi", "wir", "wireless", "wireless ca", "smart watch 12", "zz"]
+        self.stdout.write(f"{iterations} calls per case, {options['products']} products\n")
+        self.stdout.write(REDIS_HEADER)
+        for query in queries:
+            client.get("/api/products/search/", {"q": query})  # warm the snapshots
+            samples = []
+            with count_redis_commands() as stats:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    call_start = time.perf_counter()
+                    client.get("/api/products/search/", {"q": query})
+                    samples.append(time.perf_counter() - call_start)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(summarize(f"q={query!r}", samples, elapsed, stats))
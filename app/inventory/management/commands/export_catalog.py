@@ -0,0 +1,33 @@
+import sys
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from inventory.bulk import export_catalog
+from inventory.models import Category, Product
+
+MODELS = {"categories": Category, "products": Product}
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream every category or product row through COPY to a CSV or JSON "
+        "Lines file, in the layout import_catalog reads. Writes to stdout by "
+        "default."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("table", choices=list(MODELS))
+        parser.add_argument("--output", default="-", help="File to write, - for stdout")
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("The catalog export needs PostgreSQL (COPY).")
+        with ExitStack() as stack:
+            if options["output"] == "-":
+                stream = sys.stdout.buffer
+            else:
+                stream = stack.enter_context(open(options["output"], "wb"))
+            export_catalog(MODELS[options["table"]], stream, options["format"])
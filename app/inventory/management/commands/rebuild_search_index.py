@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory.search import TOKENS_KEY, r, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the Redis product search index from Postgres, e.g. after a "
+        "bulk load that bypassed the ORM. Safe to run while serving."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1000, help="Products per pipeline")
+
+    def handle(self, *args, **options):
+        rebuild_search_index(options["batch"])
+        self.stdout.write(f"indexed: {r.hlen(TOKENS_KEY)} products")
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    # Same walk as inventory.tree.rebuild_paths, on the historical model
+    Category = apps.get_model("inventory", "Category")
+    children = {}
+    for category_id, parent_id in Category.objects.values_list("id", "parent_id"):
+        children.setdefault(parent_id, []).append(category_id)
+
+    categories = []
+    # Roots are level 1, as in the seed data
+    stack = [(category_id, "", 1) for category_id in children.get(None, [])]
+    while stack:
+        category_id, parent_path, level = stack.pop()
+        path = f"{parent_path}{category_id}/"
+        categories.append(Category(id=category_id, path=path, level=level))
+        stack.extend((child, path, level + 1) for child in children.get(category_id, []))
+    Category.objects.bulk_update(categories, ["path", "level"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_product_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,9 @@ class Category(models.Model):
     slug = models.SlugField(max_length=55, unique=True)
     is_active = models.BooleanField(default=False)
     level = models.SmallIntegerField(default=0)
+    # Ids from the root down to this category, each followed by "/"
+    # ("1/4/9/"), maintained on save. See tree.py.
+    path = models.CharField(max_length=255, default="", db_index=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -26,6 +29,29 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # NULL: stock isn't tracked. Carts reserve units in Redis, see stock.py;
+    # reserved is the count written back by reconcile_stock.
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Catalog snapshot loads (id__in=..., is_active=True) answered
+            # from the index alone
+            models.Index(
+                fields=["id"],
+                include=["name", "price", "category"],
+                condition=models.Q(is_active=True),
+                name="product_active_snapshot_idx",
+            ),
+            # Active products of a category, in keyset (id) order
+            models.Index(
+                fields=["category", "id"],
+                include=["name", "price"],
+                condition=models.Q(is_active=True),
+                name="product_active_category_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -0,0 +1,35 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination on the primary key: ?after=<last id>&limit=<n>.
+
+    Each page is an indexed range scan (id > after ORDER BY id LIMIT n), so
+    the cost doesn't grow with how deep the client has paged.
+    """
+
+    page_size = 50
+    max_page_size = 200
+
+    def get_params(self, request):
+        try:
+            after = max(int(request.query_params.get("after", 0)), 0)
+        except ValueError:
+            after = 0
+        try:
+            limit = int(request.query_params.get("limit", self.page_size))
+        except ValueError:
+            limit = self.page_size
+        return after, min(max(limit, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        after, limit = self.get_params(request)
+        # Fetch one extra row to know whether there is a next page
+        page = list(queryset.filter(id__gt=after).order_by("id")[: limit + 1])
+        self.next_after = page[limit - 1]["id"] if len(page) > limit else None
+        return page[:limit]
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.next_after, "results": data})
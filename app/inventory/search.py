@@ -0,0 +1,176 @@
+# search.py
+#
+# Typeahead over product names, kept in Redis so a query is one lex range
+# read (plus a ZLEXCOUNT per word for multi-word queries) and the catalog
+# snapshots, whatever the catalog size.
+#
+#   search:terms   zset  "<token>:<product_id>", all with score 0; the
+#                        ZRANGE BYLEX range [prefix .. [prefix\xff lists the
+#                        products with a name word starting with prefix
+#   search:tokens  hash  product_id -> the tokens it is indexed under, so a
+#                        rename or deactivation removes exactly those
+#
+# Tokens are the lowercased, accent-folded words of Product.name. Only active
+# products are indexed. The Product save/delete signals keep the index
+# current (after commit), import_catalog reindexes what it changed and
+# rebuild_search_index rebuilds it from Postgres. In cluster mode both keys
+# share the {search} hash tag.
+import re
+import unicodedata
+
+from core.redis_client import get_redis, get_replica_redis, hash_tag
+
+from .catalog import get_products
+from .models import Product
+
+r = get_redis()
+replica = get_replica_redis()
+
+TERMS_KEY = f"{hash_tag('search')}:terms"
+TOKENS_KEY = f"{hash_tag('search')}:tokens"
+
+# Index entries read per query. The other words of a query only filter
+# these, so when every word is very common, matches past this many are missed.
+MAX_CANDIDATES = 500
+
+# KEYS = terms, tokens. ARGV = product_id, then its tokens (none to unindex)
+INDEX_PRODUCT = """
+local pid = ARGV[1]
+local old = redis.call('HGET', KEYS[2], pid)
+if old then
+    for token in string.gmatch(old, '%S+') do
+        redis.call('ZREM', KEYS[1], token .. ':' .. pid)
+    end
+end
+if #ARGV == 1 then
+    redis.call('HDEL', KEYS[2], pid)
+    return 0
+end
+local tokens = {}
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], 0, ARGV[i] .. ':' .. pid)
+    tokens[#tokens + 1] = ARGV[i]
+end
+redis.call('HSET', KEYS[2], pid, table.concat(tokens, ' '))
+return #tokens
+"""
+
+_index_product = r.register_script(INDEX_PRODUCT)
+
+
+def tokenize(text):
+    """The distinct lowercased, accent-folded words of text, in order."""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return list(dict.fromkeys(re.findall(r"\w+", folded)))
+
+
+def _index(product_id, name, is_active, client=None):
+    tokens = tokenize(name) if is_active else []
+    _index_product(keys=[TERMS_KEY, TOKENS_KEY], args=[product_id, *tokens], client=client)
+
+
+def index_product(product):
+    _index(product.id, product.name, product.is_active)
+
+
+def unindex_product(product_id):
+    _index(product_id, "", False)
+
+
+def index_many(rows):
+    """Index (product_id, name, is_active) rows in one pipeline."""
+    pipe = r.pipeline(transaction=False)
+    for product_id, name, is_active in rows:
+        _index(product_id, name, is_active, client=pipe)
+    pipe.execute()
+
+
+def index_products(product_ids):
+    """Reindex the given products from Postgres; ids that are gone are unindexed."""
+    rows = dict.fromkeys(product_ids, ("", False))
+    for product_id, name, is_active in Product.objects.filter(
+        id__in=product_ids
+    ).values_list("id", "name", "is_active"):
+        rows[product_id] = (name, is_active)
+    index_many((product_id, *row) for product_id, row in rows.items())
+
+
+def rebuild_search_index(batch_size=1000):
+    """Reindex every product, then drop the entries of deleted ones."""
+    rows = Product.objects.values_list("id", "name", "is_active").iterator(
+        chunk_size=batch_size
+    )
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            index_many(batch)
+            batch = []
+    index_many(batch)
+
+    indexed = []
+    for product_id, _ in r.hscan_iter(TOKENS_KEY, count=batch_size):
+        indexed.append(int(product_id))
+        if len(indexed) == batch_size:
+            _drop_deleted(indexed)
+            indexed = []
+    _drop_deleted(indexed)
+
+
+def _drop_deleted(product_ids):
+    existing = set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+    index_many((pid, "", False) for pid in product_ids if pid not in existing)
+
+
+def _matches(name, words):
+    tokens = tokenize(name)
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+def search(query, limit=10):
+    """
+    Active products with a name word starting with each word of the query,
+    as {"id", "name", "price"} dicts ordered by the matched word.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+    # Read the range of the rarest word; the others are checked against the
+    # names
+    ranges = [(b"[" + word.encode(), b"[" + word.encode() + b"\xff") for word in words]
+    low, high = ranges[0]
+    if len(ranges) > 1:
+        pipe = replica.pipeline(transaction=False)
+        for word_low, word_high in ranges:
+            pipe.zlexcount(TERMS_KEY, word_low, word_high)
+        counts = pipe.execute()
+        if not min(counts):
+            return []
+        low, high = ranges[counts.index(min(counts))]
+    # Read the range in growing pages: a single word query needs little more
+    # than `limit` entries, a filtered one may need many
+    results, seen = [], set()
+    offset, page = 0, limit * 2
+    while len(results) < limit and offset < MAX_CANDIDATES:
+        page = min(page, MAX_CANDIDATES - offset)
+        members = replica.zrange(TERMS_KEY, low, high, bylex=True, offset=offset, num=page)
+        product_ids = [
+            pid
+            for pid in dict.fromkeys(int(member.rsplit(":", 1)[1]) for member in members)
+            if pid not in seen
+        ]
+        seen.update(product_ids)
+        products = get_products(product_ids)
+        for pid in product_ids:
+            product = products.get(pid)
+            if product is None:
+                continue
+            if _matches(product["name"], words):
+                results.append({"id": pid, "name": product["name"], "price": product["price"]})
+                if len(results) == limit:
+                    break
+        if len(members) < page:
+            break
+        offset, page = offset + page, page * 2
+    return results
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version, cache_product, evict_product
+from .models import Category, Product
+from .search import index_product, unindex_product
+from .stock import sync_stock
+from .tree import check_move, update_path
+
+
+# Keep the shared catalog snapshot in step with Postgres. Deferred to commit
+# so a rolled back save never reaches Redis.
+@receiver(post_save, sender=Product)
+def refresh_cached_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: cache_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def evict_cached_product(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: evict_product(product_id))
+
+
+@receiver(post_save, sender=Product)
+def refresh_search_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: unindex_product(product_id))
+
+
+@receiver(post_save, sender=Product)
+def refresh_stock(sender, instance, **kwargs):
+    product_id, stock = instance.id, instance.stock
+    transaction.on_commit(lambda: sync_stock(product_id, stock))
+
+
+@receiver(post_delete, sender=Product)
+def untrack_stock(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: sync_stock(product_id, None))
+
+
+# Category paths are part of the row, so they are updated in the same
+# transaction as the save
+@receiver(pre_save, sender=Category)
+def refuse_cycles(sender, instance, **kwargs):
+    check_move(instance)
+
+
+@receiver(post_save, sender=Category)
+def materialize_path(sender, instance, **kwargs):
+    update_path(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_pages(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
@@ -0,0 +1,77 @@
+# stock.py
+#
+# Stock reservations. Product.stock is mirrored into Redis so carts reserve
+# units atomically inside their own scripts (cart.lua_scripts), without a
+# Postgres row lock on every click.
+#
+#   stock:available    hash  product_id -> units left (stock - reserved)
+#   stock:reserved     hash  product_id -> units held by carts
+#   stock:holds:{sid}  hash  product_id -> units held by one cart; no TTL, so
+#                            the units can still be given back after the
+#                            cart itself expired
+#   stock:holders      set   session ids with holds
+#
+# Products with stock = NULL aren't tracked: they have no stock:available
+# entry and can always be added. The reconcile_stock command pushes Postgres
+# stock into Redis and writes the reserved counts back to Product.reserved.
+from django.conf import settings
+
+from core.redis_client import get_redis, hash_tag
+
+r = get_redis()
+
+AVAILABLE_KEY = "stock:available"
+RESERVED_KEY = "stock:reserved"
+HOLDERS_KEY = "stock:holders"
+
+# KEYS = available, reserved. ARGV = product_id, stock ('' when untracked)
+# pairs. Recomputed from the reserved count inside the script so a
+# reservation running at the same time can't be lost.
+SYNC_STOCK = """
+for i = 1, #ARGV, 2 do
+    local pid, stock = ARGV[i], ARGV[i + 1]
+    if stock == '' then
+        redis.call('HDEL', KEYS[1], pid)
+    else
+        local reserved = tonumber(redis.call('HGET', KEYS[2], pid) or 0)
+        redis.call('HSET', KEYS[1], pid, tonumber(stock) - reserved)
+    end
+end
+return #ARGV / 2
+"""
+
+_sync_stock = r.register_script(SYNC_STOCK)
+
+
+def holds_key(session_id):
+    return f"stock:holds:{hash_tag(session_id)}"
+
+
+def stock_keys(session_id):
+    """Keys the cart scripts need to hold stock for a cart."""
+    return [holds_key(session_id), AVAILABLE_KEY, RESERVED_KEY, HOLDERS_KEY]
+
+
+def _sync(rows):
+    args = []
+    for product_id, stock in rows:
+        args += [product_id, "" if stock is None else stock]
+    if args:
+        _sync_stock(keys=[AVAILABLE_KEY, RESERVED_KEY], args=args)
+
+
+def sync_stock(product_id, stock):
+    if settings.STOCK_RESERVATIONS:
+        _sync([(product_id, stock)])
+
+
+def sync_many(rows):
+    """Push (product_id, stock) pairs to Redis, one script call for them all."""
+    if settings.STOCK_RESERVATIONS:
+        _sync(rows)
+
+
+def iter_reserved(batch_size):
+    """Yield (product_id, reserved units) from stock:reserved, HSCAN batched."""
+    for pid, reserved in r.hscan_iter(RESERVED_KEY, count=batch_size):
+        yield int(pid), max(int(reserved), 0)
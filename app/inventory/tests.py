@@ -1,3 +1,284 @@
-from django.test import TestCase
+import io
+import json
+import random
+import unittest
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from core.redis_client import get_redis
+
+from .bulk import export_catalog, import_catalog
+from .catalog import snapshot_rows
+from .search import search
+from .models import Category, Product
+from .tree import rebuild_paths, subtree_products
+
+
+def _scans(plan):
+    yield plan["Node Type"], plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+def _plan(queryset):
+    return set(_scans(json.loads(queryset.explain(format="json"))[0]["Plan"]))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "EXPLAIN output is PostgreSQL's")
+class HotQueryPlanTests(TransactionTestCase):
+    """The hot catalog queries are answered from the indexes alone."""
+
+    def setUp(self):
+        categories = Category.objects.bulk_create(
+            Category(name=f"Plan category {i}", slug=f"plan-category-{i}", is_active=True)
+            for i in range(100)
+        )
+        rebuild_paths()
+        # Rows land in the heap in random id order, as they end up after a
+        # catalog has seen updates; a heap in id order makes every id lookup
+        # look cheap enough through the primary key
+        product_ids = list(range(1, 10_001))
+        random.Random(0).shuffle(product_ids)
+        Product.objects.bulk_create(
+            Product(
+                id=i,
+                category=categories[i % len(categories)],
+                name=f"Plan product {i}",
+                slug=f"plan-product-{i}",
+                price="9.99",
+                is_active=i % 10 != 0,
+            )
+            for i in product_ids
+        )
+        # Index-only scans need an up to date visibility map; VACUUM can't
+        # run in a transaction, hence TransactionTestCase
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE inventory_category")
+            cursor.execute("VACUUM ANALYZE inventory_product")
+        self.category = Category.objects.get(slug="plan-category-7")
+
+    def test_snapshot_load_is_index_only(self):
+        product_ids = list(range(1, 51))
+        self.assertIn(
+            ("Index Only Scan", "product_active_snapshot_idx"),
+            _plan(snapshot_rows(product_ids)),
+        )
+
+    def test_category_listing_is_index_only(self):
+        # The page query of CategoryProductListAPIView
+        page = subtree_products(self.category.path).filter(id__gt=0).order_by("id")[:51]
+        self.assertIn(("Index Only Scan", "product_active_category_idx"), _plan(page))
+
+
+CATEGORIES_CSV = b"""id,parent_id,name,slug,is_active,level
+1,,Books,books,true,1
+2,1,Fiction,fiction,true,2
+"""
+
+PRODUCTS_CSV = b"""id,category_id,name,slug,is_active,price,stock
+1,2,Novel,novel,true,9.99,5
+2,1,Atlas,atlas,false,19.99,
+"""
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "COPY is PostgreSQL's")
+class CatalogCopyTests(TestCase):
+    def setUp(self):
+        import_catalog(io.BytesIO(CATEGORIES_CSV), io.BytesIO(PRODUCTS_CSV))
+
+    def test_import_upserts_and_derives_paths(self):
+        self.assertEqual(Category.objects.get(slug="fiction").path, "1/2/")
+        self.assertEqual(Product.objects.get(slug="novel").reserved, 0)
+
+        changed = PRODUCTS_CSV.replace(b",9.99,", b",8.99,")
+        counts = import_catalog(io.BytesIO(CATEGORIES_CSV), io.BytesIO(changed))
+        self.assertEqual(counts, {"categories": 0, "products": 1})
+        self.assertEqual(str(Product.objects.get(slug="novel").price), "8.99")
+
+    def test_export_round_trips(self):
+        for fmt in ("csv", "jsonl"):
+            categories, products = io.BytesIO(), io.BytesIO()
+            export_catalog(Category, categories, fmt)
+            export_catalog(Product, products, fmt)
+            categories.seek(0)
+            products.seek(0)
+            counts = import_catalog(categories, products, fmt)
+            self.assertEqual(counts, {"categories": 0, "products": 0})
+
+    def test_unknown_columns_are_refused(self):
+        with self.assertRaises(ValueError):
+            import_catalog(products=io.BytesIO(b"id,colour\n1,red\n"))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Audio", slug="audio", is_active=True)
+
+    def _save(self, product):
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+    def _names(self, query):
+        return [result["name"] for result in search(query)]
+
+    def test_saves_keep_the_index_current(self):
+        product = Product(
+            category=self.category,
+            name="Wireless Héadphones",
+            slug="wireless-headphones",
+            price="9.99",
+            is_active=True,
+        )
+        self._save(product)
+        self.assertEqual(self._names("head wire"), ["Wireless Héadphones"])
+        self.assertEqual(self._names("wired"), [])
+
+        product.name = "Studio Monitors"
+        self._save(product)
+        self.assertEqual(self._names("wire"), [])
+        self.assertEqual(self._names("STUD"), ["Studio Monitors"])
+
+        product.is_active = False
+        self._save(product)
+        self.assertEqual(self._names("stud"), [])
+
+
+class ProductListTests(TestCase):
+    def setUp(self):
+        get_redis().flushall()
+        category = Category.objects.create(name="Audio", slug="audio", is_active=True)
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f"Product {i}",
+                slug=f"product-{i}",
+                price="9.99",
+                is_active=i != 2,
+            )
+            for i in range(4)
+        ]
+
+    def _get(self, etag=None, **params):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/api/products/", params, **headers)
+
+    def test_pages_list_active_products(self):
+        response = self._get(limit=2)
+        self.assertEqual(
+            [product["name"] for product in response.json()["results"]],
+            ["Product 0", "Product 1"],
+        )
+        after = response.json()["next"]
+        response = self._get(after=after, limit=2)
+        self.assertEqual(
+            [product["name"] for product in response.json()["results"]], ["Product 3"]
+        )
+        self.assertIsNone(response.json()["next"])
+
+    def test_unchanged_pages_are_not_modified(self):
+        etag = self._get()["ETag"]
+        response = self._get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self._get('"other"').status_code, 200)
+
+    def test_changes_invalidate_the_pages(self):
+        etag = self._get()["ETag"]
+        product = self.products[0]
+        product.name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self._get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["results"][0]["name"], "Renamed")
+
+    def test_etags_survive_a_redis_reset(self):
+        etag = self._get()["ETag"]
+        get_redis().flushall()
+        self.assertEqual(self._get(etag).status_code, 304)
+
+        # The version counter starts over, a changed page gets a new ETag
+        Product.objects.filter(pk=self.products[0].pk).update(name="Renamed")
+        get_redis().flushall()
+        response = self._get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["name"], "Renamed")
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.electronics = Category.objects.create(
+            name="Electronics", slug="electronics", is_active=True
+        )
+        self.audio = Category.objects.create(
+            name="Audio", slug="audio", parent=self.electronics, is_active=True
+        )
+        self.headphones = Category.objects.create(
+            name="Headphones", slug="headphones", parent=self.audio, is_active=True
+        )
+        self.books = Category.objects.create(name="Books", slug="books", is_active=True)
+        for name, category, is_active in (
+            ("Amp", self.audio, True),
+            ("Earbuds", self.headphones, True),
+            ("Old earbuds", self.headphones, False),
+            ("Radio", self.electronics, True),
+            ("Novel", self.books, True),
+        ):
+            Product.objects.create(
+                category=category,
+                name=name,
+                slug=name.lower().replace(" ", "-"),
+                price="9.99",
+                is_active=is_active,
+            )
+
+    def _crumbs(self, slug):
+        response = self.client.get(f"/api/categories/{slug}/breadcrumbs/")
+        return [crumb["slug"] for crumb in response.json()]
+
+    def _products(self, slug, **params):
+        return self.client.get(f"/api/categories/{slug}/products/", params).json()
+
+    def test_paths(self):
+        e, a, h = self.electronics.pk, self.audio.pk, self.headphones.pk
+        self.headphones.refresh_from_db()
+        self.assertEqual((self.headphones.path, self.headphones.level), (f"{e}/{a}/{h}/", 3))
+
+    def test_breadcrumbs(self):
+        self.assertEqual(self._crumbs("headphones"), ["electronics", "audio", "headphones"])
+        self.assertEqual(self._crumbs("books"), ["books"])
+        response = self.client.get("/api/categories/nope/breadcrumbs/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_subtree_products(self):
+        page = self._products("audio")
+        self.assertEqual([product["name"] for product in page["results"]], ["Amp", "Earbuds"])
+        self.assertIsNone(page["next"])
+
+        page = self._products("electronics", limit=2)
+        self.assertEqual([product["name"] for product in page["results"]], ["Amp", "Earbuds"])
+        page = self._products("electronics", limit=2, after=page["next"])
+        self.assertEqual([product["name"] for product in page["results"]], ["Radio"])
+        response = self.client.get("/api/categories/nope/products/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_moves_carry_the_subtree(self):
+        self.audio.parent = self.books
+        self.audio.save()
+        self.assertEqual(self._crumbs("headphones"), ["books", "audio", "headphones"])
+        names = [product["name"] for product in self._products("books")["results"]]
+        self.assertEqual(names, ["Amp", "Earbuds", "Novel"])
+
+        self.audio.parent = self.headphones
+        with self.assertRaises(ValueError):
+            self.audio.save()
+
+    def test_rebuild_paths(self):
+        Category.objects.update(path="", level=0)
+        self.assertEqual(rebuild_paths(), 4)
+        self.assertEqual(self._crumbs("headphones"), ["electronics", "audio", "headphones"])
+        rows = subtree_products(Category.objects.get(slug="audio").path)
+        self.assertEqual(sorted(row["name"] for row in rows), ["Amp", "Earbuds"])
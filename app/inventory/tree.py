@@ -0,0 +1,82 @@
+# tree.py
+#
+# Category tree. Category.path materializes each category's ancestry: the
+# ids from the root down to it, each followed by "/" ("1/4/9/"), so
+#
+#   subtree    path LIKE '1/4/%'  one range scan on the path index
+#   ancestors  the ids in the path, one primary key lookup
+#
+# The path and level (the path's length, 1 for a root category, as in the
+# seed data) of a category are set by the Category save signal, and
+# moving a category rewrites its whole subtree in one UPDATE. Rows written
+# around the ORM (bulk loads) are fixed up by rebuild_paths().
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from .models import Category, Product
+
+
+def path_of(parent_path, category_id):
+    return f"{parent_path}{category_id}/"
+
+
+def ancestor_ids(path):
+    return [int(category_id) for category_id in path.split("/") if category_id]
+
+
+def subtree_products(path):
+    """Active products of the categories under path, as id/name/price rows."""
+    return Product.objects.filter(
+        category__path__startswith=path, is_active=True
+    ).values("id", "name", "price")
+
+
+def check_move(category):
+    """Refuse to move a category under one of its own descendants."""
+    if category.pk is None or category.parent_id is None:
+        return
+    parent_path = Category.objects.values_list("path", flat=True).get(
+        id=category.parent_id
+    )
+    if category.pk in ancestor_ids(parent_path):
+        raise ValueError("A category can't be moved under its own subtree.")
+
+
+def update_path(category):
+    """Recompute the path and level of a saved category and its subtree."""
+    ids = [category.pk] + ([category.parent_id] if category.parent_id else [])
+    paths = dict(Category.objects.filter(id__in=ids).values_list("id", "path"))
+    old = paths[category.pk]
+    new = path_of(paths.get(category.parent_id, ""), category.pk)
+    level = len(ancestor_ids(new))
+    if new != old:
+        if old:
+            # The subtree keeps its shape under the new prefix
+            Category.objects.filter(path__startswith=old).update(
+                path=Concat(Value(new), Substr("path", len(old) + 1)),
+                level=F("level") + level - len(ancestor_ids(old)),
+            )
+        else:
+            Category.objects.filter(id=category.pk).update(path=new, level=level)
+    category.path, category.level = new, level
+
+
+def rebuild_paths(batch_size=1000):
+    """Recompute every path and level top down. Returns the rows changed."""
+    rows = Category.objects.values_list("id", "parent_id", "path", "level")
+    children, current = {}, {}
+    for category_id, parent_id, path, level in rows:
+        children.setdefault(parent_id, []).append(category_id)
+        current[category_id] = (path, level)
+
+    changed = []
+    stack = [(category_id, "") for category_id in children.get(None, [])]
+    while stack:
+        category_id, parent_path = stack.pop()
+        path = path_of(parent_path, category_id)
+        level = len(ancestor_ids(path))
+        if current[category_id] != (path, level):
+            changed.append(Category(id=category_id, path=path, level=level))
+        stack.extend((child, path) for child in children.get(category_id, []))
+    Category.objects.bulk_update(changed, ["path", "level"], batch_size=batch_size)
+    return len(changed)
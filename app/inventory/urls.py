@@ -1,4 +1,22 @@
 from django.urls import path
-from .views import ProductListAPIView
+from .views import (
+    CategoryBreadcrumbsAPIView,
+    CategoryProductListAPIView,
+    ProductListAPIView,
+    ProductSearchAPIView,
+)
 
-urlpatterns = [path("products/", ProductListAPIView.as_view(), name="product-list")]
+urlpatterns = [
+    path("products/", ProductListAPIView.as_view(), name="product-list"),
+    path("products/search/", ProductSearchAPIView.as_view(), name="product-search"),
+    path(
+        "categories/<slug:slug>/products/",
+        CategoryProductListAPIView.as_view(),
+        name="category-products",
+    ),
+    path(
+        "categories/<slug:slug>/breadcrumbs/",
+        CategoryBreadcrumbsAPIView.as_view(),
+        name="category-breadcrumbs",
+    ),
+]
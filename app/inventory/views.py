@@ -1,13 +1,125 @@
-from django.shortcuts import render
-from rest_framework.views import APIView
+import hashlib
+
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.response import Response
-from .models import Product
-from .serializer import ProductSerializer
+from rest_framework.views import APIView
+
+from core.redis_client import get_redis
+from core.renderers import ORJSONRenderer
+
+from .catalog import get_catalog_version
+from .models import Category, Product
+from .pagination import KeysetPagination
+from .search import search
+from .serializer import CategorySerializer, ProductSerializer
+from .tree import ancestor_ids, subtree_products
+
+r = get_redis()
+
+CATALOG_PAGE_TTL = 60 * 5  # 5 minutes
 
 
-# Create your views here.
 class ProductListAPIView(APIView):
-    def get(self, _):
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+    """
+    Catalog pages are cached in Redis under the current catalog version, so a
+    Product/Category change invalidates every page at once by bumping it.
+
+    The ETag is a hash of the page body, stored with it, so a conditional
+    request is answered with a 304 after a single Redis read, and a reset
+    version counter (Redis flush or restart) can't revive an old ETag.
+    """
+
+    pagination_class = KeysetPagination
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("after", int, description="Last product id of the previous page"),
+            OpenApiParameter("limit", int, description="Products per page, at most 200"),
+        ],
+        responses={200: ProductSerializer(many=True)},
+    )
+    def get(self, request):
+        paginator = self.pagination_class()
+        after, limit = paginator.get_params(request)
+        version = get_catalog_version()
+
+        cache_key = f"catalog:page:v{version}:after={after}:limit={limit}"
+        etag, body = r.hmget(cache_key, "etag", "body")
+
+        if body is None:
+            products = Product.objects.filter(is_active=True).values("id", "name", "price")
+            page = paginator.paginate_queryset(products, request, view=self)
+            serializer = ProductSerializer(page, many=True)
+            data = paginator.get_paginated_response(serializer.data).data
+            body = ORJSONRenderer().render(data)
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(cache_key, mapping={"etag": etag, "body": body})
+            pipe.expire(cache_key, CATALOG_PAGE_TTL)
+            pipe.execute()
+
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        return response
+
+
+class ProductSearchAPIView(APIView):
+    """
+    Typeahead: ?q=<words>&limit=<n>. Active products with a name word
+    starting with every word of q, from the Redis prefix index (search.py),
+    without touching Postgres.
+    """
+
+    max_limit = 50
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("q", str, description="Words or word prefixes"),
+            OpenApiParameter("limit", int, description="Results, at most 50"),
+        ],
+        responses={200: ProductSerializer(many=True)},
+    )
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        limit = min(max(limit, 1), self.max_limit)
+        results = search(request.query_params.get("q", ""), limit)
+        return Response(ProductSerializer(results, many=True).data)
+
+
+class CategoryProductListAPIView(APIView):
+    """
+    Active products anywhere under a category. The subtree is a prefix scan
+    on Category.path, joined to the products in one query and keyset
+    paginated like the product list.
+    """
+
+    pagination_class = KeysetPagination
+
+    @extend_schema(responses={200: ProductSerializer(many=True)})
+    def get(self, request, slug):
+        path = get_object_or_404(Category.objects.values_list("path", flat=True), slug=slug)
+        products = subtree_products(path)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = ProductSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class CategoryBreadcrumbsAPIView(APIView):
+    """The categories from the root down to this one, by primary key."""
+
+    @extend_schema(responses={200: CategorySerializer(many=True)})
+    def get(self, request, slug):
+        path = get_object_or_404(Category.objects.values_list("path", flat=True), slug=slug)
+        crumbs = Category.objects.filter(id__in=ancestor_ids(path)).order_by("level")
+        return Response(CategorySerializer(crumbs, many=True).data)